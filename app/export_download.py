@@ -0,0 +1,87 @@
+"""
+Botão de exportação do resultado completo de uma consulta (XLSX, CSV ou Parquet).
+
+O arquivo é gerado sob demanda em data/exports (EXPORT_DIR), lendo o banco em blocos com cursor do
+lado do servidor (db.streaming) e gravando bloco a bloco (extractor.exporter): nem o resultado
+nem o arquivo são montados em memória durante a geração. O arquivo pronto é entregue pelo
+st.download_button e os arquivos antigos do diretório são removidos (EXPORT_MAX_AGE_HOURS).
+"""
+import os
+import time
+from pathlib import Path
+
+import streamlit as st
+from settings import PROJECT_ROOT
+
+
+EXPORT_DIR = os.getenv('EXPORT_DIR') or os.path.join(PROJECT_ROOT, 'data', 'exports')
+EXPORT_MAX_AGE_HOURS = float(os.getenv('EXPORT_MAX_AGE_HOURS') or 24)
+
+FORMAT_LABELS = {
+    'xlsx': 'Excel (XLSX)',
+    'csv': 'CSV',
+    'parquet': 'Parquet',
+}
+
+
+def _cleanup(directory):
+    '''Remove exportações mais antigas que EXPORT_MAX_AGE_HOURS'''
+    limit = time.time() - EXPORT_MAX_AGE_HOURS * 3600
+    for path in directory.iterdir():
+        try:
+            if path.stat().st_mtime < limit:
+                path.unlink()
+        except OSError:
+            pass
+
+
+def export_download(key, source, file_name, filters=None):
+    '''
+    Seletor de formato, botão para gerar o arquivo e botão de download.
+
+    source é uma função sem argumentos que devolve o iterável de blocos (DataFrames) ou de
+    dicionários a exportar; só é chamada quando o usuário pede a geração do arquivo.
+    file_name é o nome do arquivo sem extensão; filters identifica a consulta (um arquivo gerado
+    para outros filtros deixa de ser oferecido).
+    '''
+    from extractor.exporter import export_rows, EXPORT_FORMATS
+
+    if st.session_state.get(f'{key}_filters') != filters:
+        st.session_state[f'{key}_filters'] = filters
+        st.session_state.pop(f'{key}_export', None)
+
+    col_format, col_generate, col_download = st.columns([2, 1, 1])
+    with col_format:
+        fmt = st.selectbox(
+            "Formato da exportação",
+            options=list(FORMAT_LABELS),
+            format_func=FORMAT_LABELS.get,
+            key=f'{key}_format',
+            label_visibility='collapsed'
+        )
+
+    with col_generate:
+        if st.button("📦 Gerar arquivo", key=f'{key}_generate', use_container_width=True):
+            directory = Path(EXPORT_DIR)
+            directory.mkdir(parents=True, exist_ok=True)
+            _cleanup(directory)
+
+            path = directory / f"{file_name}_{int(time.time())}.{fmt}"
+            with st.spinner('Gerando arquivo...'):
+                total = export_rows(source(), path, fmt)
+            st.session_state[f'{key}_export'] = (str(path), fmt, total)
+
+    export = st.session_state.get(f'{key}_export')
+    if export and os.path.exists(export[0]):
+        path, fmt, total = export
+        with col_download:
+            with open(path, 'rb') as handle:
+                st.download_button(
+                    f"⬇️ Baixar ({total:,} linhas)",
+                    data=handle,
+                    file_name=f"{file_name}.{fmt}",
+                    mime=EXPORT_FORMATS[fmt],
+                    key=f'{key}_download',
+                    on_click='ignore',
+                    use_container_width=True
+                )
@@ -11,6 +11,7 @@ pages = {
     "Administração": [
         st.Page("pages/adm/config.py", title="Configurações", default=True),
         st.Page("pages/adm/gerenciar_pacotes.py", title="Gerenciar Pacotes"),
+        st.Page("pages/adm/enriquecimento.py", title="Enriquecimento de IPs"),
     ],
     "Dashboard": [
         st.Page("pages/dashboard/dashboard.py", title="Dashboard"),
@@ -0,0 +1,99 @@
+"""
+Cache em disco dos mapas renderizados da página GeoIP.
+
+O HTML do mapa folium de um telefone é gravado em data/map_cache (MAP_CACHE_DIR), em um arquivo
+por impressão digital da consulta: (operação, versão dos dados, telefone, período, área e opções
+de renderização). Como a versão muda sempre que os dados da operação mudam, uma entrada nunca fica
+desatualizada; as antigas apenas deixam de ser lidas e saem pelo LRU.
+
+O LRU usa a data de modificação dos arquivos (atualizada a cada leitura) e é limitado por
+quantidade de entradas (MAP_CACHE_MAX_ENTRIES) e por tamanho total (MAP_CACHE_MAX_MB). O
+diretório é compartilhado entre processos e analistas, e sobrevive a reinícios da aplicação.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from settings import PROJECT_ROOT
+
+
+MAP_CACHE_DIR = os.getenv('MAP_CACHE_DIR') or os.path.join(PROJECT_ROOT, 'data', 'map_cache')
+MAP_CACHE_MAX_ENTRIES = int(os.getenv('MAP_CACHE_MAX_ENTRIES') or 200)
+MAP_CACHE_MAX_MB = int(os.getenv('MAP_CACHE_MAX_MB') or 200)
+
+
+class MapCache:
+    """Armazenamento LRU em disco de artefatos de texto (HTML/JSON) por impressão digital."""
+
+    def __init__(self, directory=MAP_CACHE_DIR, max_entries=MAP_CACHE_MAX_ENTRIES, max_bytes=MAP_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def fingerprint(**parts):
+        '''Impressão digital estável dos parâmetros da consulta e da renderização'''
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key, suffix):
+        return self.directory / f"{key}{suffix}"
+
+    def get(self, key, suffix='.html'):
+        '''Retorna o artefato armazenado (None se ausente), marcando-o como usado recentemente'''
+        path = self._path(key, suffix)
+        try:
+            content = path.read_text(encoding='utf-8')
+            os.utime(path)
+            return content
+        except OSError:
+            return None
+
+    def put(self, key, content, suffix='.html'):
+        '''Grava o artefato (escrita atômica: arquivo temporário + rename) e aplica os limites do LRU'''
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(key, suffix)
+            temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            temp_path.write_text(content, encoding='utf-8')
+            os.replace(temp_path, path)
+            self.evict()
+        except OSError as e:
+            print(f"⚠️ Erro ao gravar mapa em cache: {e}")
+
+    def evict(self):
+        '''Remove as entradas usadas há mais tempo até respeitar os limites de quantidade e tamanho'''
+        entries = []
+        for path in self.directory.iterdir():
+            if path.name.endswith('.tmp'):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort(reverse=True)
+        total_bytes = 0
+        for index, (_, size, path) in enumerate(entries):
+            total_bytes += size
+            if index >= self.max_entries or total_bytes > self.max_bytes:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def clear(self):
+        '''Remove todas as entradas'''
+        if not self.directory.exists():
+            return
+        for path in self.directory.iterdir():
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+# Instância única por processo
+map_cache = MapCache()
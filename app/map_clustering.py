@@ -0,0 +1,72 @@
+"""
+Agrupamento de pontos no servidor para o mapa WebGL (pydeck) da página GeoIP.
+
+Os IPs são distribuídos numa grade regular cujo tamanho de célula acompanha o nível de zoom
+(como os tiles do mapa: a cada nível a célula cai pela metade). Cada célula ocupada vira um único
+ponto, no centróide ponderado pelas mensagens, de modo que o navegador recebe no máximo algumas
+centenas de pontos mesmo com dezenas de milhares de IPs.
+"""
+import numpy as np
+import pandas as pd
+
+
+# Largura aproximada, em pixels, de uma célula da grade na tela
+CELL_PIXELS = 60
+
+# Tamanho do tile (pixels) usado pelos mapas web no zoom 0
+TILE_PIXELS = 256
+
+
+def cell_size_degrees(zoom, cell_pixels=CELL_PIXELS):
+    '''Tamanho da célula (graus) que ocupa cerca de cell_pixels na tela no zoom informado'''
+    return 360.0 * cell_pixels / (TILE_PIXELS * 2 ** max(0, float(zoom)))
+
+
+def cluster_points(ip_data, zoom):
+    '''
+    Agrupa o agregado por IP (lista de dicionários com latitude, longitude e message_count).
+
+    Retorna um DataFrame com uma linha por célula: cluster_id, latitude, longitude (centróide
+    ponderado), ip_count, message_count e label (o próprio IP quando a célula tem um só),
+    e o array cluster_of_ip com o cluster de cada IP da entrada (mesma ordem).
+    '''
+    if not ip_data:
+        return pd.DataFrame(columns=['cluster_id', 'latitude', 'longitude', 'ip_count', 'message_count', 'label']), np.array([], dtype=int)
+
+    latitude = np.fromiter((item['latitude'] for item in ip_data), dtype=float, count=len(ip_data))
+    longitude = np.fromiter((item['longitude'] for item in ip_data), dtype=float, count=len(ip_data))
+    weight = np.fromiter((item['message_count'] for item in ip_data), dtype=float, count=len(ip_data))
+
+    cell = cell_size_degrees(zoom)
+    row = np.floor((latitude + 90.0) / cell).astype(np.int64)
+    col = np.floor((longitude + 180.0) / cell).astype(np.int64)
+    columns = int(np.ceil(360.0 / cell)) + 1
+
+    cells, cluster_of_ip = np.unique(row * columns + col, return_inverse=True)
+    cluster_of_ip = cluster_of_ip.ravel()
+
+    messages = np.bincount(cluster_of_ip, weights=weight)
+    ip_count = np.bincount(cluster_of_ip)
+    # Centróide ponderado pelas mensagens (peso mínimo 1 para IPs sem mensagens no período)
+    safe_weight = np.maximum(weight, 1.0)
+    total_weight = np.bincount(cluster_of_ip, weights=safe_weight)
+    center_lat = np.bincount(cluster_of_ip, weights=latitude * safe_weight) / total_weight
+    center_lon = np.bincount(cluster_of_ip, weights=longitude * safe_weight) / total_weight
+
+    # Índice de um IP de cada célula (usado no rótulo das células com um único IP)
+    any_ip = np.zeros(len(cells), dtype=np.int64)
+    any_ip[cluster_of_ip] = np.arange(len(ip_data))
+    labels = [
+        ip_data[any_ip[index]]['sender_ip'] if ip_count[index] == 1 else f"{ip_count[index]} IPs"
+        for index in range(len(cells))
+    ]
+
+    clusters = pd.DataFrame({
+        'cluster_id': np.arange(len(cells)),
+        'latitude': center_lat,
+        'longitude': center_lon,
+        'ip_count': ip_count,
+        'message_count': messages.astype(np.int64),
+        'label': labels
+    })
+    return clusters, cluster_of_ip
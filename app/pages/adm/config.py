@@ -2,6 +2,7 @@ import streamlit as st
 from settings import PROJECT_ROOT, set_operacao, get_operacao, set_current_op_id
 from db.models import Operation
 from db.session import get_session
+from db.enrichment_queue import prioritize_operation
 import os
 
 
@@ -106,6 +107,9 @@ if st.session_state['modo_operacao'] == 'selecionar':
                     operacao_obj = next((op for op in operacoes_dict if op['name'] == operacao), None)
                     set_current_op_id(operacao_obj['id'])
 
+                    # IPs ainda não geolocalizados da operação passam à frente na fila de enriquecimento
+                    prioritize_operation(operacao_obj['id'])
+
                     st.session_state['operacao_definida'] = True
                     st.session_state['modo_operacao'] = None
                     st.toast('Operação selecionada com sucesso!', icon="✅")
@@ -0,0 +1,174 @@
+import streamlit as st
+from settings import PROJECT_ROOT
+from sqlalchemy import func
+from db.session import get_session
+from db.models import IP
+from extractor.enrichment_metrics import read_snapshot
+from datetime import datetime
+import os
+
+
+################  FUNÇÕES PARA CONSULTA  ###############
+################  FUNÇÕES PARA CONSULTA  ###############
+################  FUNÇÕES PARA CONSULTA  ###############
+
+def get_ips_by_status():
+    '''Quantidade de IPs por estado de enriquecimento (direto da tabela ips)'''
+    try:
+        with get_session() as session:
+            rows = session.query(
+                IP.enrichment_status,
+                func.count(IP.sender_ip)
+            ).group_by(IP.enrichment_status).all()
+            return {status: count for status, count in rows}
+    except Exception as e:
+        print(f"❌ Erro ao buscar estados dos IPs: {e}")
+        return {}
+
+
+def format_rate(value):
+    return f"{value * 100:.1f}%" if value is not None else "N/A"
+
+
+def format_seconds(value):
+    return f"{value:.2f}s" if value is not None else "N/A"
+
+
+################  LÓGICA SIDEBAR  ###############
+################  LÓGICA SIDEBAR  ###############
+################  LÓGICA SIDEBAR  ###############
+
+with st.sidebar:
+    st.markdown('''<style>
+    div[data-testid="stSidebarHeader"] > img,
+    div[data-testid="collapsedControl"] > img {
+        margin-top: 1rem;
+        height: 4rem;
+        width: auto;
+    }
+
+    @media (min-width: 769px) {
+        div[data-testid="stSidebarHeader"] > img,
+        div[data-testid="collapsedControl"] > img {
+            margin-top: 4rem !important;
+            height: 10rem !important;
+        }
+    }
+
+    nav[data-testid="stSidebarNav"] {
+        margin-top: 1rem !important;
+        position: relative !important;
+        z-index: 999 !important;
+    }
+    </style>''', unsafe_allow_html=True)
+    logo_path = os.path.join(PROJECT_ROOT, 'logo.png')
+    st.logo(image=logo_path, icon_image=logo_path, size="large")
+    st.write('')
+    st.write('')
+    st.header('Enriquecimento', divider='red')
+    if st.button("🔄 Atualizar", type="tertiary"):
+        st.rerun()
+
+
+################  ÁREA CENTRAL  ###############
+################  ÁREA CENTRAL  ###############
+################  ÁREA CENTRAL  ###############
+
+st.header("🌐 Enriquecimento de IPs", divider='red')
+
+# Fila (tempo real, pelo banco)
+st.subheader("📥 Fila de IPs")
+ips_by_status = get_ips_by_status()
+
+col1, col2, col3, col4 = st.columns(4)
+with col1:
+    st.metric("⏳ Pendentes", ips_by_status.get('PENDING', 0))
+with col2:
+    st.metric("🔁 Aguardando nova tentativa", ips_by_status.get('FAILED', 0))
+with col3:
+    st.metric("✅ Geolocalizados", ips_by_status.get('DONE', 0))
+with col4:
+    st.metric("🚫 Privados/Reservados/Inválidos",
+              sum(ips_by_status.get(status, 0) for status in ('PRIVATE', 'RESERVED', 'INVALID')))
+
+# Métricas do serviço (snapshot gravado pelo extractor.enrichment_daemon)
+st.divider()
+st.subheader("📈 Serviço de Enriquecimento")
+
+snapshot = read_snapshot()
+
+if not snapshot:
+    st.info("Nenhuma métrica disponível. Verifique se o serviço de enriquecimento "
+            "(`python -m extractor.enrichment_daemon`) está em execução.", icon="ℹ️")
+    st.stop()
+
+# pandas só é necessário para as tabelas das métricas do serviço
+import pandas as pd
+
+updated_at = datetime.fromtimestamp(snapshot['updated_at'])
+started_at = datetime.fromtimestamp(snapshot['started_at'])
+st.caption(f"Última atualização: {updated_at:%d/%m/%Y %H:%M:%S} · serviço em execução desde {started_at:%d/%m/%Y %H:%M:%S}")
+
+counters = snapshot['counters']
+gauges = snapshot['gauges']
+latency = snapshot['histograms']['api_latency_seconds']
+
+col1, col2, col3, col4 = st.columns(4)
+with col1:
+    st.metric("⚡ IPs/s (último minuto)", f"{snapshot['lookups_per_second']:.2f}")
+with col2:
+    st.metric("📥 Fila no último ciclo", gauges.get('pending_backlog') if gauges.get('pending_backlog') is not None else "N/A")
+with col3:
+    st.metric("🎫 Cota restante (X-Rl)", gauges.get('quota_remaining') if gauges.get('quota_remaining') is not None else "N/A")
+with col4:
+    st.metric("⏱️ Renovação da cota (X-Ttl)", f"{gauges['quota_reset_seconds']}s" if gauges.get('quota_reset_seconds') is not None else "N/A")
+
+col1, col2, col3, col4 = st.columns(4)
+with col1:
+    st.metric("🗄️ Acertos base offline", format_rate(snapshot['offline_hit_rate']))
+with col2:
+    st.metric("🧩 Acertos cache por prefixo", format_rate(snapshot['prefix_hit_rate']))
+with col3:
+    st.metric("📶 Latência API (p50)", format_seconds(latency['p50']))
+with col4:
+    st.metric("📶 Latência API (p95)", format_seconds(latency['p95']))
+
+col1, col2 = st.columns(2)
+
+with col1:
+    st.markdown("#### 🔢 Contadores")
+    labels = {
+        'api_requests': 'Requisições à API',
+        'api_errors': 'Requisições com erro',
+        'api_ips_sent': 'IPs enviados à API',
+        'ips_enriched': 'IPs geolocalizados',
+        'ips_failed': 'IPs reagendados (falha)',
+        'ips_final': 'IPs privados/reservados/inválidos',
+        'throttle_429': 'Respostas 429',
+        'throttle_waits': 'Esperas por cota',
+        'offline_hits': 'Acertos base offline',
+        'offline_misses': 'Falhas base offline',
+        'prefix_hits': 'Acertos cache por prefixo',
+        'prefix_misses': 'Falhas cache por prefixo',
+        'prefix_inherited': 'IPs herdados do representante',
+        'cycles': 'Ciclos executados',
+    }
+    df_counters = pd.DataFrame(
+        [(labels.get(name, name), value) for name, value in counters.items()],
+        columns=['Métrica', 'Valor']
+    )
+    st.dataframe(df_counters, hide_index=True, use_container_width=True)
+
+with col2:
+    st.markdown("#### 📶 Latência da API")
+    if latency['count']:
+        df_latency = pd.DataFrame(
+            list(latency['buckets'].items()),
+            columns=['Faixa (s)', 'Requisições']
+        ).set_index('Faixa (s)')
+        st.bar_chart(df_latency)
+    else:
+        st.info("Nenhuma requisição registrada.")
+
+    throttle = snapshot['histograms']['throttle_wait_seconds']
+    st.caption(f"Esperas por cota: {throttle['count']} · tempo médio {format_seconds(throttle['avg'])}")
@@ -1,14 +1,13 @@
 import streamlit as st
 from db.models import File, Target, Operation
 from db.session import get_session
-from db.queries import insert_groups_and_contacts, insert_target_into_targets, insert_data_into_files, insert_messages
+from db.operation_metrics import refresh_operation_metrics, update_operation_metrics
+from db.enrichment_queue import prioritize_operation
 from settings import get_operacao, PROJECT_ROOT
 from pathlib import Path
 import os, time
 import uuid
 import pandas as pd
-from extractor import get_account_data_from_buffer
-from extractor.ip_api_client import IPEnricher
 
 BASE_DIR = Path(__file__).absolute().parent.parent.parent.parent
 
@@ -17,9 +16,13 @@ BASE_DIR = Path(__file__).absolute().parent.parent.parent.parent
 ################## FUNÇÕES DE PROCESSAMENTO ##################
 
 def processar_arquivo_completo(archive_path, operation_id, nome_operacao, telefone_alvo, account_data):
+    '''Carrega o pacote e retorna o resultado do registro em files (com file_id), ou None em caso de erro'''
+    # A carga (extrator e cliente da ip-api) só é importada quando há arquivo a processar
+    from db.queries import insert_groups_and_contacts, insert_target_into_targets, insert_data_into_files, insert_messages
+
     try:
         insert_target_into_targets(operation_id, nome_operacao, telefone_alvo)
-        insert_data_into_files(operation_id, archive_path, account_data)
+        file_result = insert_data_into_files(operation_id, archive_path, account_data)
 
         if account_data['file_type'] == 'DADOS':
             # insere grupos e agenda
@@ -29,21 +32,16 @@ def processar_arquivo_completo(archive_path, operation_id, nome_operacao, telefo
             # insere mensagens
             insert_messages(operation_id, archive_path)
         
-        # Enriquecer IPs após inserção com feedback visual
-        enricher = IPEnricher()
-        
-        # Verificar quantos IPs precisam ser processados
-        pending_ips = enricher.get_pending_ips()
-        if pending_ips:
-            enricher.process_pending_ips()
-            print(f"{len(pending_ips)} IPs enriquecidos com sucesso!")
-        else:
-            print("Todos os IPs já estão enriquecidos")
-
+        # Os IPs novos ficam PENDING e são enriquecidos em segundo plano pelo serviço
+        # extractor.enrichment_daemon, sem segurar o upload; os desta operação vão para o início da fila
+        if account_data['file_type'] == 'PRTT':
+            prioritize_operation(operation_id)
         print("Arquivo processado com sucesso!")
+        return file_result
         
     except Exception as e:
         print(f"Erro no processamento: {str(e)}")
+        return None
 
 
 ################## lÓGICA DA SIDEBAR ##################
@@ -291,6 +289,9 @@ with st.sidebar:
                             print(f"{targets_removidos} target(s) órfão(s) removido(s)")
                             print(f"{len(pastas_removidas)} pasta(s) física(s) removida(s): {pastas_removidas}")
                         
+                    # Atualizar snapshot de métricas do dashboard
+                    refresh_operation_metrics(operation_id)
+                    
                     st.success(f"{total_excluidos} pacote(s) excluído(s) com sucesso!", icon="✅")
                     
                 except Exception as e:
@@ -300,6 +301,7 @@ with st.sidebar:
         if uploaded_file and not st.session_state["processing"]:
             # Preparar dados para processamento
             uploaded_File_data = []
+            from extractor import get_account_data_from_buffer
             
             for file in uploaded_file:
                 account_data = get_account_data_from_buffer(file.getbuffer(), file.name)
@@ -351,8 +353,11 @@ elif st.session_state.get("processing", False):
         
         # Usar Progress Bar na área central
         st.write('')
-        progress_text = "🔄 Processando arquivos e enriquecendo dados de geolocalização..."
+        progress_text = "🔄 Processando arquivos..."
         progress_bar = st.progress(0, text=progress_text)
+        novos_arquivos = []
+        recalcular_metricas = False
+        operation_id = st.session_state.get("current_op_id", None)
         
         for i, data in enumerate(uploaded_File_data):
             file = data['file']
@@ -364,7 +369,6 @@ elif st.session_state.get("processing", False):
             progress_bar.progress(progress, text=f"📁 Processando {file.name} ({i+1}/{total_files})")
             
             # Salvar arquivo
-            operation_id = st.session_state.get("current_op_id", None)
             destino_dir = BASE_DIR / "data" / str(nome_operacao) / telefone_alvo
             archive_path = destino_dir / file.name
             os.makedirs(destino_dir, exist_ok=True)
@@ -373,7 +377,18 @@ elif st.session_state.get("processing", False):
                 f.write(file.getbuffer())
             print(f"Arquivo salvo diretamente em: {archive_path}")
             
-            processar_arquivo_completo(archive_path, operation_id, nome_operacao, telefone_alvo, account_data)
+            file_result = processar_arquivo_completo(archive_path, operation_id, nome_operacao, telefone_alvo, account_data)
+            if file_result and file_result.get('status') == 'success':
+                novos_arquivos.append(file_result['file_id'])
+            else:
+                # Pacote reenviado ou com erro: não dá para saber o que já estava somado no snapshot
+                recalcular_metricas = True
+        
+        # Atualizar o snapshot de métricas do dashboard uma única vez para o lote
+        if recalcular_metricas:
+            refresh_operation_metrics(operation_id)
+        else:
+            update_operation_metrics(operation_id, novos_arquivos)
         
         # Finalizar processamento
         progress_bar.progress(1.0, text="✅ Processamento concluído!")
@@ -474,4 +489,5 @@ else:
     # Mostrar dialog de sucesso se necessário
     if st.session_state.get("show_dialog", False):
         st.success("✅ Arquivo(s) processado(s) com sucesso!")
+        st.caption("🌐 A geolocalização dos IPs novos é feita em segundo plano e aparece no mapa conforme for concluída.")
         st.session_state.show_dialog = False
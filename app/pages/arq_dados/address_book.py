@@ -1,8 +1,14 @@
 import streamlit as st
-from settings import get_operacao, PROJECT_ROOT
-from db.models import Operation, Target, Contact, File, operation_targets, file_contacts
+from settings import get_operacao, get_current_op_id, PROJECT_ROOT
+from query_cache import cached_by_operation
+from paginated_table import paginated_table
+from export_download import export_download
+from db.models import Target, Contact, File, operation_targets, file_contacts
 from db.session import get_session
-from sqlalchemy import and_
+from db.pagination import keyset_page, PAGE_SIZE
+from db.frames import records_frame
+from db.streaming import stream_dataframes
+from sqlalchemy import and_, func, select
 import pandas as pd
 import os
 
@@ -11,105 +17,204 @@ import os
 ################  FUNÇÕES DE CONSULTA  ###############
 ################  FUNÇÕES DE CONSULTA  ###############
 
-def get_targets(op_name):
-    '''Retorna uma lista de targets, baseado no nome da operação'''
+# Formatação do tipo de contato
+CONTACT_TYPES = {
+    'symmetric_contact': 'simétrico',
+    'asymmetric_contact': 'assimétrico'
+}
+
+
+@cached_by_operation
+def get_targets(operation_id):
+    '''Retorna uma lista de targets da operação'''
     with get_session() as session:
-        # Buscar a operação pelo nome
-        current_op = session.query(Operation).filter(Operation.name == op_name).first()
-        
-        if not current_op:
-            return []  # Retorna lista vazia se operação não for encontrada
-        
-        # Retornar os targets usando o relacionamento
-        return [op.target for op in current_op.targets]
+        targets = session.query(Target.target).join(
+            operation_targets, Target.target_id == operation_targets.c.target_id
+        ).filter(operation_targets.c.operation_id == operation_id).all()
 
+        return [target[0] for target in targets]
 
-def get_address_book_data(**kwargs):
-    '''Buscar dados da agenda de contatos do target selecionado'''
-   
-    target_phone = kwargs.get('target_phone')
-    nome_operacao = get_operacao()
+
+def get_target_contacts(session, operation_id, target_phone):
+    '''Subconsulta dos contatos do alvo na operação, um registro por telefone (o do arquivo mais recente)'''
+    # Buscar o target_id específico dentro do contexto da operação
+    target_in_operation = session.query(Target.target_id).join(
+        operation_targets,
+        Target.target_id == operation_targets.c.target_id
+    ).filter(
+        and_(
+            operation_targets.c.operation_id == operation_id,
+            Target.target == target_phone
+        )
+    ).first()
+    
+    if not target_in_operation:
+        return None
     
-    if not nome_operacao or not target_phone:
-        return pd.DataFrame()
+    # Buscar contatos do target através dos files, numerando as ocorrências de cada telefone
+    return session.query(
+        Contact.contact_phone.label('contato'),
+        Contact.contact_type.label('tipo'),
+        File.generated_timestamp.label('gerado_em'),
+        File.archive_name.label('arquivo'),
+        func.row_number().over(
+            partition_by=Contact.contact_phone,
+            order_by=(File.generated_timestamp.desc(), File.file_id.desc())
+        ).label('ocorrencia')
+    ).select_from(Contact).join(
+        file_contacts, Contact.contact_id == file_contacts.c.contact_id
+    ).join(
+        File, file_contacts.c.file_id == File.file_id
+    ).filter(
+        and_(
+            File.operation_id == operation_id,
+            File.target_id == target_in_operation.target_id
+        )
+    ).subquery('target_contacts')
+
+
+@cached_by_operation
+def get_address_book_data(operation_id, target_phone, after=None):
+    '''Uma página da agenda de contatos do target selecionado (ordem do telefone) e o cursor da próxima'''
+   
+    if not operation_id or not target_phone:
+        return pd.DataFrame(), None
     
     try:
         with get_session() as session:
-            # Buscar a operação pelo nome
-            current_op = session.query(Operation).filter(Operation.name == nome_operacao).first()
+            contacts = get_target_contacts(session, operation_id, target_phone)
             
-            if not current_op:
-                return pd.DataFrame()
+            if contacts is None:
+                return pd.DataFrame(), None
             
-            # Buscar o target_id específico dentro do contexto da operação
-            target_in_operation = session.query(Target.target_id).join(
-                operation_targets,
-                Target.target_id == operation_targets.c.target_id
-            ).filter(
-                and_(
-                    operation_targets.c.operation_id == current_op.operation_id,
-                    Target.target == target_phone
-                )
-            ).first()
-            
-            if not target_in_operation:
-                return pd.DataFrame()
-            
-            target_id = target_in_operation.target_id
-            
-            # Buscar contatos do target através dos files
+            # Remover duplicatas mantendo o registro mais recente
             query = session.query(
-                Contact.contact_phone.label('contato'),
-                Contact.contact_type.label('tipo'),
-                File.generated_timestamp.label('gerado_em'),
-                File.archive_name.label('arquivo')
-            ).select_from(Contact).join(
-                file_contacts, Contact.contact_id == file_contacts.c.contact_id
-            ).join(
-                File, file_contacts.c.file_id == File.file_id
-            ).filter(
-                and_(
-                    File.operation_id == current_op.operation_id,
-                    File.target_id == target_id
-                )
-            ).order_by(Contact.contact_phone)
+                contacts.c.contato,
+                contacts.c.tipo,
+                contacts.c.gerado_em,
+                contacts.c.arquivo
+            ).filter(contacts.c.ocorrencia == 1)
             
-            results = query.all()
+            results, next_cursor = keyset_page(query, [('contato', contacts.c.contato)], after=after, descending=False)
             
             if not results:
-                return pd.DataFrame()
+                return pd.DataFrame(), None
             
-            # Converter para DataFrame
-            data = []
-            for r in results:
-                # Formatação do tipo de contato
-                tipo_formatado = {
-                    'symmetric_contact': 'simétrico',
-                    'asymmetric_contact': 'assimétrico'
-                }.get(r.tipo, r.tipo or 'N/A')
-                
-                # Formatação da data
-                gerado_em = r.gerado_em.strftime('%d/%m/%Y %H:%M:%S') if r.gerado_em else 'N/A'
-                
-                data.append({
-                    'contato': r.contato,
-                    'tipo': tipo_formatado,
-                    'gerado_em': gerado_em,
-                    'arquivo': r.arquivo or 'N/A'
-                })
+            # Converter para a exibição (coluna a coluna: tipo como categoria, datas formatadas de uma vez)
+            df = records_frame(
+                results,
+                categories=('tipo',),
+                date_formats={'gerado_em': '%d/%m/%Y %H:%M:%S'},
+                fill={'tipo': 'N/A', 'gerado_em': 'N/A', 'arquivo': 'N/A'}
+            )
+            df['tipo'] = df['tipo'].cat.rename_categories(lambda tipo: CONTACT_TYPES.get(tipo, tipo))
             
-            df = pd.DataFrame(data)
+            return df, next_cursor
             
-            # Remover duplicatas mantendo o registro mais recente
-            if not df.empty:
-                df = df.drop_duplicates(subset=['contato'], keep='first')
-                df = df.reset_index(drop=True)
+    except Exception as e:
+        print(f"❌ Erro na função get_address_book_data: {str(e)}")
+        return pd.DataFrame(), None
+
+
+@cached_by_operation
+def get_address_book_totals(operation_id, target_phone):
+    '''Quantidade de contatos do target por tipo (já formatado), contados no banco'''
+    
+    if not operation_id or not target_phone:
+        return {}
+    
+    try:
+        with get_session() as session:
+            contacts = get_target_contacts(session, operation_id, target_phone)
+            
+            if contacts is None:
+                return {}
             
-            return df
+            rows = session.query(
+                contacts.c.tipo,
+                func.count()
+            ).filter(contacts.c.ocorrencia == 1).group_by(contacts.c.tipo).all()
+            
+            return {CONTACT_TYPES.get(tipo, tipo or 'N/A'): count for tipo, count in rows}
             
     except Exception as e:
-        print(f"❌ Erro na função get_address_book_data: {str(e)}")
-        return pd.DataFrame()
+        print(f"❌ Erro na função get_address_book_totals: {str(e)}")
+        return {}
+
+
+def stream_address_book(operation_id, target_phone):
+    '''Blocos (DataFrames) com a agenda completa do target, lidos com cursor do lado do servidor'''
+    with get_session() as session:
+        contacts = get_target_contacts(session, operation_id, target_phone)
+        if contacts is None:
+            return iter(())
+        
+        query = select(
+            contacts.c.contato,
+            contacts.c.tipo,
+            contacts.c.gerado_em,
+            contacts.c.arquivo
+        ).where(contacts.c.ocorrencia == 1).order_by(contacts.c.contato)
+    
+    def format_chunk(df):
+        df['tipo'] = df['tipo'].cat.rename_categories(lambda tipo: CONTACT_TYPES.get(tipo, tipo))
+        return df
+    
+    return (
+        format_chunk(df)
+        for df in stream_dataframes(
+            query,
+            categories=('tipo',),
+            date_formats={'gerado_em': '%d/%m/%Y %H:%M:%S'},
+            fill={'tipo': 'N/A', 'gerado_em': 'N/A', 'arquivo': 'N/A'}
+        )
+    )
+
+
+################  COMPONENTES  ###############
+################  COMPONENTES  ###############
+################  COMPONENTES  ###############
+
+@st.fragment
+def render_contacts(operation_id, target_phone, total_contacts):
+    '''Tabela paginada da agenda (fragmento: trocar de página reexecuta apenas a tabela)'''
+    paginated_table(
+        'address_book_contacts',
+        lambda after: get_address_book_data(operation_id, target_phone, after),
+        filters=(operation_id, target_phone),
+        total=total_contacts,
+        page_size=PAGE_SIZE,
+        column_config={
+            "contato": st.column_config.TextColumn(
+                "📱 Contato",
+                help="Número do telefone do contato",
+                width="medium"
+            ),
+            "tipo": st.column_config.TextColumn(
+                "🔄 Tipo", 
+                help="Tipo de relacionamento na agenda",
+                width="medium"
+            ),
+            "gerado_em": st.column_config.TextColumn(
+                "📅 Gerado em",
+                help="Data e hora de geração do arquivo",
+                width="medium"
+            ),
+            "arquivo": st.column_config.TextColumn(
+                "📁 Arquivo",
+                help="Nome do arquivo de origem",
+                width="medium"
+            )
+        }
+    )
+
+    # Exportação da agenda completa (não apenas da página exibida)
+    export_download(
+        'address_book_export',
+        lambda: stream_address_book(operation_id, target_phone),
+        file_name=f"agenda_{target_phone}",
+        filters=(operation_id, target_phone)
+    )
 
 
 ################  LÓGICA SIDEBAR  ###############
@@ -148,10 +253,11 @@ with st.sidebar:
     st.write('')
     st.write('')
     nome_operacao = get_operacao()
+    operation_id = get_current_op_id()
     st.header(f'Operação: {nome_operacao}', divider='red')
 
-    if nome_operacao:
-            target_adressbook_options = get_targets(nome_operacao)
+    if nome_operacao and operation_id:
+            target_adressbook_options = get_targets(operation_id)
             target_adressbook_options.insert(0, '')
             
             if not target_adressbook_options:
@@ -222,8 +328,9 @@ st.markdown("""
     """, unsafe_allow_html=True)
 
 nome_operacao = get_operacao()
+operation_id = get_current_op_id()
 
-if not nome_operacao:
+if not nome_operacao or not operation_id:
     st.error("Por favor, selecione uma Operação para habilitar os filtros na barra lateral.", icon="🚨")
     st.error("Administração > Configurações > Selecionar operação.", icon="🚨")
     st.stop()
@@ -236,62 +343,34 @@ if 'btn_get_messages' in locals() and btn_get_messages and 'target_adressbook' i
         
         # Mostrar spinner enquanto processa
         with st.spinner('Buscando agenda de contatos...'):
-            # Chamar a função e capturar o resultado
-            df_contacts = get_address_book_data(target_phone=target_adressbook)
+            # Totais contados no banco; a tabela busca uma página por vez
+            contacts_by_type = get_address_book_totals(operation_id, target_phone=target_adressbook)
         
-        # PROTEÇÃO: Garantir que df_contacts seja sempre um DataFrame
-        if df_contacts is None:
-            df_contacts = pd.DataFrame()
+        total_contacts = sum(contacts_by_type.values())
         
-        if not df_contacts.empty:
+        if total_contacts:
             
             # Métricas resumidas no topo
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                st.metric("📞 Total de Contatos", len(df_contacts))
+                st.metric("📞 Total de Contatos", total_contacts)
             
             with col2:
-                simetricos = len(df_contacts[df_contacts['tipo'] == 'simétrico'])
+                simetricos = contacts_by_type.get('simétrico', 0)
                 st.metric("🔄 Simétricos", simetricos)
             
             with col3:
-                assimetricos = len(df_contacts[df_contacts['tipo'] == 'assimétrico'])
+                assimetricos = contacts_by_type.get('assimétrico', 0)
                 st.metric("➡️ Assimétricos", assimetricos)
             
             with col4:
                 # Calcular percentual de simétricos
-                percentual = (simetricos / len(df_contacts) * 100) if len(df_contacts) > 0 else 0
+                percentual = (simetricos / total_contacts * 100) if total_contacts > 0 else 0
                 st.metric("📊 % Simétricos", f"{percentual:.1f}%")
                        
-            # Exibir o DataFrame
-            st.dataframe(
-                df_contacts, 
-                use_container_width=True,
-                hide_index=True,
-                column_config={
-                    "contato": st.column_config.TextColumn(
-                        "📱 Contato",
-                        help="Número do telefone do contato",
-                        width="medium"
-                    ),
-                    "tipo": st.column_config.TextColumn(
-                        "🔄 Tipo", 
-                        help="Tipo de relacionamento na agenda",
-                        width="medium"
-                    ),
-                    "gerado_em": st.column_config.TextColumn(
-                        "📅 Gerado em",
-                        help="Data e hora de geração do arquivo",
-                        width="medium"
-                    ),
-                    "arquivo": st.column_config.TextColumn(
-                        "📁 Arquivo",
-                        help="Nome do arquivo de origem",
-                        width="medium"
-                    )
-                }
-            )
+            # Exibir a agenda, uma página por vez
+            render_contacts(operation_id, target_adressbook, total_contacts)
             
         else:
             st.info("📭 Nenhum contato encontrado na agenda para este alvo.", icon="ℹ️")
@@ -1,7 +1,9 @@
 import streamlit as st
-from settings import get_operacao, PROJECT_ROOT
-from db.models import Operation, Target, File, operation_targets, Group, GroupMetadata, File, file_groups
+from settings import get_operacao, get_current_op_id, PROJECT_ROOT
+from query_cache import cached_by_operation
+from db.models import Target, File, operation_targets, Group, GroupMetadata, File, file_groups
 from db.session import get_session
+from db.frames import query_frame
 from sqlalchemy import and_
 import pandas as pd
 import os
@@ -10,39 +12,30 @@ import os
 ################  FUNÇÕES DE CONSULTA  ###############
 ################  FUNÇÕES DE CONSULTA  ###############
 
-def get_targets(op_name):
-    '''Retorna uma lista de targets, baseado no nome da operação'''
+@cached_by_operation
+def get_targets(operation_id):
+    '''Retorna uma lista de targets da operação'''
     with get_session() as session:
-        # Buscar a operação pelo nome
-        current_op = session.query(Operation).filter(Operation.name == op_name).first()
-        
-        if not current_op:
-            return []  # Retorna lista vazia se operação não for encontrada
-        
-        # Retornar os targets usando o relacionamento
-        return [op.target for op in current_op.targets]
+        targets = session.query(Target.target).join(
+            operation_targets, Target.target_id == operation_targets.c.target_id
+        ).filter(operation_targets.c.operation_id == operation_id).all()
 
+        return [target[0] for target in targets]
 
-def get_groups_data(**kwargs):
+
+@cached_by_operation
+def get_groups_data(operation_id, target_phone):
     '''Buscar grupos - VERSÃO SUPER SIMPLES'''
         
-    target_phone = kwargs.get('target_phone')
-    nome_operacao = get_operacao()
-    
-    if not nome_operacao or not target_phone:
+    if not operation_id or not target_phone:
         return pd.DataFrame()
     
     try:
         with get_session() as session:
-            # Buscar operação
-            current_op = session.query(Operation).filter(Operation.name == nome_operacao).first()
-            if not current_op:
-                return pd.DataFrame()
-            
             # Buscar target
             target_obj = session.query(Target).join(operation_targets).filter(
                 and_(
-                    operation_targets.c.operation_id == current_op.operation_id,
+                    operation_targets.c.operation_id == operation_id,
                     Target.target == target_phone
                 )
             ).first()
@@ -64,26 +57,25 @@ def get_groups_data(**kwargs):
                 GroupMetadata, Group.group_id == GroupMetadata.group_id
             ).filter(
                 and_(
-                    File.operation_id == current_op.operation_id,
+                    File.operation_id == operation_id,
                     File.target_id == target_obj.target_id,
                     File.file_type == 'DADOS'
                 )
             ).distinct().order_by(Group.creation.desc())
             
-            results = query.all()
-            print(f"🔍 {len(results)} grupos encontrados")
+            # Ler direto para colunas tipadas; datas formatadas de uma vez (dt.strftime)
+            df = query_frame(
+                session,
+                query,
+                date_formats={'creation': '%d/%m/%Y %H:%M:%S'},
+                fill={'subject': '-', 'creation': 'N/A'}
+            )
+            print(f"🔍 {len(df)} grupos encontrados")
             
-            # Criar DataFrame
-            data = []
-            for r in results:
-                data.append({
-                    'group_id': r.group_id,
-                    'subject': r.subject or '-',
-                    'group_size': r.group_size or 'N/A',
-                    'creation': r.creation.strftime('%d/%m/%Y %H:%M:%S') if r.creation else 'N/A'
-                })
+            # Participantes: inteiro quando disponível, 'N/A' caso contrário (coluna exibida como texto)
+            df['group_size'] = df['group_size'].astype('Int64').astype('string').fillna('N/A')
             
-            return pd.DataFrame(data)
+            return df[['group_id', 'subject', 'group_size', 'creation']]
             
     except Exception as e:
         print(f"❌ ERRO: {e}")
@@ -126,10 +118,11 @@ with st.sidebar:
     st.write('')
     st.write('')
     nome_operacao = get_operacao()
+    operation_id = get_current_op_id()
     st.header(f'Operação: {nome_operacao}', divider='red')
 
-    if nome_operacao:
-            target_groups_options = get_targets(nome_operacao)
+    if nome_operacao and operation_id:
+            target_groups_options = get_targets(operation_id)
             target_groups_options.insert(0, '')
             
             if not target_groups_options:
@@ -157,8 +150,9 @@ with st.sidebar:
 ################  LÓGICA CENTRAL  ###############
 
 nome_operacao = get_operacao()
+operation_id = get_current_op_id()
 
-if not nome_operacao:
+if not nome_operacao or not operation_id:
     st.error("Por favor, selecione uma Operação para habilitar os filtros na barra lateral.", icon="🚨")
     st.error("Administração > Configurações > Selecionar operação.", icon="🚨")
     st.stop()
@@ -172,7 +166,7 @@ if 'btn_get_messages' in locals() and btn_get_messages and 'target_groups' in lo
         # Mostrar spinner enquanto processa
         with st.spinner('Buscando grupos do target...'):
             # Chamar a função e capturar o resultado
-            df_groups = get_groups_data(target_phone=target_groups)
+            df_groups = get_groups_data(operation_id, target_phone=target_groups)
         
         # Proteção contra None
         if df_groups is None:
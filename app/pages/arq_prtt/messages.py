@@ -1,61 +1,64 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import func, and_, case
-from settings import get_operacao, PROJECT_ROOT
+from sqlalchemy import func, and_
+from settings import get_operacao, get_current_op_id, PROJECT_ROOT
+from query_cache import cached_by_operation
+from paginated_table import paginated_table
+from export_download import export_download
 from db.session import get_session
-from db.models import Operation, Target, Message, File, operation_targets, MessageRecipient, GroupMetadata
+from db.models import Target, Message, File, operation_targets, GroupMetadata, ConversationStat
+from db.filters import time_range_filter
+from db.conversation_stats import get_conversation_page, get_conversation_totals, conversation_export_query
+from db.streaming import stream_dataframes
+from db.pagination import PAGE_SIZE
+from db.frames import records_frame
 import os
-from datetime import datetime
 
 
 ################  FUNÇÕES DE CONSULTA  ###############
 ################  FUNÇÕES DE CONSULTA  ###############
 ################  FUNÇÕES DE CONSULTA  ###############
 
-def get_targets(op_name):
-    '''Retorna uma lista de targets, baseado no nome da operação'''
+@cached_by_operation
+def get_targets(operation_id):
+    '''Retorna uma lista de targets da operação'''
     with get_session() as session:
-        # Buscar a operação pelo nome
-        current_op = session.query(Operation).filter(Operation.name == op_name).first()
-        
-        if not current_op:
-            return []  # Retorna lista vazia se operação não for encontrada
-        
-        # Retornar os targets usando o relacionamento
-        return [op.target for op in current_op.targets]
+        targets = session.query(Target.target).join(
+            operation_targets, Target.target_id == operation_targets.c.target_id
+        ).filter(operation_targets.c.operation_id == operation_id).all()
+
+        return [target[0] for target in targets]
 
 
-def get_date_messages(nome_operacao, target_messages):
+def get_target_id(session, operation_id, target_phone):
+    '''Busca o target_id do telefone dentro do contexto da operação (via operation_targets)'''
+    target_in_operation = session.query(Target.target_id).join(
+        operation_targets,
+        Target.target_id == operation_targets.c.target_id
+    ).filter(
+        and_(
+            operation_targets.c.operation_id == operation_id,
+            Target.target == target_phone
+        )
+    ).first()
+
+    return target_in_operation.target_id if target_in_operation else None
+
+
+@cached_by_operation
+def get_date_messages(operation_id, target_messages):
     ''' Retorna uma tupla contendo as datas do primeiro e último registro de mensagens para o alvo em questão.'''
     
-    if not nome_operacao or not target_messages:
+    if not operation_id or not target_messages:
         return None, None
     
     with get_session() as session:
-                
-        # Buscar a operação pelo nome
-        current_op = session.query(Operation).filter(Operation.name == nome_operacao).first()
         
-        if not current_op:
-            return None, None
+        target_id = get_target_id(session, operation_id, target_messages)
         
-        # Buscar o target_id específico dentro do contexto da operação
-        # Usa a tabela operation_targets para garantir que o target pertence à operação
-        target_in_operation = session.query(Target.target_id).join(
-            operation_targets,
-            Target.target_id == operation_targets.c.target_id
-        ).filter(
-            and_(
-                operation_targets.c.operation_id == current_op.operation_id,
-                Target.target == target_messages
-            )
-        ).first()
-        
-        if not target_in_operation:
+        if not target_id:
             return None, None  # Target não encontrado nesta operação
         
-        target_id = target_in_operation.target_id
-        
         # Query para buscar min e max timestamp das mensagens
         # Usa as FKs compostas para garantir contexto de operação + target
         result = session.query(
@@ -65,8 +68,8 @@ def get_date_messages(nome_operacao, target_messages):
             File, Message.file_id == File.file_id
         ).filter(
             and_(
-                File.operation_id == current_op.operation_id,  # FK composta: operação
-                File.target_id == target_id                    # FK composta: target
+                File.operation_id == operation_id,  # FK composta: operação
+                File.target_id == target_id         # FK composta: target
             )
         ).first()
         
@@ -76,118 +79,37 @@ def get_date_messages(nome_operacao, target_messages):
             return None, None
 
 
-def get_data_messages(**kwargs):
-    '''Versão CORRIGIDA com conversas bidirecionais e contagem única de mensagens'''
-    
-    target_messages = kwargs.get('target_messages')
-    date_message = kwargs.get('date_message')
-    nome_operacao = get_operacao()
+@cached_by_operation
+def get_data_messages(operation_id, target_messages, date_message, after=None):
+    '''Uma página das conversas bidirecionais do alvo no período (resumo diário conversation_stats) e o cursor da próxima'''
     
-    if not nome_operacao or not target_messages:
-        return pd.DataFrame()
+    if not operation_id or not target_messages:
+        return pd.DataFrame(), None
     
     with get_session() as session:
         
-        # Buscar a operação pelo nome
-        current_op = session.query(Operation).filter(Operation.name == nome_operacao).first()
+        target_id = get_target_id(session, operation_id, target_messages)
         
-        if not current_op:
-            return pd.DataFrame()
+        if not target_id:
+            return pd.DataFrame(), None
         
-        # Buscar o target_id específico dentro do contexto da operação
-        target_in_operation = session.query(Target.target_id).join(
-            operation_targets,
-            Target.target_id == operation_targets.c.target_id
-        ).filter(
-            and_(
-                operation_targets.c.operation_id == current_op.operation_id,
-                Target.target == target_messages
-            )
-        ).first()
-        
-        if not target_in_operation:
-            return pd.DataFrame()
-        
-        target_id = target_in_operation.target_id
-        
-        # Filtro de data
-        date_filter = True
-        if date_message:
-            if isinstance(date_message, (tuple, list)) and len(date_message) == 2:
-                start_date, end_date = date_message
-                
-                # GARANTIR que são objetos date
-                if isinstance(start_date, datetime):
-                    start_date = start_date.date()
-                if isinstance(end_date, datetime):
-                    end_date = end_date.date()
-                
-                date_filter = and_(
-                    func.date(Message.timestamp) >= start_date,
-                    func.date(Message.timestamp) <= end_date
-                )
-            else:
-                # Data única
-                single_date = date_message
-                if isinstance(single_date, datetime):
-                    single_date = single_date.date()
-                    
-                date_filter = func.date(Message.timestamp) >= single_date
-        
-        # Query com DISTINCT para evitar duplicatas por recipients
-        query = session.query(
-            Message.message_id,  # Inclui message_id para garantir unicidade
-            Message.sender,
-            MessageRecipient.recipient_phone.label('recipient'),
-            Message.group_id,
-            case(
-                (Message.sender == target_messages, 1),
-                else_=0
-            ).label('enviada'),
-            case(
-                (MessageRecipient.recipient_phone == target_messages, 1),
-                else_=0
-            ).label('recebida')
-        ).select_from(Message).join(
-            File, Message.file_id == File.file_id
-        ).join(
-            MessageRecipient, Message.message_id == MessageRecipient.message_id
-        ).filter(
-            and_(
-                File.operation_id == current_op.operation_id,
-                File.target_id == target_id,
-                date_filter
-            )
+        # Conversas já agregadas por dia; o banco soma apenas os dias do período e devolve uma página
+        results, next_cursor = get_conversation_page(
+            session,
+            operation_id,
+            target_id,
+            time_range_filter(ConversationStat.day, date_message),
+            after=after
         )
         
-        results = query.all()
-        
         if not results:
-            return pd.DataFrame()
+            return pd.DataFrame(), None
         
-        # Para grupos: uma mensagem pode ter múltiplos recipients, mas conta como 1 só
-        unique_messages = {}
-        
-        for r in results:
-            message_key = r.message_id
-            
-            if message_key not in unique_messages:
-                unique_messages[message_key] = r
-            else:
-                # Se já existe, manter apenas se o target está envolvido
-                existing = unique_messages[message_key]
-                if r.enviada == 1 or r.recebida == 1:  # Target está envolvido nesta linha
-                    unique_messages[message_key] = r
-        
-        # Converter de volta para lista
-        results = list(unique_messages.values())
-                
-        # Buscar metadata dos grupos
-        group_ids = [r.group_id for r in results if r.group_id]
+        # Buscar metadata dos grupos (apenas os da página)
+        unique_group_ids = list({r['group_id'] for r in results if r['group_id']})
         group_metadata = {}
         
-        if group_ids:
-            unique_group_ids = list(set(group_ids))
+        if unique_group_ids:
             metadata_query = session.query(
                 GroupMetadata.group_id,
                 GroupMetadata.subject
@@ -196,74 +118,131 @@ def get_data_messages(**kwargs):
             for meta in metadata_query.all():
                 group_metadata[meta.group_id] = meta.subject
         
-        # Conversão para conversas bidirecionais (mesmo código anterior)
-        data = []
-        for r in results:
-            if r.group_id:  # É mensagem de grupo
-                group_name = group_metadata.get(r.group_id, 'Pendente')
-                
-                if r.enviada == 1:  # Target enviou para o grupo
-                    conversa_key = f"GRUPO_{r.group_id}"
-                    contact = 'Grupo'
-                else:  # Target recebeu do grupo
-                    conversa_key = f"GRUPO_{r.group_id}"
-                    contact = 'Grupo'
-                
-                group_key = r.group_id
-                
-            else:  # Conversa particular
-                group_name = '-'
-                
-                # Chave única para conversas bidirecionais
-                if r.sender == target_messages:
-                    # Target enviou
-                    contact = r.recipient
-                else:
-                    # Target recebeu
-                    contact = r.sender
-                
-                conversa_key = f"PARTICULAR_{contact}"
-                group_key = 'CONVERSA_PARTICULAR'
-            
-            data.append({
-                'target': target_messages,
-                'contact': contact,
-                'conversa_key': conversa_key,
-                'group_id': group_key,
-                'nome_grupo': group_name,
-                'quantidade_enviadas': r.enviada,
-                'quantidade_recebidas': r.recebida
-            })
-        
-        df = pd.DataFrame(data)
+        # Montar a página coluna a coluna; nome do grupo resolvido de forma vetorizada
+        df = records_frame(
+            results,
+            columns=['contact', 'group_id', 'quantidade_enviadas', 'quantidade_recebidas', 'total_mensagens'],
+            fill={'quantidade_enviadas': 0, 'quantidade_recebidas': 0, 'total_mensagens': 0}
+        ).rename(columns={'contact': 'recipient'})
         
-        # Agrupamento por conversa_key
-        df_grouped = df.groupby(['target', 'contact', 'conversa_key', 'group_id', 'nome_grupo']).agg({
-            'quantidade_enviadas': 'sum',
-            'quantidade_recebidas': 'sum'
-        }).reset_index()
+        nome_grupo = df['group_id'].map(group_metadata).fillna('Pendente')
+        df['nome_grupo'] = pd.Categorical(nome_grupo.where(df['group_id'].notna(), '-'))
+        df.insert(0, 'sender', pd.Categorical([target_messages] * len(df)))
         
-        # Adicionar coluna de soma total
-        df_grouped['total_mensagens'] = df_grouped['quantidade_enviadas'] + df_grouped['quantidade_recebidas']
+        for column in ('quantidade_enviadas', 'quantidade_recebidas', 'total_mensagens'):
+            df[column] = df[column].astype('int64')
         
-        # Ordenar por total de mensagens (maior primeiro)
-        df_grouped = df_grouped.sort_values('total_mensagens', ascending=False).reset_index(drop=True)
+        df = df[['sender', 'recipient', 'group_id', 'nome_grupo', 'quantidade_enviadas', 'quantidade_recebidas', 'total_mensagens']]
+                
+        return df, next_cursor
+
+
+@cached_by_operation
+def get_messages_totals(operation_id, target_messages, date_message):
+    '''Retorna (conversas, enviadas, recebidas) do alvo no período, somados no resumo conversation_stats'''
+    
+    if not operation_id or not target_messages:
+        return 0, 0, 0
+    
+    with get_session() as session:
+        target_id = get_target_id(session, operation_id, target_messages)
         
-        # Limpeza final: Ajustar colunas para o formato desejado
-        df_final = pd.DataFrame({
-            'sender': df_grouped['target'],
-            'recipient': df_grouped['contact'],
-            'group_id': df_grouped['group_id'],
-            'nome_grupo': df_grouped['nome_grupo'],
-            'quantidade_enviadas': df_grouped['quantidade_enviadas'],
-            'quantidade_recebidas': df_grouped['quantidade_recebidas'],
-            'total_mensagens': df_grouped['total_mensagens']
-        })
+        if not target_id:
+            return 0, 0, 0
         
-        # Voltar None para conversas particulares
-        df_final.loc[df_final['group_id'] == 'CONVERSA_PARTICULAR', 'group_id'] = None
-                
-        return df_final
+        return get_conversation_totals(
+            session,
+            operation_id,
+            target_id,
+            time_range_filter(ConversationStat.day, date_message)
+        )
+
+
+def stream_conversations(operation_id, target_messages, date_message):
+    '''Blocos (DataFrames) com todas as conversas do alvo no período, lidos com cursor do lado do servidor'''
+    with get_session() as session:
+        target_id = get_target_id(session, operation_id, target_messages)
+        if not target_id:
+            return iter(())
+        
+        query = conversation_export_query(
+            session,
+            operation_id,
+            target_id,
+            time_range_filter(ConversationStat.day, date_message)
+        )
+    
+    def format_chunk(df):
+        # Mesmas regras da tabela: grupo sem metadados -> 'Pendente', conversa particular -> '-'
+        df['nome_grupo'] = df['nome_grupo'].where(df['nome_grupo'].notna(), df['group_id'].map(lambda group_id: 'Pendente' if group_id else '-'))
+        df.insert(0, 'sender', target_messages)
+        return df.rename(columns={'contact': 'recipient'})
+    
+    return (format_chunk(df) for df in stream_dataframes(query))
+
+
+################  COMPONENTES  ###############
+################  COMPONENTES  ###############
+################  COMPONENTES  ###############
+
+@st.fragment
+def render_conversations(operation_id, target_messages, date_message, total_conversations):
+    '''Tabela paginada das conversas (fragmento: trocar de página reexecuta apenas a tabela)'''
+    paginated_table(
+        'messages_conversations',
+        lambda after: get_data_messages(operation_id, target_messages, date_message, after),
+        filters=(operation_id, target_messages, str(date_message)),
+        total=total_conversations,
+        page_size=PAGE_SIZE,
+        column_config={
+            "sender": st.column_config.TextColumn(
+                "Remetente",
+                help="Número do remetente",
+                width=104
+            ),
+            "recipient": st.column_config.TextColumn(
+                "Destinatário", 
+                help="Número do destinatário",
+                width=104
+            ),
+            "group_id": st.column_config.TextColumn(
+                "ID do Grupo",
+                help="Identificador do grupo",
+                width=140
+            ),
+            "nome_grupo": st.column_config.TextColumn(
+                "Nome do Grupo",
+                help="Nome ou descrição do grupo",
+                width=250
+            ),
+            "quantidade_enviadas": st.column_config.NumberColumn(
+                "Enviadas",
+                help="Quantidade de mensagens enviadas pelo alvo",
+                format="%d",  # ✅ Formato numérico sem decimais
+                width=62
+            ),
+            "quantidade_recebidas": st.column_config.NumberColumn(
+                "Recebidas", 
+                help="Quantidade de mensagens recebidas pelo alvo",
+                format="%d",  # ✅ Formato numérico sem decimais
+                width=67
+            ),
+            "total_mensagens": st.column_config.NumberColumn(
+                "Total",
+                help="Total de mensagens na conversa",
+                format="%d",  # ✅ Formato numérico sem decimais
+                width=60
+            )
+        }
+    )
+
+    # Exportação do resultado completo (não apenas da página exibida)
+    export_download(
+        'messages_export',
+        lambda: stream_conversations(operation_id, target_messages, date_message),
+        file_name=f"conversas_{target_messages}",
+        filters=(operation_id, target_messages, str(date_message))
+    )
 
 
 ################  LÓGICA SIDEBAR  ###############
@@ -302,10 +281,11 @@ with st.sidebar:
     st.write('')
     st.write('')
     nome_operacao = get_operacao()
+    operation_id = get_current_op_id()
     st.header(f'Operação: {nome_operacao}', divider='red')
 
-    if nome_operacao:
-        target_messages_options = get_targets(nome_operacao)
+    if nome_operacao and operation_id:
+        target_messages_options = get_targets(operation_id)
         target_messages_options.insert(0, '')
         
         if not target_messages_options:
@@ -320,7 +300,7 @@ with st.sidebar:
             index=0
         )
 
-        date_messages_tuple = get_date_messages(nome_operacao, target_messages)
+        date_messages_tuple = get_date_messages(operation_id, target_messages)
         
         if date_messages_tuple == (None, None) and target_messages != '':
             st.warning("Nenhuma mensagem encontrada para este alvo.")
@@ -357,8 +337,9 @@ with st.sidebar:
 ################  LÓGICA CENTRAL  ###############
 
 nome_operacao = get_operacao()
+operation_id = get_current_op_id()
 
-if not nome_operacao:
+if not nome_operacao or not operation_id:
     st.error("Por favor, selecione uma Operação para habilitar os filtros na barra lateral.", icon="🚨")
     st.error("Administração > Configurações > Selecionar operação.", icon="🚨")
     st.stop()
@@ -377,10 +358,10 @@ if 'btn_get_messages' in locals() and btn_get_messages and 'target_messages' in
         
         # Mostrar spinner enquanto processa
         with st.spinner('Buscando mensagens...'):
-            # CHAMAR A FUNÇÃO E CAPTURAR O RESULTADO
-            df_messages = get_data_messages(**message_filter)
+            # Totais do resumo; a tabela busca uma página por vez
+            total_conversations, total_sent, total_received = get_messages_totals(operation_id, **message_filter)
         
-        if not df_messages.empty:
+        if total_conversations:
             st.markdown("""
     <style>
     /* Centralizar métricas */
@@ -425,61 +406,15 @@ if 'btn_get_messages' in locals() and btn_get_messages and 'target_messages' in
             # Métricas resumidas no topo
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("Total de Conversas", len(df_messages))
+                st.metric("Total de Conversas", total_conversations)
             with col2:
-                st.metric("Mensagens Enviadas", df_messages['quantidade_enviadas'].sum())
+                st.metric("Mensagens Enviadas", total_sent)
             with col3:
-                st.metric("Mensagens Recebidas", df_messages['quantidade_recebidas'].sum())
+                st.metric("Mensagens Recebidas", total_received)
             with col4:
-                st.metric("Total de Mensagens", df_messages['total_mensagens'].sum())
+                st.metric("Total de Mensagens", total_sent + total_received)
             
-            
-            # Exibir o DataFrame com configurações de centralização
-            st.dataframe(
-                df_messages, 
-                use_container_width=True,
-                hide_index=True,
-                column_config={
-                    "sender": st.column_config.TextColumn(
-                        "Remetente",
-                        help="Número do remetente",
-                        width=104
-                    ),
-                    "recipient": st.column_config.TextColumn(
-                        "Destinatário", 
-                        help="Número do destinatário",
-                        width=104
-                    ),
-                    "group_id": st.column_config.TextColumn(
-                        "ID do Grupo",
-                        help="Identificador do grupo",
-                        width=140
-                    ),
-                    "nome_grupo": st.column_config.TextColumn(
-                        "Nome do Grupo",
-                        help="Nome ou descrição do grupo",
-                        width=250
-                    ),
-                    "quantidade_enviadas": st.column_config.NumberColumn(
-                        "Enviadas",
-                        help="Quantidade de mensagens enviadas pelo alvo",
-                        format="%d",  # ✅ Formato numérico sem decimais
-                        width=62
-                    ),
-                    "quantidade_recebidas": st.column_config.NumberColumn(
-                        "Recebidas", 
-                        help="Quantidade de mensagens recebidas pelo alvo",
-                        format="%d",  # ✅ Formato numérico sem decimais
-                        width=67
-                    ),
-                    "total_mensagens": st.column_config.NumberColumn(
-                        "Total",
-                        help="Total de mensagens na conversa",
-                        format="%d",  # ✅ Formato numérico sem decimais
-                        width=60
-                    )
-                }
-            )
+            render_conversations(operation_id, target_messages, date_message, total_conversations)
         else:
             st.info("Nenhuma mensagem encontrada para os filtros selecionados.", icon="ℹ️")
     else:
@@ -1,8 +1,10 @@
 import streamlit as st
-from settings import get_operacao, PROJECT_ROOT
-from db.models import Operation, File, Message, file_contacts, Contact, operation_targets, Target
+from settings import get_operacao, get_current_op_id, PROJECT_ROOT
+from query_cache import cached_by_operation
+from db.models import Operation
 from db.session import get_session
-import pandas as pd
+from db.operation_metrics import get_operation_metrics_snapshot, refresh_operation_metrics
+from db.frames import frame_from_columns
 import os
 
 
@@ -28,109 +30,50 @@ def get_operation_data(nome_operacao):
             return None
         
 
-def get_operation_metrics(nome_operacao):
-    '''Buscar todas as métricas da operação'''
+@cached_by_operation
+def get_operation_metrics(operation_id):
+    '''Buscar todas as métricas da operação (snapshot materializado em operation_metrics)'''
     
-    if not nome_operacao:
+    if not operation_id:
         return None
-        
-    with get_session() as session:
-        from sqlalchemy import func, distinct
-        
-        # Buscar operação
-        operation = session.query(Operation).filter(Operation.name == nome_operacao).first()
-        
-        if not operation:
-            return None
-            
-        op_id = operation.operation_id
-        
-        # 1. Número de Targets (Alvos)
-        num_targets = session.query(func.count(Target.target_id)).join(
-            operation_targets, Target.target_id == operation_targets.c.target_id
-        ).filter(operation_targets.c.operation_id == op_id).scalar()
-        
-        # 2. Número de Files (Arquivos)
-        num_files = session.query(func.count(File.file_id)).filter(
-            File.operation_id == op_id
-        ).scalar()
-        
-        # 3. Número de Grupos únicos
-        num_groups = session.query(func.count(distinct(Message.group_id))).join(
-            File, Message.file_id == File.file_id
-        ).filter(
-            File.operation_id == op_id,
-            Message.group_id.isnot(None)
-        ).scalar()
-        
-        # 4. Número total de Mensagens
-        num_messages = session.query(func.count(Message.message_id)).join(
-            File, Message.file_id == File.file_id
-        ).filter(File.operation_id == op_id).scalar()
-        
-        # 5. Número de Contatos únicos
-        num_contacts = session.query(func.count(distinct(Contact.contact_phone))).join(
-            file_contacts, Contact.contact_id == file_contacts.c.contact_id
-        ).join(
-            File, file_contacts.c.file_id == File.file_id
-        ).filter(File.operation_id == op_id).scalar()
-        
-        # 6. Período de dados (primeira e última mensagem)
-        date_range = session.query(
-            func.min(Message.timestamp).label('start_date'),
-            func.max(Message.timestamp).label('end_date')
-        ).join(File, Message.file_id == File.file_id).filter(
-            File.operation_id == op_id
-        ).first()
-        
-        # 7. Número de IPs únicos
-        num_ips = session.query(func.count(distinct(Message.sender_ip))).join(
-            File, Message.file_id == File.file_id
-        ).filter(
-            File.operation_id == op_id,
-            Message.sender_ip.isnot(None)
-        ).scalar()
-        
-        # 8. Files por status
-        files_by_status = session.query(
-            File.process_status,
-            func.count(File.file_id).label('count')
-        ).filter(File.operation_id == op_id).group_by(File.process_status).all()
-        
-        # 9. Mensagens por tipo
-        messages_by_type = session.query(
-            Message.message_type,
-            func.count(Message.message_id).label('count')
-        ).join(File, Message.file_id == File.file_id).filter(
-            File.operation_id == op_id
-        ).group_by(Message.message_type).all()
-        
-        # 10. Top 5 targets mais ativos
-        top_targets = session.query(
-            Target.target,
-            func.count(Message.message_id).label('msg_count')
-        ).join(
-            operation_targets, Target.target_id == operation_targets.c.target_id
-        ).join(
-            File, File.target_id == Target.target_id
-        ).join(
-            Message, Message.file_id == File.file_id
-        ).filter(
-            operation_targets.c.operation_id == op_id
-        ).group_by(Target.target).order_by(func.count(Message.message_id).desc()).limit(5).all()
-        
-        return {
-            'num_targets': num_targets or 0,
-            'num_files': num_files or 0,
-            'num_groups': num_groups or 0,
-            'num_messages': num_messages or 0,
-            'num_contacts': num_contacts or 0,
-            'num_ips': num_ips or 0,
-            'date_range': date_range,
-            'files_by_status': files_by_status,
-            'messages_by_type': messages_by_type,
-            'top_targets': top_targets
-        }
+    
+    return get_operation_metrics_snapshot(operation_id)
+
+
+@cached_by_operation
+def get_distribution_frame(operation_id, metric, label, empty_label):
+    '''DataFrame (rótulo, quantidade) de uma distribuição do snapshot (files_by_status, messages_by_type)'''
+    metrics = get_operation_metrics(operation_id)
+    rows = metrics[metric] if metrics else []
+    return frame_from_columns(
+        [label, 'Quantidade'],
+        [(value or empty_label, count) for value, count in rows],
+        categories=(label,)
+    )
+
+
+################  COMPONENTES  ###############
+################  COMPONENTES  ###############
+################  COMPONENTES  ###############
+
+@st.fragment
+def render_distribution(operation_id, metric, title, label, empty_label, empty_message):
+    '''Gráfico de uma distribuição (fragmento: alternar gráfico/tabela não reexecuta o dashboard)'''
+    st.markdown(title)
+    df = get_distribution_frame(operation_id, metric, label, empty_label)
+
+    if df.empty:
+        st.info(empty_message)
+        return
+
+    exibir = st.segmented_control(
+        "Exibir como", options=['Gráfico', 'Tabela'], default='Gráfico', key=f"dashboard_{metric}"
+    ) or 'Gráfico'
+
+    if exibir == 'Gráfico':
+        st.bar_chart(df.set_index(label))
+    else:
+        st.dataframe(df, use_container_width=True, hide_index=True)
     
 
 ################  LÓGICA SIDEBAR  ###############
@@ -177,8 +120,13 @@ with st.sidebar:
     st.header(f'Criada em:')
     st.markdown(f'_{data}_')
 
-    if nome_operacao:
-        print('teste')
+    if nome_operacao and op_data.get('id'):
+        st.write('')
+        # Reconciliação: recalcula o snapshot direto das tabelas de dados
+        if st.button("🔄 Recalcular métricas", type="tertiary"):
+            with st.spinner('Recalculando métricas...'):
+                refresh_operation_metrics(op_data['id'])
+            st.rerun()
 
 
 ################## lÓGICA DA ÁREA CENTRAL ##################
@@ -271,7 +219,7 @@ if not nome_operacao:
 
 # BUSCAR MÉTRICAS DA OPERAÇÃO
 with st.spinner('Carregando métricas da operação...'):
-    metrics = get_operation_metrics(nome_operacao)
+    metrics = get_operation_metrics(get_current_op_id())
 
 if not metrics:
     st.error("❌ Não foi possível carregar as métricas da operação.")
@@ -279,6 +227,8 @@ if not metrics:
 
 # MÉTRICAS PRINCIPAIS (4 colunas)
 st.markdown("### 📈 Métricas Principais")
+if metrics.get('refreshed_at'):
+    st.caption(f"Versão {metrics['version']} · atualizado em {metrics['refreshed_at'].strftime('%d/%m/%Y %H:%M:%S')}")
 col1, col2, col3, col4 = st.columns(4)
 
 with col1:
@@ -332,37 +282,21 @@ st.markdown("---")
 col1, col2 = st.columns(2)
 
 with col1:
-    st.markdown("### 📊 Status dos Arquivos")
-    if metrics['files_by_status']:
-        
-        status_df = pd.DataFrame([
-            {'Status': status or 'Sem Status', 'Quantidade': count} 
-            for status, count in metrics['files_by_status']
-        ])
-        
-        st.bar_chart(status_df.set_index('Status'))
-    else:
-        st.info("Nenhum dado de status encontrado.")
+    render_distribution(
+        get_current_op_id(), 'files_by_status', "### 📊 Status dos Arquivos",
+        'Status', 'Sem Status', "Nenhum dado de status encontrado."
+    )
 
 with col2:
-    st.markdown("### 💬 Tipos de Mensagem")
-    if metrics['messages_by_type']:
-        type_df = pd.DataFrame([
-            {'Tipo': msg_type or 'Sem Tipo', 'Quantidade': count} 
-            for msg_type, count in metrics['messages_by_type']
-        ])
-        
-        st.bar_chart(type_df.set_index('Tipo'))
-    else:
-        st.info("Nenhum dado de tipo encontrado.")
+    render_distribution(
+        get_current_op_id(), 'messages_by_type', "### 💬 Tipos de Mensagem",
+        'Tipo', 'Sem Tipo', "Nenhum dado de tipo encontrado."
+    )
 
 # TOP TARGETS MAIS ATIVOS
 st.markdown("### 🏆 Top 5 Alvos Mais Ativos")
 if metrics['top_targets']:
-    targets_df = pd.DataFrame([
-        {'Alvo': target, 'Mensagens': count} 
-        for target, count in metrics['top_targets']
-    ])
+    targets_df = frame_from_columns(['Alvo', 'Mensagens'], [tuple(row) for row in metrics['top_targets']])
     
     st.dataframe(
         targets_df, 
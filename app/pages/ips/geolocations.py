@@ -1,12 +1,20 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
-import plotly.express as px
-import folium
-from streamlit_folium import st_folium
 from sqlalchemy import func
 from settings import get_operacao, get_current_op_id, PROJECT_ROOT
+from query_cache import cached_by_operation, get_data_version
+from map_cache import map_cache
+from prefix_search import prefix_select
+from paginated_table import paginated_table
+from export_download import export_download
 from db.session import get_session
-from db.models import Message, File, IP
+from db.models import Message, File
+from db.geo import bounds_to_area
+from db.ip_activity import IPActivityQuery
+from db.pagination import PAGE_SIZE
+from db.frames import records_frame
+from db.enrichment_queue import prioritize_ips, pending_ips_for_sender
 import os
 from datetime import date
 
@@ -15,24 +23,7 @@ from datetime import date
 ################  FUNÇÕES DE CONSULTA  ###############
 ################  FUNÇÕES DE CONSULTA  ###############
 
-def get_senders(operation_id):
-    '''Retorna uma lista de senders únicos baseado na operação corrente'''
-    try:
-        with get_session() as session:
-            senders = session.query(Message.sender).join(
-                File, Message.file_id == File.file_id
-            ).filter(
-                File.operation_id == operation_id,
-                Message.sender.isnot(None),
-                Message.sender != ''
-            ).distinct().order_by(Message.sender).all()
-            
-            return [sender[0] for sender in senders if sender[0]]
-    except Exception as e:
-        print(f"❌ Erro ao buscar senders: {e}")
-        return []
-
-
+@cached_by_operation
 def get_date_for_ips(operation_id, sender_for_ip):
     '''Retorna uma tupla contendo as datas do primeiro e último registro de mensagens para o sender na operação atual'''
     try:
@@ -41,8 +32,8 @@ def get_date_for_ips(operation_id, sender_for_ip):
             
         with get_session() as session:
             dates = session.query(
-                func.min(func.date(Message.timestamp)),
-                func.max(func.date(Message.timestamp))
+                func.date(func.min(Message.timestamp)),
+                func.date(func.max(Message.timestamp))
             ).join(
                 File, Message.file_id == File.file_id
             ).filter(
@@ -60,128 +51,528 @@ def get_date_for_ips(operation_id, sender_for_ip):
         return (None, None)
 
 
-def get_ip_data_for_map(operation_id, sender_for_ip, date_range):
-    '''Retorna dados de IPs para plotagem no mapa baseado na operação corrente'''
+def normalize_date_range(date_range):
+    '''Retorna o intervalo como tupla (início, fim) ou None se incompleto'''
+    if isinstance(date_range, (tuple, list)) and len(date_range) == 2:
+        return tuple(date_range)
+    return None
+
+
+@cached_by_operation
+def get_ip_data_for_map(operation_id, sender_for_ip, date_range, area=None):
+    '''Retorna o agregado por IP (mensagens, primeira/última ocorrência) para plotagem no mapa, opcionalmente restrito a uma área'''
+    date_range = normalize_date_range(date_range)
+    if not date_range:
+        return []
+
     try:
-        # Validar date_range
-        if isinstance(date_range, tuple) and len(date_range) == 2:
-            start_date, end_date = date_range
-        elif hasattr(date_range, '__iter__') and len(date_range) == 2:
-            start_date, end_date = date_range[0], date_range[1]
-        else:
-            return []
-        
-        with get_session() as session:
-            # Query simplificada que funciona
-            messages_with_ip = session.query(
-                Message.sender,
-                Message.sender_ip,
-                Message.timestamp,
-                IP.city,
-                IP.region_name,
-                IP.country,
-                IP.latitude,
-                IP.longitude,
-                IP.isp,
-                IP.org
-            ).join(
-                File, Message.file_id == File.file_id
-            ).join(
-                IP, Message.sender_ip == IP.sender_ip
-            ).filter(
-                File.operation_id == operation_id,
-                Message.sender == sender_for_ip,
-                Message.sender_ip.isnot(None),
-                Message.sender_ip != '',
-                func.date(Message.timestamp) >= start_date,
-                func.date(Message.timestamp) <= end_date,
-                IP.latitude.isnot(None),
-                IP.longitude.isnot(None)
-            ).all()
-            
-            # Agrupar dados manualmente
-            from collections import defaultdict
-            grouped_data = defaultdict(lambda: {'count': 0, 'data': None})
-            
-            for row in messages_with_ip:
-                key = (row.sender_ip, row.city, row.country, row.latitude, row.longitude)
-                grouped_data[key]['count'] += 1
-                if grouped_data[key]['data'] is None:
-                    grouped_data[key]['data'] = row
-            
-            # Converter para formato esperado
-            result = []
-            for key, value in grouped_data.items():
-                row_data = value['data']
-                result.append({
-                    'sender': row_data.sender,
-                    'sender_ip': row_data.sender_ip,
-                    'city': row_data.city,
-                    'region_name': row_data.region_name,
-                    'country': row_data.country,
-                    'latitude': float(row_data.latitude),
-                    'longitude': float(row_data.longitude),
-                    'isp': row_data.isp,
-                    'org': row_data.org,
-                    'message_count': value['count']
-                })
-            
-            return result
-            
+        return IPActivityQuery(operation_id, sender_for_ip, date_range, area).aggregate()
     except Exception as e:
         print(f"❌ Erro ao buscar dados de IP para mapa: {e}")
         return []
 
 
-def get_detailed_messages_by_ip(operation_id, sender_for_ip, date_range):
-    '''Retorna mensagens detalhadas por IP para o dataframe'''
+@cached_by_operation
+def get_daily_message_counts(operation_id, sender_for_ip, date_range, area=None):
+    '''Retorna a quantidade de mensagens por dia para o gráfico temporal'''
+    date_range = normalize_date_range(date_range)
+    if not date_range:
+        return []
+
     try:
-        if isinstance(date_range, tuple) and len(date_range) == 2:
-            start_date, end_date = date_range
-        elif hasattr(date_range, '__iter__') and len(date_range) == 2:
-            start_date, end_date = date_range[0], date_range[1]
-        else:
-            return []
-        
-        with get_session() as session:
-            messages = session.query(
-                Message.message_id,
-                Message.sender,
-                Message.sender_ip,
-                Message.timestamp,
-                Message.sender_device,
-                Message.message_type,
-                IP.city,
-                IP.region_name,
-                IP.country,
-                IP.latitude,
-                IP.longitude,
-                IP.isp,
-                IP.org,
-                IP.continent
-            ).join(
-                File, Message.file_id == File.file_id
-            ).join(
-                IP, Message.sender_ip == IP.sender_ip
-            ).filter(
-                File.operation_id == operation_id,
-                Message.sender == sender_for_ip,
-                Message.sender_ip.isnot(None),
-                Message.sender_ip != '',
-                func.date(Message.timestamp) >= start_date,
-                func.date(Message.timestamp) <= end_date
-            ).order_by(Message.timestamp.desc()).all()
-            
-            return messages
+        return IPActivityQuery(operation_id, sender_for_ip, date_range, area).daily_counts()
     except Exception as e:
-        print(f"❌ Erro ao buscar mensagens detalhadas: {e}")
+        print(f"❌ Erro ao buscar distribuição temporal: {e}")
         return []
 
 
+@cached_by_operation
+def get_detailed_messages_page(operation_id, sender_for_ip, date_range, area=None, after=None):
+    '''Retorna uma página das mensagens detalhadas por IP e o cursor da próxima página'''
+    date_range = normalize_date_range(date_range)
+    if not date_range:
+        return [], None
+
+    try:
+        return IPActivityQuery(operation_id, sender_for_ip, date_range, area).detail_page(after)
+    except Exception as e:
+        print(f"❌ Erro ao buscar mensagens detalhadas: {e}")
+        return [], None
+
+
+@cached_by_operation
+def get_detailed_messages_count(operation_id, sender_for_ip, date_range, area=None):
+    '''Retorna o total de mensagens detalhadas por IP (mesmos filtros da paginação)'''
+    date_range = normalize_date_range(date_range)
+    if not date_range:
+        return 0
+
+    try:
+        return IPActivityQuery(operation_id, sender_for_ip, date_range, area).detail_count()
+    except Exception as e:
+        print(f"❌ Erro ao contar mensagens detalhadas: {e}")
+        return 0
+
+
+@cached_by_operation
+def get_location_summary(operation_id, sender_for_ip, date_range, area=None):
+    '''Retorna as mensagens somadas por país e por ISP (DataFrames em ordem decrescente)'''
+    df_chart = pd.DataFrame(get_ip_data_for_map(operation_id, sender_for_ip, date_range, area))
+    if df_chart.empty:
+        empty = pd.DataFrame(columns=['message_count'])
+        return empty, empty
+
+    country_data = df_chart.groupby('country')['message_count'].sum().reset_index()
+    country_data = country_data.sort_values('message_count', ascending=False)
+
+    isp_data = df_chart.groupby('isp')['message_count'].sum().reset_index()
+    isp_data = isp_data.sort_values('message_count', ascending=False)
+    return country_data, isp_data
+
+
+def compute_map_view(ip_data):
+    '''Retorna (latitude, longitude, zoom) iniciais do mapa conforme a dispersão dos pontos'''
+    latitudes = [item['latitude'] for item in ip_data if item['latitude'] is not None]
+    longitudes = [item['longitude'] for item in ip_data if item['longitude'] is not None]
+
+    if not latitudes or not longitudes:
+        return -15.7801, -47.9292, 6  # Brasília como padrão
+
+    # Calcular centro geográfico
+    center_lat = sum(latitudes) / len(latitudes)
+    center_lon = sum(longitudes) / len(longitudes)
+
+    # Determinar zoom baseado na dispersão dos pontos
+    max_range = max(max(latitudes) - min(latitudes), max(longitudes) - min(longitudes))
+
+    if max_range < 0.01:
+        zoom_level = 12  # Pontos muito próximos
+    elif max_range < 0.1:
+        zoom_level = 10
+    elif max_range < 1:
+        zoom_level = 8
+    elif max_range < 5:
+        zoom_level = 6
+    else:
+        zoom_level = 4   # Pontos muito espalhados
+
+    return center_lat, center_lon, zoom_level
+
+
+def build_folium_map(ip_data, center_lat, center_lon, zoom_level, fit_bounds=True):
+    '''Monta o mapa folium com um marcador (agrupado em MarkerCluster) por IP'''
+    import folium
+    from folium.plugins import MarkerCluster
+
+    max_messages = max(item['message_count'] for item in ip_data)
+
+    # Criar mapa base com configurações otimizadas
+    m = folium.Map(
+        location=[center_lat, center_lon],
+        zoom_start=zoom_level,
+        tiles="OpenStreetMap",
+        width='100%',
+        height='600px'
+    )
+
+    # ADICIONAR MARKER CLUSTER
+    cluster = MarkerCluster(
+        name="IPs Cluster",
+        overlay=True,
+        control=True,
+        options={
+            'disableClusteringAtZoom': 15,  # Desagrupar em zoom alto
+            'maxClusterRadius': 50,         # Raio máximo do cluster
+            'spiderfyOnMaxZoom': True,      # Expandir em zoom máximo
+            'showCoverageOnHover': False,   # Não mostrar área de cobertura
+            'zoomToBoundsOnClick': True     # Zoom ao clicar no cluster
+        }
+    ).add_to(m)
+
+    # Adicionar marcadores com cluster
+    for i, item in enumerate(ip_data):
+
+        # Popup com informações detalhadas
+        popup_html = f"""
+        <div style="width: 320px; font-family: Arial, sans-serif;">
+            <div style="background: linear-gradient(135deg, #B0E0E6 0%, #5F9EA0 100%); 
+                        color: black; padding: 12px; border-radius: 8px 8px 8px 8px; margin: 10px -5px -10px -10px;">
+                <h3 style="margin: 0; font-size: 16px; text-align: center;"><b>{item['sender_ip']}</b></h3>
+            </div>
+            <div style="padding: 8px; line-height: 1.3; margin-left: -12px">
+                <p style="margin: 6px 0;"><b>Localização:</b> {item['city']}, {item['country']}</p>
+                <p style="margin: 6px 0;"><b>ISP:</b> {item['isp'] or 'N/A'}</p>
+                <p style="margin: 6px 0;"><b>Organização:</b> {item['org'] or 'N/A'}</p>
+                <p style="margin: 6px 0;"><b>Mensagens:</b> {item['message_count']}</p>
+                <p style="margin: 6px 0;"><b>Coordenadas:</b> {item['latitude']:.4f}, {item['longitude']:.4f}</p>
+            </div>
+        </div>
+        """
+
+        # Criar popup
+        popup = folium.Popup(popup_html, max_width=340)
+
+        # Definir cor baseada na intensidade de mensagens
+        ratio = item['message_count'] / max_messages
+
+        if ratio > 0.8:
+            icon = folium.Icon(color='red', icon='map-marker', prefix='fa')
+        elif ratio > 0.6:
+            icon = folium.Icon(color='orange', icon='map-marker', prefix='fa')
+        elif ratio > 0.4:
+            icon = folium.Icon(color='beige', icon='map-marker', prefix='fa')
+        elif ratio > 0.2:
+            icon = folium.Icon(color='green', icon='map-marker', prefix='fa')
+        else:
+            icon = folium.Icon(color='blue', icon='map-marker', prefix='fa')
+
+        # Verificar se as coordenadas são válidas
+        if -90 <= item['latitude'] <= 90 and -180 <= item['longitude'] <= 180:
+            # Adicionar marcador ao cluster
+            folium.Marker(
+                location=[item['latitude'], item['longitude']],
+                popup=popup,
+                icon=icon,
+                tooltip=f"IP: {item['sender_ip']} | {item['city']}, {item['country']} | {item['message_count']} mensagens"
+            ).add_to(cluster)
+        else:
+            st.warning(f"⚠️ Coordenadas inválidas para IP {item['sender_ip']}: {item['latitude']}, {item['longitude']}")
+
+    # ADICIONAR CONTROLE DE CAMADAS
+    folium.LayerControl().add_to(m)
+
+    # AJUSTAR VISUALIZAÇÃO PARA MOSTRAR TODOS OS PONTOS
+    if fit_bounds and len(ip_data) > 1:
+        # Criar bounds para incluir todos os pontos
+        coordinates = [[item['latitude'], item['longitude']] for item in ip_data 
+                       if -90 <= item['latitude'] <= 90 and -180 <= item['longitude'] <= 180]
+
+        if coordinates:
+            m.fit_bounds(coordinates, padding=(20, 20))
+
+    return m
+
+
+################  COMPONENTES  ###############
+################  COMPONENTES  ###############
+################  COMPONENTES  ###############
+
+# Cada componente é um st.fragment: interações dentro dele reexecutam apenas o próprio componente,
+# e as consultas que ele faz são memorizadas (cached_by_operation), sem voltar ao banco.
+
+AGRUPAMENTOS_TEMPORAIS = {'Dia': 'D', 'Semana': 'W', 'Mês': 'MS'}
+
+# Colunas da tabela detalhada (nome na consulta -> título) e as exibidas como categoria
+DETAIL_COLUMNS = {
+    'message_id': 'ID Mensagem',
+    'sender': 'Sender',
+    'sender_ip': 'IP',
+    'timestamp': 'Data/Hora',
+    'sender_device': 'Dispositivo',
+    'message_type': 'Tipo',
+    'city': 'Cidade',
+    'region_name': 'Estado/Região',
+    'country': 'País',
+    'latitude': 'Latitude',
+    'longitude': 'Longitude',
+    'isp': 'ISP',
+    'org': 'Organização',
+    'continent': 'Continente'
+}
+DETAIL_CATEGORIES = ('sender', 'sender_ip', 'sender_device', 'message_type', 'city', 'region_name',
+                     'country', 'isp', 'org', 'continent')
+
+
+@st.fragment
+def render_map(operation_id, sender_for_ip, date_range, area, filtro_espacial, modo_mapa):
+    '''Mapa dos IPs (fragmento: pan, zoom, clique e agrupamento reexecutam apenas o mapa)'''
+    ip_data = get_ip_data_for_map(operation_id, sender_for_ip, date_range, area)
+    center_lat, center_lon, zoom_level = compute_map_view(ip_data)
+
+    # No filtro por área visível, preservar o enquadramento escolhido pelo usuário
+    geo_view = st.session_state.get('geo_view') if filtro_espacial == FILTRO_VIEWPORT else None
+    if geo_view:
+        center_lat, center_lon = geo_view['center']
+        zoom_level = geo_view['zoom']
+
+    usar_webgl = modo_mapa == MAPA_WEBGL or (modo_mapa == MAPA_AUTOMATICO and len(ip_data) > MAX_MARCADORES)
+
+    if usar_webgl:
+        # MAPA WEBGL: pontos agrupados no servidor (grade proporcional ao zoom) e desenhados pela GPU
+        import numpy as np
+        import pydeck as pdk
+        from map_clustering import cluster_points
+
+        cluster_zoom = st.slider(
+            "🔍 Nível de agrupamento (zoom)",
+            min_value=1,
+            max_value=18,
+            value=int(zoom_level),
+            help="Quanto maior, menores as células da grade e mais pontos individuais no mapa."
+        )
+        clusters, cluster_of_ip = cluster_points(ip_data, cluster_zoom)
+
+        # Cor e tamanho pela intensidade de mensagens (mesma escala dos marcadores)
+        ratio = clusters['message_count'] / max(int(clusters['message_count'].max()), 1)
+        clusters['radius'] = 6 + 24 * np.sqrt(ratio)
+        clusters['color'] = [
+            [220, 20, 60, 190] if r > 0.8 else
+            [255, 140, 0, 190] if r > 0.6 else
+            [255, 215, 0, 190] if r > 0.4 else
+            [60, 179, 113, 190] if r > 0.2 else
+            [30, 144, 255, 190]
+            for r in ratio
+        ]
+
+        deck = pdk.Deck(
+            layers=[
+                pdk.Layer(
+                    "ScatterplotLayer",
+                    id="ip_clusters",
+                    data=clusters,
+                    get_position='[longitude, latitude]',
+                    get_radius='radius',
+                    radius_units='pixels',
+                    get_fill_color='color',
+                    pickable=True,
+                    stroked=True,
+                    get_line_color=[0, 0, 0, 120],
+                    line_width_min_pixels=1
+                )
+            ],
+            initial_view_state=pdk.ViewState(latitude=center_lat, longitude=center_lon, zoom=cluster_zoom),
+            map_provider="carto",
+            map_style="light",
+            tooltip={"text": "{label}\n{message_count} mensagens"}
+        )
+
+        event = st.pydeck_chart(deck, height=600, on_select="rerun", selection_mode="single-object", key="geo_deck")
+        st.caption(f"🧩 {len(ip_data)} IPs agrupados em {len(clusters)} pontos. Clique em um ponto para ver os detalhes.")
+
+        # Detalhes carregados apenas para o ponto clicado
+        selecionados = event.selection.objects.get("ip_clusters", []) if event and event.selection else []
+        if selecionados:
+            cluster_id = selecionados[0]['cluster_id']
+            membros = [ip_data[i] for i in np.flatnonzero(cluster_of_ip == cluster_id)]
+            membros.sort(key=lambda item: item['message_count'], reverse=True)
+
+            st.markdown(f"#### 📍 Ponto selecionado: {selecionados[0]['label']}")
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        'IP': item['sender_ip'],
+                        'Cidade': item['city'],
+                        'País': item['country'],
+                        'ISP': item['isp'] or 'N/A',
+                        'Organização': item['org'] or 'N/A',
+                        'Mensagens': item['message_count'],
+                        'Primeira ocorrência': item['first_seen'],
+                        'Última ocorrência': item['last_seen']
+                    }
+                    for item in membros
+                ]),
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "Primeira ocorrência": st.column_config.DatetimeColumn(format="DD/MM/YYYY HH:mm:ss"),
+                    "Última ocorrência": st.column_config.DatetimeColumn(format="DD/MM/YYYY HH:mm:ss")
+                }
+            )
+
+    elif filtro_espacial == FILTRO_VIEWPORT:
+        # Filtro por área visível: o mapa precisa devolver bounds/centro/zoom (st_folium)
+        from streamlit_folium import st_folium
+
+        m = build_folium_map(ip_data, center_lat, center_lon, zoom_level, fit_bounds=not geo_view)
+        map_data = st_folium(
+            m, 
+            width=None,  # Usar largura total do container
+            height=600,
+            returned_objects=["bounds", "center", "zoom"]
+        )
+
+        # Pan/zoom com filtro por área visível: buscar novamente apenas os IPs do novo enquadramento
+        if map_data:
+            viewport = bounds_to_area(map_data.get('bounds'))
+            if viewport and viewport != st.session_state.get('geo_viewport'):
+                st.session_state['geo_viewport'] = viewport
+                if map_data.get('center') and map_data.get('zoom'):
+                    st.session_state['geo_view'] = {
+                        'center': (map_data['center']['lat'], map_data['center']['lng']),
+                        'zoom': map_data['zoom']
+                    }
+                # A área do filtro é lida na barra lateral: rerun da página inteira
+                st.rerun(scope="app")
+
+    else:
+        # Sem retorno de pan/zoom: o HTML renderizado é reaproveitado do cache em disco
+        cache_key = map_cache.fingerprint(
+            operation_id=operation_id,
+            data_version=get_data_version(operation_id),
+            sender=sender_for_ip,
+            date_range=date_range,
+            area=area,
+            render='folium-markercluster'
+        )
+        map_html = map_cache.get(cache_key)
+        if map_html is None:
+            m = build_folium_map(ip_data, center_lat, center_lon, zoom_level)
+            map_html = m.get_root().render()
+            map_cache.put(cache_key, map_html)
+
+        components.html(map_html, height=600)
+
+
+@st.fragment
+def render_location_charts(operation_id, sender_for_ip, date_range, area):
+    '''Gráficos por país e ISP (fragmento: trocar a quantidade de ISPs não reexecuta a página)'''
+    import plotly.express as px
+
+    country_data, isp_data = get_location_summary(operation_id, sender_for_ip, date_range, area)
+
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        # Gráfico de pizza por país
+        if len(country_data) > 0:
+            fig_country = px.pie(
+                country_data,
+                values='message_count',
+                names='country',
+                title="Distribuição de Mensagens por País",
+                color_discrete_sequence=px.colors.qualitative.Set3
+            )
+            fig_country.update_traces(textposition='inside', textinfo='percent+label')
+            st.plotly_chart(fig_country, use_container_width=True)
+    
+    with col2:
+        # Gráfico de barras por ISP (top N)
+        top_isps = st.select_slider("Quantidade de ISPs", options=[5, 10, 20, 50], value=10)
+        isp_data = isp_data.head(top_isps)
+
+        if len(isp_data) > 0:
+            fig_isp = px.bar(
+                isp_data,
+                x='message_count',
+                y='isp',
+                orientation='h',
+                title=f"Top {top_isps} ISPs por Mensagens",
+                color='message_count',
+                color_continuous_scale='Viridis'
+            )
+            fig_isp.update_layout(
+                yaxis={'categoryorder':'total ascending'},
+                showlegend=False
+            )
+            st.plotly_chart(fig_isp, use_container_width=True)
+
+
+@st.fragment
+def render_detail_table(operation_id, sender_for_ip, date_range, area):
+    '''Mensagens detalhadas, paginadas (fragmento: trocar de página reexecuta apenas a tabela)'''
+    # Total contado com os mesmos filtros das páginas (o agregado do mapa só tem IPs geolocalizados)
+    total = get_detailed_messages_count(operation_id, sender_for_ip, date_range, area)
+
+    def to_dataframe(detailed_messages):
+        # Colunas tipadas (Arrow); textos repetidos na página codificados como categoria
+        return records_frame(detailed_messages, categories=DETAIL_CATEGORIES).rename(columns=DETAIL_COLUMNS)
+
+    has_rows = paginated_table(
+        'geo_detail',
+        lambda after: get_detailed_messages_page(operation_id, sender_for_ip, date_range, area, after),
+        filters=(operation_id, sender_for_ip, tuple(date_range), str(area)),
+        to_dataframe=to_dataframe,
+        total=total,
+        page_size=PAGE_SIZE,
+        column_config={
+            "Data/Hora": st.column_config.DatetimeColumn(
+                "Data/Hora",
+                format="DD/MM/YYYY HH:mm:ss"
+            ),
+            "Latitude": st.column_config.NumberColumn(
+                "Latitude",
+                format="%.6f"
+            ),
+            "Longitude": st.column_config.NumberColumn(
+                "Longitude", 
+                format="%.6f"
+            )
+        }
+    )
+
+    if not has_rows:
+        st.info("Nenhuma mensagem detalhada encontrada para os filtros selecionados.")
+        return
+
+    # Exportação de todas as mensagens do filtro (não apenas da página exibida)
+    export_download(
+        'geo_detail_export',
+        lambda: (
+            df.rename(columns=DETAIL_COLUMNS)
+            for df in IPActivityQuery(operation_id, sender_for_ip, date_range, area).stream_details()
+        ),
+        file_name=f"mensagens_ip_{sender_for_ip}",
+        filters=(operation_id, sender_for_ip, tuple(date_range), str(area))
+    )
+
+
+@st.fragment
+def render_temporal_chart(operation_id, sender_for_ip, date_range, area):
+    '''Distribuição temporal das mensagens (fragmento: trocar o agrupamento não reexecuta a página)'''
+    temporal_rows = get_daily_message_counts(operation_id, sender_for_ip, date_range, area)
+
+    if temporal_rows:
+        import plotly.express as px
+
+        st.divider()
+        st.subheader("⏰ Distribuição Temporal das Mensagens")
+        
+        agrupamento = st.segmented_control(
+            "Agrupar por",
+            options=list(AGRUPAMENTOS_TEMPORAIS),
+            default='Dia'
+        ) or 'Dia'
+
+        temporal_data = pd.DataFrame(temporal_rows, columns=['Data', 'Quantidade'])
+        temporal_data['Data'] = pd.to_datetime(temporal_data['Data'])
+        if agrupamento != 'Dia':
+            temporal_data = temporal_data.resample(
+                AGRUPAMENTOS_TEMPORAIS[agrupamento], on='Data'
+            )['Quantidade'].sum().reset_index()
+
+        fig_temporal = px.line(
+            temporal_data,
+            x='Data',
+            y='Quantidade',
+            title=f"Mensagens por {agrupamento}",
+            markers=True
+        )
+        fig_temporal.update_layout(
+            xaxis_title="Data",
+            yaxis_title="Quantidade de Mensagens"
+        )
+        st.plotly_chart(fig_temporal, use_container_width=True)
+
+
 ################  LÓGICA SIDEBAR  ###############
 ################  LÓGICA SIDEBAR  ###############
 ################  LÓGICA SIDEBAR  ###############
 
+FILTRO_NENHUM = 'Nenhum'
+FILTRO_RAIO = 'Raio a partir de um ponto'
+FILTRO_VIEWPORT = 'Área visível do mapa'
+
+MAPA_AUTOMATICO = 'Automático'
+MAPA_MARCADORES = 'Marcadores (folium)'
+MAPA_WEBGL = 'WebGL agrupado (pydeck)'
+
+# Acima disso, o modo automático troca os marcadores folium pelo mapa WebGL agrupado no servidor
+MAX_MARCADORES = 1000
+
+filtro_espacial = FILTRO_NENHUM
+modo_mapa = MAPA_AUTOMATICO
+area = None
+
 with st.sidebar:
     st.markdown('''<style>
     div[data-testid="stSidebarHeader"] > img, 
@@ -218,24 +609,15 @@ with st.sidebar:
 
     # Filtros baseados na operação corrente
     if nome_operacao and operation_id:
-        sender_options = get_senders(operation_id)
-        
-        if not sender_options:
+        st.write('')
+        st.write('')
+        # Busca por prefixo: apenas os primeiros resultados vão para o selectbox
+        sender_for_ip = prefix_select("📱 Selecione um telefone:", operation_id, 'senders', key='geo_sender')
+
+        if sender_for_ip is None:
             st.warning("Nenhum sender encontrado para esta operação.")
-            sender_for_ip = None
             date_range = None
         else:
-            sender_options.insert(0, '')
-            
-            st.write('')
-            st.write('')
-            sender_for_ip = st.selectbox(
-                "📱 Selecione um telefone:", 
-                options=sender_options, 
-                placeholder='Escolha o telefone',
-                index=0
-            )
-
             if sender_for_ip and sender_for_ip != '':
                 date_for_ip_tuple = get_date_for_ips(operation_id, sender_for_ip)
                 
@@ -257,6 +639,42 @@ with st.sidebar:
                         date_range = (date_range, date_range)
                     elif len(date_range) == 1:
                         date_range = (date_range[0], date_range[0])
+
+                    # Renderização: marcadores folium (poucos IPs) ou pontos agrupados em WebGL (muitos IPs)
+                    st.write('')
+                    modo_mapa = st.radio(
+                        "🗺️ Renderização do mapa:",
+                        options=[MAPA_AUTOMATICO, MAPA_MARCADORES, MAPA_WEBGL],
+                        index=0,
+                        help=f"No modo automático, o mapa WebGL é usado acima de {MAX_MARCADORES} IPs."
+                    )
+
+                    # Filtro espacial (resolvido pelo SPATIAL INDEX de ips.geo_point)
+                    # A área visível depende do retorno de pan/zoom, disponível apenas no mapa folium
+                    filtros_disponiveis = [FILTRO_NENHUM, FILTRO_RAIO]
+                    if modo_mapa != MAPA_WEBGL:
+                        filtros_disponiveis.append(FILTRO_VIEWPORT)
+
+                    st.write('')
+                    filtro_espacial = st.radio(
+                        "🧭 Filtro espacial:",
+                        options=filtros_disponiveis,
+                        index=0
+                    )
+
+                    if filtro_espacial == FILTRO_RAIO:
+                        col_lat, col_lon = st.columns(2)
+                        with col_lat:
+                            raio_lat = st.number_input("Latitude", min_value=-90.0, max_value=90.0, value=-15.7801, format="%.6f")
+                        with col_lon:
+                            raio_lon = st.number_input("Longitude", min_value=-180.0, max_value=180.0, value=-47.9292, format="%.6f")
+                        raio_km = st.number_input("Raio (km)", min_value=0.1, max_value=20000.0, value=5.0, step=1.0)
+                        area = {'type': 'radius', 'latitude': raio_lat, 'longitude': raio_lon, 'radius_km': raio_km}
+
+                    elif filtro_espacial == FILTRO_VIEWPORT:
+                        # Área capturada do último pan/zoom do mapa
+                        area = st.session_state.get('geo_viewport')
+                        st.caption("Movimente ou aproxime o mapa para buscar apenas os IPs visíveis.")
             else:
                 date_range = None
     else:
@@ -287,171 +705,38 @@ if not date_range:
     st.info("📅 Selecione um intervalo de datas na barra lateral.", icon="ℹ️")
     st.stop()
 
+# IPs do telefone ainda sem geolocalização: pedir ao serviço de enriquecimento que sejam os próximos
+pending_key = (operation_id, sender_for_ip)
+if st.session_state.get('geo_prioritized') != pending_key:
+    st.session_state['geo_pending_ips'] = pending_ips_for_sender(operation_id, sender_for_ip)
+    prioritize_ips(st.session_state['geo_pending_ips'])
+    st.session_state['geo_prioritized'] = pending_key
+
+if st.session_state.get('geo_pending_ips'):
+    st.caption(f"⏳ {len(st.session_state['geo_pending_ips'])} IP(s) deste telefone aguardando geolocalização "
+               "foram colocados no início da fila de enriquecimento.")
+
 # Se o botão foi clicado ou se há filtros válidos, buscar e exibir dados
 if sender_for_ip and date_range:
     
     with st.spinner("🔍 Buscando dados de geolocalização..."):
-        ip_data = get_ip_data_for_map(operation_id, sender_for_ip, date_range)
-        detailed_messages = get_detailed_messages_by_ip(operation_id, sender_for_ip, date_range)
+        ip_data = get_ip_data_for_map(operation_id, sender_for_ip, date_range, area)
     
     if not ip_data:
         st.warning("Nenhum dado de IP encontrado para os filtros selecionados.", icon="⚠️")
-        st.info("💡 Verifique se os IPs foram enriquecidos com dados de geolocalização.")
+        if area:
+            st.info("💡 Nenhum IP dentro da área selecionada. Altere o filtro espacial na barra lateral.")
+            st.session_state.pop('geo_viewport', None)
+            st.session_state.pop('geo_view', None)
+        else:
+            st.info("💡 Verifique se os IPs foram enriquecidos com dados de geolocalização.")
         st.stop()
     
 
-    # Configurar centro do mapa
-    if ip_data:
-        center_lat = sum(item['latitude'] for item in ip_data) / len(ip_data)
-        center_lon = sum(item['longitude'] for item in ip_data) / len(ip_data)
-    else:
-        center_lat, center_lon = -15.7801, -47.9292  # Brasília como padrão
-
-    # Definir cores baseadas na quantidade de mensagens
-    max_messages = max(item['message_count'] for item in ip_data) if ip_data else 1
+    # MAPA
+    render_map(operation_id, sender_for_ip, tuple(date_range), area, filtro_espacial, modo_mapa)
 
-    def get_color(message_count):
-        ratio = message_count / max_messages
-        if ratio > 0.8:
-            return 'red'
-        elif ratio > 0.6:
-            return 'orange'
-        elif ratio > 0.4:
-            return 'yellow'
-        elif ratio > 0.2:
-            return 'lightgreen'
-        else:
-            return 'green'
-
-    # Configurar centro do mapa
-    if ip_data and len(ip_data) > 0:
-        # Calcular centro geográfico
-        latitudes = [item['latitude'] for item in ip_data if item['latitude'] is not None]
-        longitudes = [item['longitude'] for item in ip_data if item['longitude'] is not None]
-        
-        if latitudes and longitudes:
-            center_lat = sum(latitudes) / len(latitudes)
-            center_lon = sum(longitudes) / len(longitudes)
-            
-            # Calcular bounds para melhor visualização
-            min_lat, max_lat = min(latitudes), max(latitudes)
-            min_lon, max_lon = min(longitudes), max(longitudes)
-            
-            # Determinar zoom baseado na dispersão dos pontos
-            lat_range = max_lat - min_lat
-            lon_range = max_lon - min_lon
-            max_range = max(lat_range, lon_range)
-            
-            if max_range < 0.01:
-                zoom_level = 12  # Pontos muito próximos
-            elif max_range < 0.1:
-                zoom_level = 10
-            elif max_range < 1:
-                zoom_level = 8
-            elif max_range < 5:
-                zoom_level = 6
-            else:
-                zoom_level = 4   # Pontos muito espalhados
-        else:
-            center_lat, center_lon = -15.7801, -47.9292  # Brasília como padrão
-            zoom_level = 6
-    else:
-        center_lat, center_lon = -15.7801, -47.9292  # Brasília como padrão
-        zoom_level = 6
-
-
-    # Criar mapa base com configurações otimizadas
-    m = folium.Map(
-        location=[center_lat, center_lon],
-        zoom_start=zoom_level,
-        tiles="OpenStreetMap",
-        width='100%',
-        height='600px'
-    )
-
-    # ADICIONAR MARKER CLUSTER
-    from folium.plugins import MarkerCluster
-    cluster = MarkerCluster(
-        name="IPs Cluster",
-        overlay=True,
-        control=True,
-        options={
-            'disableClusteringAtZoom': 15,  # Desagrupar em zoom alto
-            'maxClusterRadius': 50,         # Raio máximo do cluster
-            'spiderfyOnMaxZoom': True,      # Expandir em zoom máximo
-            'showCoverageOnHover': False,   # Não mostrar área de cobertura
-            'zoomToBoundsOnClick': True     # Zoom ao clicar no cluster
-        }
-    ).add_to(m)
-
-    # Adicionar marcadores com cluster
-    for i, item in enumerate(ip_data):
-        
-        # Popup com informações detalhadas
-        popup_html = f"""
-        <div style="width: 320px; font-family: Arial, sans-serif;">
-            <div style="background: linear-gradient(135deg, #B0E0E6 0%, #5F9EA0 100%); 
-                        color: black; padding: 12px; border-radius: 8px 8px 8px 8px; margin: 10px -5px -10px -10px;">
-                <h3 style="margin: 0; font-size: 16px; text-align: center;"><b>{item['sender_ip']}</b></h3>
-            </div>
-            <div style="padding: 8px; line-height: 1.3; margin-left: -12px">
-                <p style="margin: 6px 0;"><b>Localização:</b> {item['city']}, {item['country']}</p>
-                <p style="margin: 6px 0;"><b>ISP:</b> {item['isp'] or 'N/A'}</p>
-                <p style="margin: 6px 0;"><b>Organização:</b> {item['org'] or 'N/A'}</p>
-                <p style="margin: 6px 0;"><b>Mensagens:</b> {item['message_count']}</p>
-                <p style="margin: 6px 0;"><b>Coordenadas:</b> {item['latitude']:.4f}, {item['longitude']:.4f}</p>
-            </div>
-        </div>
-        """
-        
-        # Criar popup
-        popup = folium.Popup(popup_html, max_width=340)
-        
-        # Definir cor baseada na intensidade de mensagens
-        ratio = item['message_count'] / max_messages
-        
-        if ratio > 0.8:
-            icon = folium.Icon(color='red', icon='map-marker', prefix='fa')
-        elif ratio > 0.6:
-            icon = folium.Icon(color='orange', icon='map-marker', prefix='fa')
-        elif ratio > 0.4:
-            icon = folium.Icon(color='beige', icon='map-marker', prefix='fa')
-        elif ratio > 0.2:
-            icon = folium.Icon(color='green', icon='map-marker', prefix='fa')
-        else:
-            icon = folium.Icon(color='blue', icon='map-marker', prefix='fa')
-        
-        # Verificar se as coordenadas são válidas
-        if -90 <= item['latitude'] <= 90 and -180 <= item['longitude'] <= 180:
-            # Adicionar marcador ao cluster
-            folium.Marker(
-                location=[item['latitude'], item['longitude']],
-                popup=popup,
-                icon=icon,
-                tooltip=f"IP: {item['sender_ip']} | {item['city']}, {item['country']} | {item['message_count']} mensagens"
-            ).add_to(cluster)
-        else:
-            st.warning(f"⚠️ Coordenadas inválidas para IP {item['sender_ip']}: {item['latitude']}, {item['longitude']}")
-
-    # ADICIONAR CONTROLE DE CAMADAS
-    folium.LayerControl().add_to(m)
-
-    # AJUSTAR VISUALIZAÇÃO PARA MOSTRAR TODOS OS PONTOS
-    if ip_data and len(ip_data) > 1:
-        # Criar bounds para incluir todos os pontos
-        coordinates = [[item['latitude'], item['longitude']] for item in ip_data 
-                       if -90 <= item['latitude'] <= 90 and -180 <= item['longitude'] <= 180]
-        
-        if coordinates:
-            m.fit_bounds(coordinates, padding=(20, 20))
-
-    # Exibir mapa com configurações otimizadas
-    map_data = st_folium(
-        m, 
-        width=None,  # Usar largura total do container
-        height=600,
-        returned_objects=["last_object_clicked"]
-    )
+    max_messages = max(item['message_count'] for item in ip_data)
 
     # LEGENDA E INFORMAÇÕES ABAIXO DO MAPA
     st.markdown("---")
@@ -519,121 +804,15 @@ if sender_for_ip and date_range:
     # GRÁFICOS DE ANÁLISE
     st.divider()
     st.subheader("📈 Análise por Localização")
-    
-    # Preparar dados para gráficos
-    df_chart = pd.DataFrame(ip_data)
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        # Gráfico de pizza por país
-        country_data = df_chart.groupby('country')['message_count'].sum().reset_index()
-        country_data = country_data.sort_values('message_count', ascending=False)
-        
-        if len(country_data) > 0:
-            fig_country = px.pie(
-                country_data,
-                values='message_count',
-                names='country',
-                title="Distribuição de Mensagens por País",
-                color_discrete_sequence=px.colors.qualitative.Set3
-            )
-            fig_country.update_traces(textposition='inside', textinfo='percent+label')
-            st.plotly_chart(fig_country, use_container_width=True)
-    
-    with col2:
-        # Gráfico de barras por ISP (top 10)
-        isp_data = df_chart.groupby('isp')['message_count'].sum().reset_index()
-        isp_data = isp_data.sort_values('message_count', ascending=False).head(10)
-        
-        if len(isp_data) > 0:
-            fig_isp = px.bar(
-                isp_data,
-                x='message_count',
-                y='isp',
-                orientation='h',
-                title="Top 10 ISPs por Mensagens",
-                color='message_count',
-                color_continuous_scale='Viridis'
-            )
-            fig_isp.update_layout(
-                yaxis={'categoryorder':'total ascending'},
-                showlegend=False
-            )
-            st.plotly_chart(fig_isp, use_container_width=True)
-    
-    # DATAFRAME DETALHADO
+    render_location_charts(operation_id, sender_for_ip, tuple(date_range), area)
+
+    # DATAFRAME DETALHADO (paginado: uma página por vez, cursor na sessão)
     st.divider()
     st.subheader("📊 Dados Detalhados das Mensagens")
-    
-    if detailed_messages:
-        df_details = pd.DataFrame([
-            {
-                'ID Mensagem': msg.message_id,
-                'Sender': msg.sender,
-                'IP': msg.sender_ip,
-                'Data/Hora': msg.timestamp,
-                'Dispositivo': msg.sender_device,
-                'Tipo': msg.message_type,
-                'Cidade': msg.city,
-                'Estado/Região': msg.region_name,
-                'País': msg.country,
-                'Latitude': msg.latitude,
-                'Longitude': msg.longitude,
-                'ISP': msg.isp,
-                'Organização': msg.org,
-                'Continente': msg.continent
-            }
-            for msg in detailed_messages
-        ])
-        
-        # Exibir dataframe
-        st.dataframe(
-            df_details,
-            use_container_width=True,
-            hide_index=True,
-            column_config={
-                "Data/Hora": st.column_config.DatetimeColumn(
-                    "Data/Hora",
-                    format="DD/MM/YYYY HH:mm:ss"
-                ),
-                "Latitude": st.column_config.NumberColumn(
-                    "Latitude",
-                    format="%.6f"
-                ),
-                "Longitude": st.column_config.NumberColumn(
-                    "Longitude", 
-                    format="%.6f"
-                )
-            }
-        )
-        
-                
-        # GRÁFICO TEMPORAL
-        st.divider()
-        st.subheader("⏰ Distribuição Temporal das Mensagens")
-        
-        # Criar gráfico de linha temporal
-        df_details['Data'] = pd.to_datetime(df_details['Data/Hora']).dt.date
-        temporal_data = df_details.groupby('Data').size().reset_index(name='Quantidade')
-        temporal_data['Data'] = pd.to_datetime(temporal_data['Data'])
-        
-        if len(temporal_data) > 0:
-            fig_temporal = px.line(
-                temporal_data,
-                x='Data',
-                y='Quantidade',
-                title="Mensagens por Data",
-                markers=True
-            )
-            fig_temporal.update_layout(
-                xaxis_title="Data",
-                yaxis_title="Quantidade de Mensagens"
-            )
-            st.plotly_chart(fig_temporal, use_container_width=True)
-    
-    else:
-        st.info("Nenhuma mensagem detalhada encontrada para os filtros selecionados.")
+    render_detail_table(operation_id, sender_for_ip, tuple(date_range), area)
+
+    # GRÁFICO TEMPORAL (contagem por dia feita no banco)
+    render_temporal_chart(operation_id, sender_for_ip, tuple(date_range), area)
 
 else:
     st.info("👆 Clique em 'Plotar IPs no Mapa' na barra lateral para visualizar os dados.", icon="ℹ️")
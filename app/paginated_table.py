@@ -0,0 +1,68 @@
+"""
+Tabela paginada por keyset (ver db/pagination.py) para as páginas do Streamlit.
+
+Apenas a página atual é buscada e enviada ao navegador. Os cursores das páginas já visitadas
+ficam na sessão (uma pilha: avançar empilha o cursor da próxima página, voltar desempilha) e são
+descartados quando os filtros da consulta mudam. Os botões usam callbacks: dentro de um
+st.fragment, trocar de página reexecuta apenas o fragmento.
+"""
+import streamlit as st
+import pandas as pd
+
+
+def _reset(key, filters):
+    st.session_state[f'{key}_filters'] = filters
+    st.session_state[f'{key}_cursors'] = [None]
+
+
+def _next_page(key, cursor):
+    st.session_state[f'{key}_cursors'].append(cursor)
+
+
+def _previous_page(key):
+    if len(st.session_state[f'{key}_cursors']) > 1:
+        st.session_state[f'{key}_cursors'].pop()
+
+
+def paginated_table(key, fetch_page, filters, to_dataframe=None, total=None, page_size=None, **dataframe_kwargs):
+    '''
+    Exibe uma página de fetch_page(after) -> (linhas, próximo cursor) com navegação anterior/próxima.
+
+    filters identifica a consulta (a paginação volta à primeira página quando muda), to_dataframe
+    converte as linhas da página para exibição (desnecessário se a página já for um DataFrame) e
+    total (opcional, vindo das tabelas de resumo) aparece no rodapé. Os demais argumentos vão para
+    st.dataframe. Retorna False se não houver linhas.
+    '''
+    if st.session_state.get(f'{key}_filters') != filters:
+        _reset(key, filters)
+
+    cursors = st.session_state[f'{key}_cursors']
+    rows, next_cursor = fetch_page(cursors[-1])
+    if len(rows) == 0:
+        return False
+
+    dataframe_kwargs.setdefault('use_container_width', True)
+    dataframe_kwargs.setdefault('hide_index', True)
+    if to_dataframe is None:
+        to_dataframe = lambda page: page if isinstance(page, pd.DataFrame) else pd.DataFrame(page)
+    st.dataframe(to_dataframe(rows), **dataframe_kwargs)
+
+    page_number = len(cursors)
+    caption = f"Página {page_number} · {len(rows)} registros"
+    if total is not None:
+        if page_size:
+            caption = f"Página {page_number} de {max(1, -(-total // page_size))} · {len(rows)} de {total:,} registros"
+        else:
+            caption += f" de {total:,}"
+
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        st.button("⬅️ Página anterior", key=f'{key}_previous', disabled=page_number == 1,
+                  on_click=_previous_page, args=(key,), use_container_width=True)
+    with col_page:
+        st.caption(caption)
+    with col_next:
+        st.button("Próxima página ➡️", key=f'{key}_next', disabled=next_cursor is None,
+                  on_click=_next_page, args=(key, next_cursor), use_container_width=True)
+
+    return True
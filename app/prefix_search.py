@@ -0,0 +1,54 @@
+"""
+Seleção de telefones por busca de prefixo (remetentes, alvos e contatos da operação).
+
+O índice (db.prefix_index.PrefixIndex) é montado uma vez por (operação, tipo, versão dos dados) e
+mantido com st.cache_resource, compartilhado entre sessões sem cópia. A cada tecla o campo de busca
+consulta o índice com bisect e o selectbox recebe apenas os primeiros resultados, nunca a lista toda.
+"""
+import streamlit as st
+from query_cache import get_data_version
+from db.prefix_index import PrefixIndex, load_prefix_index, DEFAULT_LIMIT
+
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def _load_index(operation_id, kind, data_version):
+    try:
+        return load_prefix_index(operation_id, kind) or PrefixIndex([])
+    except Exception as e:
+        print(f"❌ Erro ao montar índice de {kind}: {e}")
+        return PrefixIndex([])
+
+
+def get_prefix_index(operation_id, kind):
+    '''Índice de prefixos da operação para a versão atual dos dados'''
+    return _load_index(operation_id, kind, get_data_version(operation_id))
+
+
+def prefix_select(label, operation_id, kind, key, limit=DEFAULT_LIMIT, placeholder='Digite o início do telefone'):
+    '''
+    Campo de busca + selectbox com os primeiros limit telefones que começam com o texto digitado.
+
+    Retorna o telefone selecionado ('' enquanto nenhum for escolhido).
+    '''
+    index = get_prefix_index(operation_id, kind)
+    if not len(index):
+        return None
+
+    prefix = st.text_input(f"🔎 {label}", key=f"{key}_prefix", placeholder=placeholder)
+    matches = index.search(prefix, limit)
+    total = index.count(prefix)
+
+    selected = st.selectbox(
+        label,
+        options=[''] + matches,
+        index=0,
+        key=f"{key}_select",
+        label_visibility='collapsed'
+    )
+
+    if total > len(matches):
+        st.caption(f"Exibindo {len(matches)} de {total:,} telefones. Digite mais dígitos para refinar.")
+    elif not matches:
+        st.caption("Nenhum telefone encontrado com esse início.")
+
+    return selected
@@ -0,0 +1,63 @@
+"""
+Cache das consultas das páginas, invalidado pela versão dos dados da operação.
+
+Cada função decorada com cached_by_operation recebe o operation_id como primeiro argumento e é
+armazenada com st.cache_data (compartilhado entre reruns e entre analistas) usando a chave
+(operation_id, versão dos dados, demais argumentos). A versão é operation_metrics.version,
+incrementada na ingestão e exclusão de pacotes (refresh_operation_metrics) e quando o
+enriquecimento geolocaliza IPs da operação (bump_versions_for_ips). Enquanto os dados da operação
+não mudam, as páginas não voltam ao banco.
+"""
+import streamlit as st
+from db.session import get_session
+from db.models import OperationMetrics
+
+
+# Entradas mantidas por função (o LRU do st.cache_data descarta as mais antigas)
+MAX_ENTRIES = 128
+
+
+def get_data_version(operation_id):
+    '''Versão atual dos dados da operação (0 enquanto não houver snapshot de métricas)'''
+    if not operation_id:
+        return 0
+
+    with get_session() as session:
+        version = session.query(OperationMetrics.version).filter(
+            OperationMetrics.operation_id == operation_id
+        ).scalar()
+        return version or 0
+
+
+def cached_by_operation(func=None, *, max_entries=MAX_ENTRIES, ttl=None):
+    '''
+    Decorador: memoriza o resultado por (operation_id, versão dos dados, argumentos).
+
+    Os argumentos precisam ser hasheáveis pelo st.cache_data e o retorno serializável (pickle):
+    DataFrames, listas, tuplas e dicionários, não objetos ORM.
+    '''
+    def decorator(func):
+        def load(operation_id, data_version, *args, **kwargs):
+            return func(operation_id, *args, **kwargs)
+
+        # O st.cache_data identifica a função pelo módulo/nome: cada função decorada tem seu próprio cache
+        load.__module__ = func.__module__
+        load.__qualname__ = func.__qualname__
+        load.__name__ = func.__name__
+        load.__doc__ = func.__doc__
+
+        cached_load = st.cache_data(max_entries=max_entries, ttl=ttl, show_spinner=False)(load)
+
+        def wrapper(operation_id, *args, **kwargs):
+            return cached_load(operation_id, get_data_version(operation_id), *args, **kwargs)
+
+        wrapper.__module__ = func.__module__
+        wrapper.__qualname__ = func.__qualname__
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.clear = cached_load.clear
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
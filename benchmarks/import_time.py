@@ -0,0 +1,155 @@
+"""
+Tempo de importação das páginas do Streamlit (python -X importtime).
+
+Cada página é medida em um processo novo (sem nada em sys.modules): o script importa o streamlit
+(carregado pelo app/main.py antes de qualquer página) e em seguida executa o bloco de imports do
+topo da página, exatamente como estão no arquivo. O tempo reportado é o que a página acrescenta
+ao streamlit, ou seja, o custo de abrir a página pela primeira vez (primeira renderização ou
+troca de página em um servidor recém-iniciado). Imports feitos dentro de funções e ramos (mapa
+WebGL, gráficos, upload...) ficam de fora, pois só são pagos quando o trecho é usado.
+
+Para cada página são listados os pacotes que mais pesam (soma do tempo próprio dos módulos de
+cada pacote), para identificar o que vale adiar.
+
+Uso:
+    python -m benchmarks.import_time                         # todas as páginas do app/main.py
+    python -m benchmarks.import_time adm/config.py ips/geolocations.py
+    python -m benchmarks.import_time --repeat 5 --top 8
+"""
+import argparse
+import ast
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+
+PROJECT_ROOT = Path(__file__).absolute().parent.parent
+APP_DIR = PROJECT_ROOT / 'app'
+PAGES_DIR = APP_DIR / 'pages'
+
+# Módulo importado antes de todas as páginas (app/main.py)
+BASELINE_MODULE = 'streamlit'
+
+# Último módulo carregado na inicialização do interpretador
+STARTUP_MODULE = 'site'
+
+# Linha do -X importtime: "import time:  self [us] | cumulative | imported package"
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\| ( *)(\S+)')
+
+
+def list_pages():
+    '''Páginas registradas na navegação do app/main.py (caminhos relativos a app/pages)'''
+    source = (APP_DIR / 'main.py').read_text(encoding='utf-8')
+    return [path.removeprefix('pages/') for path in re.findall(r'st\.Page\(\s*"([^"]+)"', source)]
+
+
+def header_imports(path):
+    '''Código do bloco de imports do topo do arquivo (o que é executado ao abrir a página)'''
+    source = Path(path).read_text(encoding='utf-8')
+    statements = []
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            statements.append(ast.get_source_segment(source, node))
+        elif isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and not statements:
+            continue  # docstring do módulo
+        else:
+            break
+    return '\n'.join(statements)
+
+
+def run_importtime(code):
+    '''Executa o código com -X importtime em um processo novo e retorna as linhas do relatório'''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(APP_DIR), str(PROJECT_ROOT), env.get('PYTHONPATH')]))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=PROJECT_ROOT,
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        error = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+        raise RuntimeError(error[-1] if error else f"código de saída {result.returncode}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, len(indent), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def page_cost(entries, after):
+    '''
+    Separa o que foi importado depois do módulo after.
+
+    Retorna (tempo total em ms, {pacote: tempo próprio em ms}). As entradas aparecem na ordem em
+    que as importações terminam; a de after fecha a árvore dele, e o que vem depois é do código medido.
+    '''
+    start = 0
+    for index, (module, depth, _, _) in enumerate(entries):
+        if module == after and depth == 0:
+            start = index + 1
+            break
+
+    page_entries = entries[start:]
+    top_level = min((depth for _, depth, _, _ in page_entries), default=0)
+    total_us = sum(cumulative for _, depth, _, cumulative in page_entries if depth == top_level)
+
+    packages = defaultdict(int)
+    for module, _, self_us, _ in page_entries:
+        packages[module.split('.')[0]] += self_us
+
+    return total_us / 1000, {name: us / 1000 for name, us in packages.items()}
+
+
+def measure(code, after, repeat):
+    '''Mediana do tempo total e dos pacotes em repeat processos'''
+    totals = []
+    packages = defaultdict(list)
+    for _ in range(repeat):
+        total, by_package = page_cost(run_importtime(code), after)
+        totals.append(total)
+        for name, ms in by_package.items():
+            packages[name].append(ms)
+    return statistics.median(totals), {name: statistics.median(values) for name, values in packages.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tempo de importação das páginas do Streamlit (-X importtime)")
+    parser.add_argument('pages', nargs='*', help="páginas relativas a app/pages (padrão: todas do app/main.py)")
+    parser.add_argument('--repeat', type=int, default=3, help="execuções por página (usa a mediana)")
+    parser.add_argument('--top', type=int, default=5, help="pacotes mais pesados listados por página")
+    args = parser.parse_args(argv)
+
+    try:
+        streamlit_ms, _ = measure(f'import {BASELINE_MODULE}', STARTUP_MODULE, args.repeat)
+    except RuntimeError as e:
+        print(f"Não foi possível importar o {BASELINE_MODULE}: {e}")
+        return 1
+    print(f"{'main.py (' + BASELINE_MODULE + ')':<40} {streamlit_ms:>9.1f} ms")
+
+    failures = 0
+    for page in args.pages or list_pages():
+        code = f'import {BASELINE_MODULE}\n' + header_imports(PAGES_DIR / page)
+        try:
+            total, packages = measure(code, BASELINE_MODULE, args.repeat)
+        except RuntimeError as e:
+            print(f"{page:<40} {'erro':>12}  {e}")
+            failures += 1
+            continue
+
+        heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        print(f"{page:<40} {total:>9.1f} ms  " + ', '.join(f"{name} {ms:.1f}" for name, ms in heaviest))
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
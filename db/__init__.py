@@ -1,7 +1,29 @@
-from .session import get_session
-from .models import Operation, Target, File, Group, GroupMetadata, Contact, IP, Message, MessageRecipient
-from .queries import insert_target_into_targets, insert_data_into_files, insert_messages
+from importlib import import_module
 
 
-__all__ = ["get_session", "Operation", "Target", "File", "Group", "GroupMetadata", "Contact", "IP", "Message", "MessageRecipient"]
-__all__ += ["insert_target_into_targets", "insert_data_into_files", "insert_groups_and_contacts", "insert_messages"]
\ No newline at end of file
+# Nomes reexportados e o submódulo de origem. A importação é feita no primeiro acesso
+# (db.get_session, from db import Message...), para que "from db.models import ..." nas páginas
+# não carregue db.queries e, com ele, o extrator (BeautifulSoup) e o cliente da ip-api.
+_EXPORTS = {
+    "get_session": ".session",
+    **dict.fromkeys(["Operation", "Target", "File", "Group", "GroupMetadata", "Contact", "IP", "Message",
+                     "MessageRecipient", "ConversationStat", "OperationMetrics", "IPPrefixCache"], ".models"),
+    **dict.fromkeys(["insert_target_into_targets", "insert_data_into_files", "insert_groups_and_contacts",
+                     "insert_messages"], ".queries"),
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+__all__ = ["get_session", "Operation", "Target", "File", "Group", "GroupMetadata", "Contact", "IP", "Message", "MessageRecipient", "ConversationStat", "OperationMetrics", "IPPrefixCache"]
+__all__ += ["insert_target_into_targets", "insert_data_into_files", "insert_groups_and_contacts", "insert_messages"]
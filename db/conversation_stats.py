@@ -0,0 +1,343 @@
+"""
+Tabela conversation_stats: resumo diário (enviadas/recebidas) das conversas do alvo de cada arquivo.
+
+A tabela é atualizada de forma incremental em insert_messages e removida em cascata junto com o
+arquivo, de modo que a página "Mensagens" responde a partir de um agregado pequeno e indexado em vez
+de ler todas as linhas mensagem x destinatário do alvo.
+
+Regras (as mesmas da antiga agregação em pandas da página):
+    - mensagens sem destinatários não entram no resumo;
+    - mensagem de grupo -> conversa "GRUPO_<group_id>", contato "Grupo";
+    - mensagem particular -> conversa "PARTICULAR_<contato>", onde o contato é o destinatário
+      quando o alvo enviou e o remetente quando o alvo recebeu;
+    - enviada = alvo é o remetente; recebida = alvo está entre os destinatários.
+
+As mesmas regras existem em SQL (conversation_aggregate_select): um único GROUP BY com somas
+condicionais sobre messages x message_recipients, usado na reconstrução (INSERT ... SELECT) e na
+conferência do resumo gravado.
+
+Uso:
+    python -m db.conversation_stats rebuild [file_id ...]  # recalcula o resumo (todos os arquivos PRTT)
+    python -m db.conversation_stats verify [file_id ...]   # compara o resumo gravado com a agregação SQL
+"""
+import sys
+import os
+from collections import defaultdict
+from sqlalchemy import func, select, case, and_, literal
+from sqlalchemy.dialects.mysql import insert
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.session import get_session
+from db.models import ConversationStat, File, Target, Message, MessageRecipient, GroupMetadata
+from db.pagination import keyset_page, PAGE_SIZE
+
+
+GROUP_CONTACT = 'Grupo'
+
+
+def conversation_for(sender, recipients, group_id, target_phone):
+    '''Retorna (conversation_key, contact, group_id) da mensagem do ponto de vista do alvo'''
+    if group_id:
+        return f"GRUPO_{group_id}", GROUP_CONTACT, group_id
+
+    contact = recipients[-1] if sender == target_phone else sender
+    return f"PARTICULAR_{contact}", contact, None
+
+
+def summarize_conversations(messages, target_phone):
+    '''
+    Agrega mensagens (formato de extractor.get_messages) por conversa e dia.
+
+    Retorna um dicionário {(conversation_key, day): {'contact', 'group_id', 'sent', 'received'}}.
+    '''
+    summary = defaultdict(lambda: {'contact': None, 'group_id': None, 'sent': 0, 'received': 0})
+
+    for message in messages:
+        recipients = message.get('recipients') or []
+        timestamp = message.get('timestamp')
+        if not recipients or not timestamp:
+            continue
+
+        sender = message.get('sender')
+        conversation_key, contact, group_id = conversation_for(sender, recipients, message.get('group_id'), target_phone)
+
+        entry = summary[(conversation_key, timestamp.date())]
+        entry['contact'] = contact
+        entry['group_id'] = group_id
+        entry['sent'] += 1 if sender == target_phone else 0
+        entry['received'] += 1 if target_phone in recipients else 0
+
+    return dict(summary)
+
+
+def apply_conversation_stats(session, file_id, summary):
+    '''Soma o resumo ao que já existe para o arquivo (INSERT ... ON DUPLICATE KEY UPDATE)'''
+    if not summary:
+        return 0
+
+    rows = [
+        {
+            'file_id': file_id,
+            'conversation_key': conversation_key,
+            'day': day,
+            'contact': entry['contact'],
+            'group_id': entry['group_id'],
+            'sent': entry['sent'],
+            'received': entry['received']
+        }
+        for (conversation_key, day), entry in summary.items()
+    ]
+
+    stmt = insert(ConversationStat.__table__)
+    stmt = stmt.on_duplicate_key_update(
+        sent=ConversationStat.__table__.c.sent + stmt.inserted.sent,
+        received=ConversationStat.__table__.c.received + stmt.inserted.received
+    )
+    session.execute(stmt, rows)
+    print(f"{len(rows)} linhas de resumo de conversas atualizadas")
+    return len(rows)
+
+
+def conversation_rows_query(session, operation_id, target_id, date_filter):
+    '''
+    Consulta das conversas do alvo no período, já somadas pelo banco.
+
+    date_filter deve ser um filtro sobre ConversationStat.day (ex.: time_range_filter).
+    '''
+    return session.query(
+        ConversationStat.conversation_key,
+        ConversationStat.contact,
+        ConversationStat.group_id,
+        func.sum(ConversationStat.sent).label('quantidade_enviadas'),
+        func.sum(ConversationStat.received).label('quantidade_recebidas')
+    ).join(
+        File, ConversationStat.file_id == File.file_id
+    ).filter(
+        File.operation_id == operation_id,
+        File.target_id == target_id,
+        date_filter
+    ).group_by(
+        ConversationStat.conversation_key,
+        ConversationStat.contact,
+        ConversationStat.group_id
+    )
+
+
+def get_conversation_rows(session, operation_id, target_id, date_filter):
+    '''Retorna todas as conversas do alvo no período (ver conversation_rows_query)'''
+    return conversation_rows_query(session, operation_id, target_id, date_filter).all()
+
+
+def get_conversation_page(session, operation_id, target_id, date_filter, after=None, limit=PAGE_SIZE):
+    '''
+    Uma página das conversas do alvo, da mais ativa para a menos ativa.
+
+    A ordem (total de mensagens, conversation_key) é total; after é o cursor devolvido pela página anterior.
+    Retorna (linhas, próximo cursor ou None).
+    '''
+    conversations = conversation_rows_query(session, operation_id, target_id, date_filter).subquery('conversations')
+    total = (conversations.c.quantidade_enviadas + conversations.c.quantidade_recebidas).label('total_mensagens')
+
+    query = session.query(
+        conversations.c.conversation_key,
+        conversations.c.contact,
+        conversations.c.group_id,
+        conversations.c.quantidade_enviadas,
+        conversations.c.quantidade_recebidas,
+        total
+    )
+    return keyset_page(
+        query,
+        [('total_mensagens', total), ('conversation_key', conversations.c.conversation_key)],
+        after=after,
+        limit=limit
+    )
+
+
+def conversation_export_query(session, operation_id, target_id, date_filter):
+    '''Todas as conversas do alvo no período com o nome do grupo, da mais ativa para a menos ativa (para exportação)'''
+    conversations = conversation_rows_query(session, operation_id, target_id, date_filter).subquery('conversations')
+    subjects = session.query(
+        GroupMetadata.group_id,
+        func.max(GroupMetadata.subject).label('subject')
+    ).group_by(GroupMetadata.group_id).subquery('subjects')
+    total = (conversations.c.quantidade_enviadas + conversations.c.quantidade_recebidas).label('total_mensagens')
+
+    return session.query(
+        conversations.c.contact,
+        conversations.c.group_id,
+        subjects.c.subject.label('nome_grupo'),
+        conversations.c.quantidade_enviadas,
+        conversations.c.quantidade_recebidas,
+        total
+    ).outerjoin(
+        subjects, subjects.c.group_id == conversations.c.group_id
+    ).order_by(total.desc(), conversations.c.conversation_key.desc())
+
+
+def get_conversation_totals(session, operation_id, target_id, date_filter):
+    '''Retorna (conversas, enviadas, recebidas) do alvo no período, somados no resumo'''
+    totals = session.query(
+        func.count(func.distinct(ConversationStat.conversation_key)),
+        func.coalesce(func.sum(ConversationStat.sent), 0),
+        func.coalesce(func.sum(ConversationStat.received), 0)
+    ).join(
+        File, ConversationStat.file_id == File.file_id
+    ).filter(
+        File.operation_id == operation_id,
+        File.target_id == target_id,
+        date_filter
+    ).one()
+    return int(totals[0]), int(totals[1]), int(totals[2])
+
+
+def conversation_aggregate_select(file_ids=None):
+    '''
+    Agregação das regras do módulo inteiramente em SQL, em três níveis:
+
+        1. por mensagem: dia, último destinatário (maior id) e se o alvo está entre os destinatários;
+        2. por mensagem: chave da conversa, contato e grupo do ponto de vista do alvo;
+        3. GROUP BY (arquivo, conversa, dia) com SUM das enviadas/recebidas.
+
+    Retorna um SELECT com as colunas de conversation_stats. Sem file_ids, considera todos os arquivos PRTT.
+    '''
+    recipients = MessageRecipient.__table__
+
+    # 1. Uma linha por mensagem com destinatários (mensagens sem destinatários não entram)
+    per_message = select(
+        Message.file_id.label('file_id'),
+        Message.sender.label('sender'),
+        Message.group_id.label('group_id'),
+        func.date(Message.timestamp).label('day'),
+        Target.target.label('target'),
+        func.max(recipients.c.id).label('last_recipient_id'),
+        func.max(case((recipients.c.recipient_phone == Target.target, 1), else_=0)).label('received')
+    ).join(
+        recipients, recipients.c.message_id == Message.message_id
+    ).join(
+        File, Message.file_id == File.file_id
+    ).join(
+        Target, File.target_id == Target.target_id
+    ).where(
+        File.file_type == 'PRTT',
+        Message.timestamp.isnot(None)
+    ).group_by(
+        Message.file_id, Message.message_id, Message.sender, Message.group_id,
+        func.date(Message.timestamp), Target.target
+    )
+    if file_ids:
+        per_message = per_message.where(File.file_id.in_(file_ids))
+    per_message = per_message.subquery('per_message')
+
+    # 2. Conversa da mensagem (mesma regra de conversation_for)
+    last_recipient = recipients.alias('last_recipient')
+    is_group = and_(per_message.c.group_id.isnot(None), per_message.c.group_id != '')
+    sent_by_target = per_message.c.sender == per_message.c.target
+    private_contact = case((sent_by_target, last_recipient.c.recipient_phone), else_=per_message.c.sender)
+
+    keyed = select(
+        per_message.c.file_id,
+        per_message.c.day,
+        case(
+            (is_group, func.concat('GRUPO_', per_message.c.group_id)),
+            # f"PARTICULAR_{None}" no Python
+            else_=func.concat('PARTICULAR_', func.coalesce(private_contact, 'None'))
+        ).label('conversation_key'),
+        case((is_group, literal(GROUP_CONTACT)), else_=private_contact).label('contact'),
+        case((is_group, per_message.c.group_id), else_=None).label('group_id'),
+        case((sent_by_target, 1), else_=0).label('sent'),
+        per_message.c.received
+    ).select_from(per_message).join(
+        last_recipient, last_recipient.c.id == per_message.c.last_recipient_id
+    ).subquery('keyed')
+
+    # 3. Resumo por conversa e dia (contato e grupo são determinados pela chave)
+    return select(
+        keyed.c.file_id,
+        keyed.c.conversation_key,
+        keyed.c.day,
+        func.max(keyed.c.contact).label('contact'),
+        func.max(keyed.c.group_id).label('group_id'),
+        func.sum(keyed.c.sent).label('sent'),
+        func.sum(keyed.c.received).label('received')
+    ).group_by(
+        keyed.c.file_id, keyed.c.conversation_key, keyed.c.day
+    )
+
+
+def _prtt_file_ids(session, file_ids=None):
+    query = session.query(File.file_id).filter(File.file_type == 'PRTT')
+    if file_ids:
+        query = query.filter(File.file_id.in_(file_ids))
+    return [row[0] for row in query.order_by(File.file_id).all()]
+
+
+def rebuild_conversation_stats(file_ids=None):
+    '''
+    Recalcula o resumo a partir das mensagens já gravadas (backfill de arquivos antigos).
+
+    Cada arquivo é recalculado pelo banco com um único INSERT ... SELECT, em transação própria.
+    Sem file_ids, recalcula todos os arquivos PRTT.
+    '''
+    with get_session() as session:
+        files = _prtt_file_ids(session, file_ids)
+
+    columns = ['file_id', 'conversation_key', 'day', 'contact', 'group_id', 'sent', 'received']
+
+    for file_id in files:
+        with get_session() as session:
+            session.query(ConversationStat).filter(ConversationStat.file_id == file_id).delete()
+            session.execute(
+                insert(ConversationStat.__table__).from_select(columns, conversation_aggregate_select([file_id]))
+            )
+            session.commit()
+
+        print(f"Resumo de conversas recalculado para o arquivo {file_id}")
+
+    return len(files)
+
+
+def verify_conversation_stats(file_ids=None):
+    '''
+    Compara o resumo gravado (incremental, em Python) com a agregação SQL sobre as mensagens.
+
+    Retorna a lista de arquivos divergentes: [(file_id, linhas só no resumo, linhas só no SQL)].
+    '''
+    with get_session() as session:
+        files = _prtt_file_ids(session, file_ids)
+
+    divergent = []
+    for file_id in files:
+        with get_session() as session:
+            stored = {
+                (row.conversation_key, row.day, row.contact, row.group_id, int(row.sent), int(row.received))
+                for row in session.query(
+                    ConversationStat.conversation_key, ConversationStat.day, ConversationStat.contact,
+                    ConversationStat.group_id, ConversationStat.sent, ConversationStat.received
+                ).filter(ConversationStat.file_id == file_id).all()
+            }
+            computed = {
+                (row.conversation_key, row.day, row.contact, row.group_id, int(row.sent), int(row.received))
+                for row in session.execute(conversation_aggregate_select([file_id])).all()
+            }
+
+        if stored != computed:
+            divergent.append((file_id, sorted(stored - computed, key=str), sorted(computed - stored, key=str)))
+            print(f"⚠️  Arquivo {file_id}: {len(stored - computed)} linha(s) só no resumo, {len(computed - stored)} só no SQL")
+
+    return divergent
+
+
+if __name__ == '__main__':
+    comando = sys.argv[1] if len(sys.argv) > 1 else None
+    arquivos = [int(arg) for arg in sys.argv[2:]] or None
+
+    if comando == 'rebuild':
+        total = rebuild_conversation_stats(arquivos)
+        print(f"✅ {total} arquivo(s) processado(s)")
+    elif comando == 'verify':
+        divergentes = verify_conversation_stats(arquivos)
+        print("✅ Resumo confere com a agregação SQL" if not divergentes else f"❌ {len(divergentes)} arquivo(s) divergente(s)")
+    else:
+        print(__doc__)
@@ -0,0 +1,104 @@
+"""
+Fila de prioridade do enriquecimento de IPs.
+
+Cada IP pendente carrega três colunas de prioridade, usadas por IPEnricher.get_pending_ips na ordem:
+    - priority_tier: 0 = fila normal, 1 = operação aberta/carregada, 2 = pedido explícito ("enriquecer agora");
+    - priority_at: quando a prioridade foi dada (o pedido mais recente passa à frente);
+    - priority_weight: quantidade de mensagens da operação com o IP (IPs mais usados primeiro).
+
+IPs já enriquecidos não são alterados.
+"""
+from sqlalchemy import update, select, func
+
+from db.session import get_session
+from db.models import IP, Message, File
+from db.enrichment_state import RETRYABLE_STATUSES
+
+
+TIER_NORMAL = 0
+TIER_OPERATION = 1
+TIER_EXPLICIT = 2
+
+# Apenas IPs que ainda vão à API
+QUEUED_STATUSES = RETRYABLE_STATUSES
+
+
+def prioritize_operation(operation_id, tier=TIER_OPERATION):
+    '''
+    Coloca os IPs pendentes da operação à frente da fila, ponderados pela quantidade de mensagens.
+
+    Chamada ao carregar um pacote e ao selecionar a operação. Retorna quantos IPs foram priorizados.
+    '''
+    if not operation_id:
+        return 0
+
+    weights = select(
+        Message.sender_ip.label('sender_ip'),
+        func.count().label('weight')
+    ).join(
+        File, Message.file_id == File.file_id
+    ).where(
+        File.operation_id == operation_id,
+        Message.sender_ip.isnot(None)
+    ).group_by(Message.sender_ip).subquery()
+
+    # UPDATE ips, (subconsulta) SET ... (multi-table UPDATE do MySQL)
+    stmt = update(IP).where(
+        IP.sender_ip == weights.c.sender_ip,
+        IP.enrichment_status.in_(QUEUED_STATUSES),
+        IP.priority_tier <= tier
+    ).values(
+        priority_tier=tier,
+        priority_at=func.now(),
+        priority_weight=weights.c.weight
+    ).execution_options(synchronize_session=False)
+
+    try:
+        with get_session() as session:
+            result = session.execute(stmt)
+            session.commit()
+            print(f"{result.rowcount} IPs pendentes da operação {operation_id} priorizados")
+            return result.rowcount
+    except Exception as e:
+        print(f"❌ Erro ao priorizar IPs da operação {operation_id}: {e}")
+        return 0
+
+
+def prioritize_ips(ip_list, tier=TIER_EXPLICIT):
+    '''Pedido explícito: os IPs informados são os próximos a serem enriquecidos'''
+    ip_list = [ip for ip in set(ip_list or []) if ip]
+    if not ip_list:
+        return 0
+
+    stmt = update(IP).where(
+        IP.sender_ip.in_(ip_list),
+        IP.enrichment_status.in_(QUEUED_STATUSES)
+    ).values(
+        priority_tier=tier,
+        priority_at=func.now()
+    ).execution_options(synchronize_session=False)
+
+    try:
+        with get_session() as session:
+            result = session.execute(stmt)
+            session.commit()
+            return result.rowcount
+    except Exception as e:
+        print(f"❌ Erro ao priorizar IPs: {e}")
+        return 0
+
+
+def pending_ips_for_sender(operation_id, sender):
+    '''IPs do telefone na operação que ainda aguardam geolocalização'''
+    with get_session() as session:
+        rows = session.query(IP.sender_ip).join(
+            Message, Message.sender_ip == IP.sender_ip
+        ).join(
+            File, Message.file_id == File.file_id
+        ).filter(
+            File.operation_id == operation_id,
+            Message.sender == sender,
+            IP.enrichment_status.in_(QUEUED_STATUSES)
+        ).distinct().all()
+
+        return [row[0] for row in rows]
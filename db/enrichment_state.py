@@ -0,0 +1,50 @@
+"""
+Estados de enriquecimento dos IPs (ips.enrichment_status) e classificação local de faixas.
+
+Sem dependências do restante do projeto: usado tanto pela ingestão (db.queries), que já grava
+os IPs privados/reservados/inválidos com o estado definitivo, quanto pelo cliente da ip-api
+(extractor.ip_api_client) e pela fila de prioridade (db.enrichment_queue).
+"""
+import ipaddress
+from typing import Optional
+
+
+ENRICHMENT_PENDING = 'PENDING'    # aguardando consulta
+ENRICHMENT_DONE = 'DONE'          # geolocalizado
+ENRICHMENT_FAILED = 'FAILED'      # falha temporária, nova tentativa após retry_after
+ENRICHMENT_PRIVATE = 'PRIVATE'    # RFC1918, loopback, CGNAT, link-local (nunca enviado)
+ENRICHMENT_RESERVED = 'RESERVED'  # demais faixas não roteáveis (multicast, documentação...)
+ENRICHMENT_INVALID = 'INVALID'    # texto que não é um IP válido
+
+RETRYABLE_STATUSES = (ENRICHMENT_PENDING, ENRICHMENT_FAILED)
+
+CGNAT_NETWORK = ipaddress.ip_network('100.64.0.0/10')
+
+
+def classify_ip(ip: str) -> Optional[str]:
+    """
+    Classifica localmente IPs que não devem ir para a API.
+
+    Retorna o estado definitivo (PRIVATE, RESERVED ou INVALID) ou None para IPs públicos.
+    """
+    try:
+        address = ipaddress.ip_address(str(ip).strip())
+    except ValueError:
+        return ENRICHMENT_INVALID
+
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+
+    # Verificado antes de is_private, que no Python também cobre 0.0.0.0, :: e 240.0.0.0/4
+    # (o loopback IPv6 ::1 fica dentro da faixa reservada ::/8 e continua como privado)
+    if not address.is_loopback and (address.is_multicast or address.is_reserved or address.is_unspecified):
+        return ENRICHMENT_RESERVED
+
+    if (address.is_private or address.is_loopback or address.is_link_local
+            or (address.version == 4 and address in CGNAT_NETWORK)):
+        return ENRICHMENT_PRIVATE
+
+    if not address.is_global:
+        return ENRICHMENT_RESERVED
+
+    return None
@@ -0,0 +1,57 @@
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import and_, true
+
+
+def _as_date(value):
+    '''Converte date/datetime/string ISO em date'''
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).date()
+    raise TypeError(f"Data inválida: {value!r}")
+
+
+def to_time_range(date_range):
+    '''
+    Converte o intervalo selecionado nas páginas em um intervalo semiaberto de timestamps.
+
+    Aceita uma tupla/lista (início, fim) ou uma data única, com date ou datetime.
+    Retorna (início, fim_exclusivo), onde início = 00:00 do primeiro dia e
+    fim_exclusivo = 00:00 do dia seguinte ao último (ou None quando não há fim).
+    '''
+    if date_range is None or date_range == '':
+        return None
+
+    if isinstance(date_range, (tuple, list)):
+        if len(date_range) == 0:
+            return None
+        start = date_range[0]
+        end = date_range[1] if len(date_range) > 1 else None
+    else:
+        start, end = date_range, None
+
+    start_dt = datetime.combine(_as_date(start), time.min)
+    end_dt = datetime.combine(_as_date(end) + timedelta(days=1), time.min) if end is not None else None
+
+    return start_dt, end_dt
+
+
+def time_range_filter(column, date_range):
+    '''
+    Filtro sargável de período: column >= início AND column < fim + 1 dia.
+
+    Diferente de DATE(column) >= início, não envolve a coluna em função e permite
+    ao MySQL usar índices (range scan) e partition pruning sobre o timestamp.
+    Sem intervalo, retorna um filtro neutro.
+    '''
+    time_range = to_time_range(date_range)
+    if not time_range:
+        return true()
+
+    start_dt, end_dt = time_range
+    if end_dt is None:
+        return column >= start_dt
+
+    return and_(column >= start_dt, column < end_dt)
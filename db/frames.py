@@ -0,0 +1,76 @@
+"""
+Conversão de resultados de consulta em DataFrames coluna a coluna (Arrow).
+
+Em vez de montar uma lista de dicionários linha a linha (com strftime por linha) e só então um
+DataFrame, as linhas são transpostas em colunas e cada coluna vira um array Arrow com tipo
+definido (inteiros, decimais como float, datas como timestamp). Colunas repetitivas (tipo,
+status, nome do grupo...) são codificadas como dicionário e chegam ao pandas como Categorical,
+e as datas são formatadas de uma vez com dt.strftime.
+
+Uso programático:
+    from db.frames import query_frame
+    df = query_frame(session, query, categories=['tipo'], date_formats={'gerado_em': '%d/%m/%Y'})
+"""
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def _column_array(values):
+    '''Array Arrow tipado de uma coluna (decimais viram float64; tipos mistos viram texto)'''
+    try:
+        array = pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+    if pa.types.is_decimal(array.type):
+        return array.cast(pa.float64())
+    if pa.types.is_null(array.type):
+        return array.cast(pa.string())
+    return array
+
+
+def frame_from_columns(columns, rows, categories=(), date_formats=None, fill=None):
+    '''
+    Monta o DataFrame a partir dos nomes das colunas e das linhas (tuplas ou Row).
+
+    categories: colunas codificadas como dicionário (Categorical no pandas);
+    date_formats: {coluna: formato} aplicado com dt.strftime;
+    fill: {coluna: valor} para os nulos (aplicado por último).
+    '''
+    columns = list(columns)
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+
+    arrays = []
+    for name, column_values in zip(columns, values):
+        array = _column_array(list(column_values))
+        if name in categories and not pa.types.is_dictionary(array.type):
+            array = pc.dictionary_encode(array)
+        arrays.append(array)
+
+    df = pa.Table.from_arrays(arrays, names=columns).to_pandas()
+
+    for name, date_format in (date_formats or {}).items():
+        df[name] = pd.to_datetime(df[name]).dt.strftime(date_format)
+
+    for name, value in (fill or {}).items():
+        if isinstance(df[name].dtype, pd.CategoricalDtype):
+            if value not in df[name].cat.categories:
+                df[name] = df[name].cat.add_categories([value])
+        df[name] = df[name].fillna(value)
+
+    return df
+
+
+def query_frame(session, query, **options):
+    '''Executa a consulta (Query legada ou SELECT) e retorna o DataFrame (opções de frame_from_columns)'''
+    statement = query.statement if hasattr(query, 'statement') else query
+    result = session.execute(statement)
+    return frame_from_columns(result.keys(), result.all(), **options)
+
+
+def records_frame(records, columns=None, **options):
+    '''DataFrame a partir de uma lista de dicionários (ex.: página de keyset_page)'''
+    if columns is None:
+        columns = list(records[0].keys()) if records else []
+    return frame_from_columns(columns, [tuple(record[name] for name in columns) for record in records], **options)
@@ -0,0 +1,151 @@
+import math
+from sqlalchemy import func, and_, or_, true, bindparam
+from db.models import IP
+
+
+# SRID WGS 84 usado na coluna ips.geo_point
+SRID_WGS84 = 4326
+
+# Para o SRID 4326 o MySQL espera latitude primeiro; forçamos a ordem longitude-latitude no WKT
+AXIS_ORDER = 'axis-order=long-lat'
+
+# Aproximação de quilômetros por grau de latitude
+KM_PER_DEGREE = 111.32
+
+
+# Raio médio da Terra (o mesmo usado pelo ST_Distance_Sphere)
+EARTH_RADIUS_KM = 6370.986
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> float:
+    '''Distância em quilômetros entre dois pontos (fórmula de haversine)'''
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def point_wkt(latitude, longitude) -> str:
+    '''Retorna o WKT de um ponto na ordem longitude-latitude'''
+    return f"POINT({float(longitude)} {float(latitude)})"
+
+
+def geo_point_expression(latitude, longitude):
+    '''Expressão SQL que gera o POINT (SRID 4326) a partir de latitude e longitude'''
+    return func.ST_GeomFromText(point_wkt(latitude, longitude), SRID_WGS84, AXIS_ORDER)
+
+
+def geo_point_param(name):
+    '''Expressão SQL que gera o POINT a partir de um parâmetro WKT (para UPDATE em lote / executemany)'''
+    return func.ST_GeomFromText(bindparam(name), SRID_WGS84, AXIS_ORDER)
+
+
+def _bbox_polygon(south, west, north, east):
+    '''Expressão SQL de um retângulo (SRID 4326) delimitado pelas coordenadas informadas'''
+    wkt = (
+        f"POLYGON(({west} {south}, {east} {south}, {east} {north}, "
+        f"{west} {north}, {west} {south}))"
+    )
+    return func.ST_GeomFromText(wkt, SRID_WGS84, AXIS_ORDER)
+
+
+def within_bbox(south, west, north, east):
+    '''
+    Filtro para IPs dentro de um retângulo (ex.: área visível do mapa).
+
+    Usa MBRContains sobre ips.geo_point, o que permite ao MySQL resolver a busca pelo SPATIAL INDEX.
+    Retângulos que cruzam o antimeridiano (west > east) são divididos em dois.
+    '''
+    south = max(-90.0, min(90.0, float(south)))
+    north = max(-90.0, min(90.0, float(north)))
+    west, east = float(west), float(east)
+
+    # Viewport mais largo que o globo: não há o que filtrar na longitude
+    if east - west >= 360:
+        west, east = -180.0, 180.0
+    else:
+        west = ((west + 180) % 360) - 180
+        east = ((east + 180) % 360) - 180
+
+    if west <= east:
+        spatial = func.MBRContains(_bbox_polygon(south, west, north, east), IP.geo_point)
+    else:
+        spatial = or_(
+            func.MBRContains(_bbox_polygon(south, west, north, 180.0), IP.geo_point),
+            func.MBRContains(_bbox_polygon(south, -180.0, north, east), IP.geo_point)
+        )
+
+    return and_(IP.latitude.isnot(None), IP.longitude.isnot(None), spatial)
+
+
+def radius_bbox(latitude, longitude, radius_km):
+    '''Retorna (south, west, north, east) do retângulo que envolve o círculo informado'''
+    latitude, longitude, radius_km = float(latitude), float(longitude), float(radius_km)
+
+    delta_lat = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6:
+        delta_lon = 180.0
+    else:
+        delta_lon = min(180.0, radius_km / (KM_PER_DEGREE * cos_lat))
+
+    return (
+        latitude - delta_lat,
+        longitude - delta_lon,
+        latitude + delta_lat,
+        longitude + delta_lon
+    )
+
+
+def within_radius(latitude, longitude, radius_km):
+    '''
+    Filtro para IPs a até radius_km quilômetros do ponto informado.
+
+    O retângulo envolvente é resolvido pelo SPATIAL INDEX e apenas os candidatos
+    passam pelo cálculo exato de distância (ST_Distance_Sphere, em metros).
+    '''
+    south, west, north, east = radius_bbox(latitude, longitude, radius_km)
+
+    return and_(
+        within_bbox(south, west, north, east),
+        func.ST_Distance_Sphere(IP.geo_point, geo_point_expression(latitude, longitude)) <= float(radius_km) * 1000
+    )
+
+
+def spatial_filter(area):
+    '''
+    Converte a área selecionada na página GeoIP em filtro SQL.
+
+    Formatos aceitos:
+        {'type': 'bbox', 'south': ..., 'west': ..., 'north': ..., 'east': ...}
+        {'type': 'radius', 'latitude': ..., 'longitude': ..., 'radius_km': ...}
+    Sem área, retorna um filtro neutro.
+    '''
+    if not area:
+        return true()
+
+    if area.get('type') == 'bbox':
+        return within_bbox(area['south'], area['west'], area['north'], area['east'])
+
+    if area.get('type') == 'radius':
+        return within_radius(area['latitude'], area['longitude'], area['radius_km'])
+
+    raise ValueError(f"Tipo de área desconhecido: {area.get('type')}")
+
+
+def bounds_to_area(bounds, precision=4):
+    '''Converte o dicionário "bounds" retornado pelo st_folium em área do tipo bbox'''
+    if not bounds or not bounds.get('_southWest') or not bounds.get('_northEast'):
+        return None
+
+    south_west = bounds['_southWest']
+    north_east = bounds['_northEast']
+    if south_west.get('lat') is None or north_east.get('lat') is None:
+        return None
+
+    return {
+        'type': 'bbox',
+        'south': round(south_west['lat'], precision),
+        'west': round(south_west['lng'], precision),
+        'north': round(north_east['lat'], precision),
+        'east': round(north_east['lng'], precision)
+    }
@@ -111,7 +111,22 @@ CREATE TABLE IF NOT EXISTS ips (
   isp TEXT,
   org TEXT,
   as_name TEXT,
-  mobile TINYINT(1)
+  mobile TINYINT(1),
+  -- Ponto geográfico (SRID 4326) sincronizado com latitude/longitude pelo enriquecimento.
+  -- IPs ainda não enriquecidos ficam em POINT(0 0) (SPATIAL INDEX exige NOT NULL).
+  geo_point POINT NOT NULL SRID 4326 DEFAULT (ST_GeomFromText('POINT(0 0)', 4326)),
+  -- Estado do enriquecimento: PENDING, DONE, FAILED (com retry_after), PRIVATE, RESERVED, INVALID
+  enrichment_status VARCHAR(20) NOT NULL DEFAULT 'PENDING',
+  enriched_at TIMESTAMP NULL,
+  attempts INT NOT NULL DEFAULT 0,
+  retry_after TIMESTAMP NULL,
+  -- Prioridade na fila: 0 = normal, 1 = operação aberta/carregada, 2 = pedido explícito
+  priority_tier INT NOT NULL DEFAULT 0,
+  priority_at TIMESTAMP NULL,
+  priority_weight INT NOT NULL DEFAULT 0,
+  SPATIAL INDEX idx_ips_geo_point (geo_point),
+  INDEX idx_ips_enrichment (enrichment_status, retry_after),
+  INDEX idx_ips_priority (enrichment_status, priority_tier, priority_at, priority_weight)
 );
 
 -- Tabela de mensagens (sem FK para whats_groups)
@@ -127,6 +142,8 @@ CREATE TABLE IF NOT EXISTS messages (
   message_type VARCHAR(255),
   message_style VARCHAR(255),
   message_size INT,
+  INDEX idx_messages_file_timestamp (file_id, timestamp),
+  INDEX idx_messages_sender_timestamp (sender, timestamp),
   FOREIGN KEY (file_id) REFERENCES files(file_id)
     ON DELETE CASCADE,
   FOREIGN KEY (sender_ip) REFERENCES ips(sender_ip)
@@ -141,6 +158,51 @@ CREATE TABLE IF NOT EXISTS message_recipients (
     ON DELETE CASCADE
 );
 
+-- Resumo diário das conversas do alvo de cada arquivo (mantido na ingestão)
+-- Removido junto com o arquivo (CASCADE), o que desfaz a contribuição do pacote excluído
+CREATE TABLE IF NOT EXISTS conversation_stats (
+  file_id INT NOT NULL,
+  conversation_key VARCHAR(255) NOT NULL,
+  day DATE NOT NULL,
+  contact VARCHAR(255),
+  group_id VARCHAR(255),
+  sent INT NOT NULL DEFAULT 0,
+  received INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (file_id, conversation_key, day),
+  INDEX idx_conversation_stats_file_day (file_id, day),
+  FOREIGN KEY (file_id) REFERENCES files(file_id)
+    ON DELETE CASCADE
+);
+
+-- Snapshot das métricas do dashboard por operação (recalculado na ingestão/exclusão)
+CREATE TABLE IF NOT EXISTS operation_metrics (
+  operation_id INT PRIMARY KEY,
+  version INT NOT NULL DEFAULT 0,
+  refreshed_at TIMESTAMP NULL,
+  num_targets INT NOT NULL DEFAULT 0,
+  num_files INT NOT NULL DEFAULT 0,
+  num_groups INT NOT NULL DEFAULT 0,
+  num_messages INT NOT NULL DEFAULT 0,
+  num_contacts INT NOT NULL DEFAULT 0,
+  num_ips INT NOT NULL DEFAULT 0,
+  start_date TIMESTAMP NULL,
+  end_date TIMESTAMP NULL,
+  files_by_status JSON,
+  messages_by_type JSON,
+  top_targets JSON,
+  FOREIGN KEY (operation_id) REFERENCES operations(operation_id)
+    ON DELETE CASCADE
+);
+
+-- Cache de geolocalização por prefixo de rede (/24 IPv4, /48 IPv6)
+CREATE TABLE IF NOT EXISTS ip_prefix_cache (
+  prefix VARCHAR(50) PRIMARY KEY,
+  representative_ip VARCHAR(255) NOT NULL,
+  result JSON NOT NULL,
+  cached_at TIMESTAMP NOT NULL,
+  INDEX idx_ip_prefix_cache_cached_at (cached_at)
+);
+
 -- Trigger: Após deletar de file_groups
 DROP TRIGGER IF EXISTS delete_orphan_groups_after_file_groups;
 DELIMITER $$
@@ -0,0 +1,158 @@
+"""
+Atividade por IP de um telefone (página GeoIP): agregado por IP e detalhe paginado das mensagens.
+
+O mapa e a tabela de detalhes usam os mesmos filtros (operação, telefone, período e área), montados
+uma única vez em IPActivityQuery:
+
+    - aggregate(): um GROUP BY sender_ip no banco (COUNT, MIN/MAX(timestamp)), uma linha por IP;
+    - daily_counts(): mensagens por dia, para o gráfico temporal;
+    - detail_page(after): uma página das mensagens, em ordem (timestamp, message_id) decrescente,
+      paginada por keyset (db.pagination: o cursor é a última linha da página anterior, sem OFFSET);
+    - detail_count(): total de mensagens do detalhe (mesmas junções e filtros do detail_page);
+    - stream_details(): todas as mensagens em blocos, com cursor do lado do servidor (db.streaming),
+      para exportações.
+"""
+from sqlalchemy import func, select
+
+from db.session import get_session
+from db.models import Message, File, IP
+from db.geo import spatial_filter
+from db.filters import time_range_filter
+from db.pagination import keyset_page, PAGE_SIZE
+from db.streaming import stream_dataframes, CHUNK_SIZE
+
+
+class IPActivityQuery:
+    """Filtros compartilhados entre o agregado do mapa e o detalhe das mensagens."""
+
+    def __init__(self, operation_id, sender, date_range, area=None):
+        self.operation_id = operation_id
+        self.sender = sender
+        self.date_range = date_range
+        self.area = area
+
+    def _filters(self):
+        filters = [
+            File.operation_id == self.operation_id,
+            Message.sender == self.sender,
+            Message.sender_ip.isnot(None),
+            Message.sender_ip != '',
+            time_range_filter(Message.timestamp, self.date_range)
+        ]
+        if self.area:
+            filters.append(spatial_filter(self.area))
+        return filters
+
+    def _detail_columns(self):
+        return (
+            Message.message_id,
+            Message.sender,
+            Message.sender_ip,
+            Message.timestamp,
+            Message.sender_device,
+            Message.message_type,
+            IP.city,
+            IP.region_name,
+            IP.country,
+            IP.latitude,
+            IP.longitude,
+            IP.isp,
+            IP.org,
+            IP.continent
+        )
+
+    def _messages(self, session, *columns):
+        '''Mensagens do telefone no período (com a tabela ips já unida para o filtro espacial)'''
+        return session.query(*columns).select_from(Message).join(
+            File, Message.file_id == File.file_id
+        ).join(
+            IP, Message.sender_ip == IP.sender_ip
+        ).filter(*self._filters())
+
+    def aggregate(self):
+        '''Uma linha por IP geolocalizado: mensagens, primeira/última ocorrência e dados do IP'''
+        with get_session() as session:
+            per_ip = self._messages(
+                session,
+                Message.sender_ip.label('sender_ip'),
+                func.count().label('message_count'),
+                func.min(Message.timestamp).label('first_seen'),
+                func.max(Message.timestamp).label('last_seen')
+            ).group_by(Message.sender_ip).subquery('per_ip')
+
+            rows = session.query(
+                per_ip,
+                IP.city,
+                IP.region_name,
+                IP.country,
+                IP.latitude,
+                IP.longitude,
+                IP.isp,
+                IP.org
+            ).join(
+                IP, IP.sender_ip == per_ip.c.sender_ip
+            ).filter(
+                IP.latitude.isnot(None),
+                IP.longitude.isnot(None)
+            ).all()
+
+            return [
+                {
+                    'sender': self.sender,
+                    'sender_ip': row.sender_ip,
+                    'city': row.city,
+                    'region_name': row.region_name,
+                    'country': row.country,
+                    'latitude': float(row.latitude),
+                    'longitude': float(row.longitude),
+                    'isp': row.isp,
+                    'org': row.org,
+                    'message_count': row.message_count,
+                    'first_seen': row.first_seen,
+                    'last_seen': row.last_seen
+                }
+                for row in rows
+            ]
+
+    def daily_counts(self):
+        '''Lista de (dia, quantidade de mensagens) no período'''
+        with get_session() as session:
+            day = func.date(Message.timestamp)
+            rows = self._messages(session, day.label('day'), func.count().label('count')).group_by(day).order_by(day).all()
+            return [(row.day, row.count) for row in rows]
+
+    def detail_page(self, after=None, limit=PAGE_SIZE):
+        '''
+        Uma página de mensagens com os dados do IP, da mais recente para a mais antiga.
+
+        after é o cursor (timestamp, message_id) devolvido pela página anterior.
+        Retorna (linhas, próximo cursor ou None quando não há mais páginas).
+        '''
+        with get_session() as session:
+            query = self._messages(session, *self._detail_columns())
+
+            return keyset_page(
+                query,
+                [('timestamp', Message.timestamp), ('message_id', Message.message_id)],
+                after=after,
+                limit=limit
+            )
+
+    def detail_count(self):
+        '''Total de mensagens do detalhe (inclui IPs ainda sem coordenadas, ao contrário do aggregate())'''
+        with get_session() as session:
+            return self._messages(session, func.count()).scalar() or 0
+
+    def detail_statement(self):
+        '''SELECT de todas as mensagens detalhadas (sem paginação), da mais recente para a mais antiga'''
+        return select(*self._detail_columns()).select_from(Message).join(
+            File, Message.file_id == File.file_id
+        ).join(
+            IP, Message.sender_ip == IP.sender_ip
+        ).where(
+            *self._filters()
+        ).order_by(Message.timestamp.desc(), Message.message_id.desc())
+
+    def stream_details(self, chunk_size=CHUNK_SIZE):
+        '''Itera todas as mensagens detalhadas em DataFrames de até chunk_size linhas (cursor do lado do servidor)'''
+        return stream_dataframes(self.detail_statement(), chunk_size)
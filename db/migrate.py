@@ -0,0 +1,260 @@
+"""
+Atualização do esquema de bancos já existentes.
+
+O init.sql só é executado quando o volume do MySQL é criado: bancos anteriores não recebem as
+colunas, índices e tabelas novas, e o ORM (que já as mapeia) falha com "Unknown column". Este
+script aplica as mesmas alterações sobre um banco existente e preenche os dados derivados:
+
+    - ips.geo_point: coluna POINT (SRID 4326) preenchida a partir de latitude/longitude dos IPs já
+      geolocalizados (mesma ordem longitude-latitude de db.geo.point_wkt); o SPATIAL INDEX é
+      criado depois do preenchimento;
+    - tabelas materializadas conversation_stats, operation_metrics e ip_prefix_cache: criadas com a
+      mesma definição do init.sql; em seguida o resumo de conversas é recalculado para os arquivos
+      PRTT que ainda não têm resumo e as métricas são calculadas para as operações sem snapshot
+      (sem isso, o dashboard e a página de mensagens ficariam vazios para os dados já carregados);
+    - ips.enrichment_status, enriched_at, attempts, retry_after e as colunas de prioridade da fila
+      (priority_tier, priority_at, priority_weight), com os índices idx_ips_enrichment e
+      idx_ips_priority. Os IPs já geolocalizados (country preenchido, o critério do enriquecimento
+      antigo) passam a DONE, e os privados, reservados e inválidos recebem o estado definitivo de
+      classify_ip; sem isso, todos ficariam PENDING e voltariam a ser enviados ao ip-api.
+
+Cada etapa consulta o information_schema antes de alterar uma tabela e os preenchimentos só tocam
+as linhas que ainda precisam deles, de modo que o script pode ser executado mais de uma vez.
+Executar com a aplicação parada (sem uploads nem o serviço de enriquecimento).
+
+Uso:
+    python -m db.migrate
+"""
+import re
+import sys
+import os
+from pathlib import Path
+from sqlalchemy import text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.session import engine
+from db.geo import SRID_WGS84, AXIS_ORDER
+from db.conversation_stats import rebuild_conversation_stats
+from db.operation_metrics import refresh_operation_metrics
+from db.enrichment_state import classify_ip, ENRICHMENT_PENDING, ENRICHMENT_DONE
+
+
+INIT_SQL = Path(__file__).absolute().parent / 'init.sql'
+
+# Tabelas criadas depois da primeira versão do init.sql
+NEW_TABLES = ['conversation_stats', 'operation_metrics', 'ip_prefix_cache']
+
+# Colunas de estado e prioridade do enriquecimento em ips (mesmas definições do init.sql)
+ENRICHMENT_COLUMNS = [
+    ('enrichment_status', f"VARCHAR(20) NOT NULL DEFAULT '{ENRICHMENT_PENDING}'"),
+    ('enriched_at', "TIMESTAMP NULL"),
+    ('attempts', "INT NOT NULL DEFAULT 0"),
+    ('retry_after', "TIMESTAMP NULL"),
+    ('priority_tier', "INT NOT NULL DEFAULT 0"),
+    ('priority_at', "TIMESTAMP NULL"),
+    ('priority_weight', "INT NOT NULL DEFAULT 0"),
+]
+
+ENRICHMENT_INDEXES = [
+    ('idx_ips_enrichment', "INDEX idx_ips_enrichment (enrichment_status, retry_after)"),
+    ('idx_ips_priority', "INDEX idx_ips_priority (enrichment_status, priority_tier, priority_at, priority_weight)"),
+]
+
+# IPs classificados por UPDATE (executemany)
+CLASSIFY_BATCH_SIZE = 1000
+
+
+def _has_column(connection, table_name, column_name) -> bool:
+    return bool(connection.execute(text("""
+        SELECT COUNT(*)
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = :table_name
+          AND COLUMN_NAME = :column_name
+    """), {'table_name': table_name, 'column_name': column_name}).scalar())
+
+
+def _has_table(connection, table_name) -> bool:
+    return bool(connection.execute(text("""
+        SELECT COUNT(*)
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = :table_name
+    """), {'table_name': table_name}).scalar())
+
+
+def _has_index(connection, table_name, index_name) -> bool:
+    return bool(connection.execute(text("""
+        SELECT COUNT(*)
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = :table_name
+          AND INDEX_NAME = :index_name
+    """), {'table_name': table_name, 'index_name': index_name}).scalar())
+
+
+def _add_column(connection, table_name, column_name, definition):
+    '''ALTER TABLE ... ADD COLUMN, se a coluna ainda não existir'''
+    if _has_column(connection, table_name, column_name):
+        return False
+    print(f"Adicionando coluna {table_name}.{column_name}")
+    connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}"))
+    return True
+
+
+def _add_index(connection, table_name, index_name, definition):
+    '''ALTER TABLE ... ADD INDEX, se o índice ainda não existir (definition inclui o tipo e as colunas)'''
+    if _has_index(connection, table_name, index_name):
+        return False
+    print(f"Criando índice {index_name} em {table_name}")
+    connection.execute(text(f"ALTER TABLE {table_name} ADD {definition}"))
+    return True
+
+
+def migrate_geo_point(connection):
+    '''ips.geo_point: coluna, preenchimento para os IPs já geolocalizados e SPATIAL INDEX'''
+    _add_column(
+        connection, 'ips', 'geo_point',
+        f"POINT NOT NULL SRID {SRID_WGS84} DEFAULT (ST_GeomFromText('POINT(0 0)', {SRID_WGS84}))"
+    )
+
+    # IPs geolocalizados antes da coluna ficaram em POINT(0 0) e sumiriam dos filtros espaciais
+    filled = connection.execute(text(f"""
+        UPDATE ips
+        SET geo_point = ST_GeomFromText(
+            CONCAT('POINT(', longitude, ' ', latitude, ')'), {SRID_WGS84}, '{AXIS_ORDER}'
+        )
+        WHERE latitude IS NOT NULL AND latitude <> ''
+          AND longitude IS NOT NULL AND longitude <> ''
+          AND ST_AsText(geo_point) = 'POINT(0 0)'
+    """)).rowcount
+    if filled:
+        print(f"{filled} IPs com geo_point preenchido")
+
+    _add_index(connection, 'ips', 'idx_ips_geo_point', "SPATIAL INDEX idx_ips_geo_point (geo_point)")
+
+
+def migrate_enrichment_state(connection):
+    '''Colunas e índices do enriquecimento em ips, com o estado dos IPs já existentes'''
+    added = [
+        column_name for column_name, definition in ENRICHMENT_COLUMNS
+        if _add_column(connection, 'ips', column_name, definition)
+    ]
+    if added:
+        print(f"Colunas adicionadas em ips: {added}")
+
+    for index_name, definition in ENRICHMENT_INDEXES:
+        _add_index(connection, 'ips', index_name, definition)
+
+    # Geolocalizados pelo enriquecimento antigo (que selecionava os IPs com country IS NULL)
+    done = connection.execute(text("""
+        UPDATE ips
+        SET enrichment_status = :done, enriched_at = NOW()
+        WHERE enrichment_status = :pending
+          AND country IS NOT NULL
+    """), {'done': ENRICHMENT_DONE, 'pending': ENRICHMENT_PENDING}).rowcount
+    if done:
+        print(f"{done} IPs já geolocalizados marcados como {ENRICHMENT_DONE}")
+
+    # Privados, reservados e inválidos nunca vão para a API: estado definitivo já na migração
+    pending = connection.execute(
+        text("SELECT sender_ip FROM ips WHERE enrichment_status = :pending"),
+        {'pending': ENRICHMENT_PENDING}
+    ).scalars().all()
+    classified = [
+        {'sender_ip': ip, 'status': status}
+        for ip, status in ((ip, classify_ip(ip)) for ip in pending)
+        if status is not None
+    ]
+    for i in range(0, len(classified), CLASSIFY_BATCH_SIZE):
+        connection.execute(text("""
+            UPDATE ips
+            SET enrichment_status = :status, enriched_at = NOW()
+            WHERE sender_ip = :sender_ip
+        """), classified[i:i + CLASSIFY_BATCH_SIZE])
+    if classified:
+        print(f"{len(classified)} IPs classificados localmente (privados/reservados/inválidos)")
+
+
+def create_table_statement(table_name) -> str:
+    '''CREATE TABLE IF NOT EXISTS da tabela, copiado do init.sql (uma única definição do esquema)'''
+    match = re.search(
+        rf"CREATE TABLE IF NOT EXISTS {table_name} \(.*?\n\);",
+        INIT_SQL.read_text(encoding='utf-8'),
+        re.DOTALL
+    )
+    if not match:
+        raise ValueError(f"Tabela {table_name} não encontrada em {INIT_SQL}")
+    return match.group(0)
+
+
+def migrate_new_tables(connection):
+    '''Cria as tabelas materializadas que ainda não existem'''
+    for table_name in NEW_TABLES:
+        if not _has_table(connection, table_name):
+            print(f"Criando tabela {table_name}")
+            connection.exec_driver_sql(create_table_statement(table_name))
+
+
+def files_without_conversation_stats(connection):
+    '''Arquivos PRTT com mensagens e sem nenhuma linha em conversation_stats'''
+    return [row[0] for row in connection.execute(text("""
+        SELECT f.file_id
+        FROM files f
+        WHERE f.file_type = 'PRTT'
+          AND EXISTS (SELECT 1 FROM messages m WHERE m.file_id = f.file_id)
+          AND NOT EXISTS (SELECT 1 FROM conversation_stats cs WHERE cs.file_id = f.file_id)
+        ORDER BY f.file_id
+    """)).all()]
+
+
+def operations_without_metrics(connection):
+    '''Operações sem snapshot em operation_metrics'''
+    return [row[0] for row in connection.execute(text("""
+        SELECT o.operation_id
+        FROM operations o
+        LEFT JOIN operation_metrics om ON om.operation_id = o.operation_id
+        WHERE om.operation_id IS NULL
+        ORDER BY o.operation_id
+    """)).all()]
+
+
+def backfill_materialized():
+    '''Preenche o resumo de conversas e as métricas a partir dos dados já carregados'''
+    with engine.connect() as conn:
+        file_ids = files_without_conversation_stats(conn)
+        operation_ids = operations_without_metrics(conn)
+
+    if file_ids:
+        rebuild_conversation_stats(file_ids)
+    for operation_id in operation_ids:
+        refresh_operation_metrics(operation_id)
+
+    print(f"{len(file_ids)} arquivo(s) com resumo de conversas recalculado, "
+          f"{len(operation_ids)} operação(ões) com métricas calculadas")
+
+
+# Etapas de esquema, em ordem (cada uma em transação própria)
+SCHEMA_STEPS = [
+    migrate_geo_point,
+    migrate_new_tables,
+    migrate_enrichment_state,
+]
+
+
+def migrate():
+    '''Aplica todas as etapas ao banco de DATABASE_URL'''
+    for step in SCHEMA_STEPS:
+        with engine.begin() as conn:
+            step(conn)
+
+    backfill_materialized()
+    print("✅ Esquema atualizado")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        print(__doc__)
+    else:
+        migrate()
@@ -1,15 +1,28 @@
 from sqlalchemy import (
-    ForeignKeyConstraint, String, Text, TIMESTAMP, Boolean, ForeignKey, Integer, UniqueConstraint, Table, Column
+    ForeignKeyConstraint, String, Text, TIMESTAMP, Boolean, ForeignKey, Integer, UniqueConstraint, Table, Column, Index, Date, JSON, text
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.types import UserDefinedType
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, date
 
 
 class Base(DeclarativeBase):
     pass
 
 
+class Point(UserDefinedType):
+    """Tipo espacial POINT do MySQL com SRID fixo (padrão WGS 84)."""
+
+    cache_ok = True
+
+    def __init__(self, srid: int = 4326):
+        self.srid = srid
+
+    def get_col_spec(self, **kw):
+        return f"POINT SRID {self.srid}"
+
+
 # Tabela de associação many-to-many entre operations e targets
 operation_targets = Table(
     "operation_targets",
@@ -146,6 +159,32 @@ class IP(Base):
     org: Mapped[Optional[str]] = mapped_column(Text)
     as_name: Mapped[Optional[str]] = mapped_column(Text)
     mobile: Mapped[Optional[bool]] = mapped_column(Boolean)
+    # POINT (SRID 4326) mantido pelo IPEnricher a partir de latitude/longitude.
+    # O SPATIAL INDEX exige NOT NULL: IPs ainda não enriquecidos ficam em POINT(0 0),
+    # por isso as consultas espaciais sempre filtram também latitude IS NOT NULL.
+    geo_point: Mapped[bytes] = mapped_column(
+        Point(4326),
+        nullable=False,
+        server_default=text("(ST_GeomFromText('POINT(0 0)', 4326))"),
+        deferred=True
+    )
+
+    # Máquina de estados do enriquecimento (PENDING, DONE, FAILED, PRIVATE, RESERVED, INVALID)
+    enrichment_status: Mapped[str] = mapped_column(String(20), nullable=False, server_default='PENDING')
+    enriched_at: Mapped[Optional[datetime]] = mapped_column(TIMESTAMP, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, server_default='0')
+    retry_after: Mapped[Optional[datetime]] = mapped_column(TIMESTAMP, nullable=True)
+
+    # Prioridade na fila de enriquecimento (ver db.enrichment_queue)
+    priority_tier: Mapped[int] = mapped_column(Integer, nullable=False, server_default='0')
+    priority_at: Mapped[Optional[datetime]] = mapped_column(TIMESTAMP, nullable=True)
+    priority_weight: Mapped[int] = mapped_column(Integer, nullable=False, server_default='0')
+
+    __table_args__ = (
+        Index('idx_ips_geo_point', 'geo_point', mysql_prefix='SPATIAL'),
+        Index('idx_ips_enrichment', 'enrichment_status', 'retry_after'),
+        Index('idx_ips_priority', 'enrichment_status', 'priority_tier', 'priority_at', 'priority_weight'),
+    )
 
     messages: Mapped[List["Message"]] = relationship("Message", back_populates="ip")
 
@@ -165,6 +204,12 @@ class Message(Base):
     message_style: Mapped[Optional[str]] = mapped_column(String(255))
     message_size: Mapped[Optional[int]] = mapped_column(Integer)
 
+    # Índices para filtros de período (timestamp >= início AND timestamp < fim)
+    __table_args__ = (
+        Index('idx_messages_file_timestamp', 'file_id', 'timestamp'),
+        Index('idx_messages_sender_timestamp', 'sender', 'timestamp'),
+    )
+
     file: Mapped["File"] = relationship("File", back_populates="messages")
     ip: Mapped[Optional["IP"]] = relationship("IP", back_populates="messages")
     message_recipients: Mapped[List["MessageRecipient"]] = relationship("MessageRecipient", back_populates="message", cascade="all, delete-orphan")
@@ -178,3 +223,50 @@ class MessageRecipient(Base):
     recipient_phone: Mapped[str] = mapped_column(String(255), nullable=False)
 
     message: Mapped["Message"] = relationship("Message", back_populates="message_recipients")
+
+
+class ConversationStat(Base):
+    __tablename__ = 'conversation_stats'
+
+    # Resumo diário por conversa do alvo de cada arquivo (mantido em insert_messages)
+    file_id: Mapped[int] = mapped_column(Integer, ForeignKey('files.file_id', ondelete="CASCADE"), primary_key=True)
+    conversation_key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    contact: Mapped[Optional[str]] = mapped_column(String(255))
+    group_id: Mapped[Optional[str]] = mapped_column(String(255))
+    sent: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    received: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('idx_conversation_stats_file_day', 'file_id', 'day'),
+    )
+
+
+class OperationMetrics(Base):
+    __tablename__ = 'operation_metrics'
+
+    # Snapshot das métricas do dashboard, recalculado ao fim de cada ingestão/exclusão
+    operation_id: Mapped[int] = mapped_column(Integer, ForeignKey('operations.operation_id', ondelete="CASCADE"), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    refreshed_at: Mapped[Optional[datetime]] = mapped_column(TIMESTAMP)
+    num_targets: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    num_files: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    num_groups: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    num_messages: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    num_contacts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    num_ips: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    start_date: Mapped[Optional[datetime]] = mapped_column(TIMESTAMP)
+    end_date: Mapped[Optional[datetime]] = mapped_column(TIMESTAMP)
+    files_by_status: Mapped[Optional[list]] = mapped_column(JSON)
+    messages_by_type: Mapped[Optional[list]] = mapped_column(JSON)
+    top_targets: Mapped[Optional[list]] = mapped_column(JSON)
+
+
+class IPPrefixCache(Base):
+    __tablename__ = 'ip_prefix_cache'
+
+    # Resultado de geolocalização compartilhado por todos os IPs de um prefixo (/24 IPv4, /48 IPv6)
+    prefix: Mapped[str] = mapped_column(String(50), primary_key=True)
+    representative_ip: Mapped[str] = mapped_column(String(255), nullable=False)
+    result: Mapped[dict] = mapped_column(JSON, nullable=False)
+    cached_at: Mapped[datetime] = mapped_column(TIMESTAMP, nullable=False, index=True)
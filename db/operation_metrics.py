@@ -0,0 +1,403 @@
+"""
+Tabela operation_metrics: snapshot das métricas do dashboard por operação.
+
+As agregações (contagens distintas, período, tipos, status e alvos mais ativos) são calculadas
+apenas para a operação afetada. Ao fim de um lote de upload, update_operation_metrics soma ao
+snapshot as mensagens dos arquivos novos e os contatos e IPs que aparecem pela primeira vez na
+operação; os grupos distintos ainda são recontados em toda a operação (messages.group_id não tem
+índice para a verificação por chave). A exclusão de pacotes (e qualquer caso sem snapshot) usa o
+cálculo completo de refresh_operation_metrics.
+
+O dashboard lê uma única linha. Cada atualização incrementa `version`, que identifica a versão
+dos dados da operação.
+"""
+import sys
+import os
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import func, distinct
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.mysql import insert
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.session import get_session
+from db.models import Operation, Target, File, Message, Contact, OperationMetrics, operation_targets, file_contacts
+
+
+# Mesmo formato (start_date/end_date) do resultado da consulta original do dashboard
+DateRange = namedtuple('DateRange', ['start_date', 'end_date'])
+
+
+# Quantidade de alvos exibida no dashboard (o snapshot guarda a contagem de todos os alvos)
+TOP_TARGETS = 5
+
+
+def _file_metrics(session, op_id):
+    '''Alvos, arquivos e status dos arquivos (tabelas pequenas, sempre recontadas)'''
+
+    # 1. Número de Targets (Alvos)
+    num_targets = session.query(func.count(Target.target_id)).join(
+        operation_targets, Target.target_id == operation_targets.c.target_id
+    ).filter(operation_targets.c.operation_id == op_id).scalar()
+
+    # 2. Número de Files (Arquivos)
+    num_files = session.query(func.count(File.file_id)).filter(
+        File.operation_id == op_id
+    ).scalar()
+
+    # 8. Files por status
+    files_by_status = session.query(
+        File.process_status,
+        func.count(File.file_id).label('count')
+    ).filter(File.operation_id == op_id).group_by(File.process_status).all()
+
+    return {
+        'num_targets': num_targets or 0,
+        'num_files': num_files or 0,
+        'files_by_status': [[status, count] for status, count in files_by_status]
+    }
+
+
+def _group_count(session, op_id):
+    '''Grupos distintos da operação (recontados a cada carga)'''
+
+    # 3. Número de Grupos únicos
+    num_groups = session.query(func.count(distinct(Message.group_id))).join(
+        File, Message.file_id == File.file_id
+    ).filter(
+        File.operation_id == op_id,
+        Message.group_id.isnot(None)
+    ).scalar()
+
+    return num_groups or 0
+
+
+def _distinct_metrics(session, op_id):
+    '''Contagens distintas da operação (não podem ser somadas entre cargas)'''
+
+    num_groups = _group_count(session, op_id)
+
+    # 5. Número de Contatos únicos
+    num_contacts = session.query(func.count(distinct(Contact.contact_phone))).join(
+        file_contacts, Contact.contact_id == file_contacts.c.contact_id
+    ).join(
+        File, file_contacts.c.file_id == File.file_id
+    ).filter(File.operation_id == op_id).scalar()
+
+    # 7. Número de IPs únicos
+    num_ips = session.query(func.count(distinct(Message.sender_ip))).join(
+        File, Message.file_id == File.file_id
+    ).filter(
+        File.operation_id == op_id,
+        Message.sender_ip.isnot(None)
+    ).scalar()
+
+    return {
+        'num_groups': num_groups,
+        'num_contacts': num_contacts or 0,
+        'num_ips': num_ips or 0
+    }
+
+
+def _new_distinct_counts(session, op_id, file_ids):
+    '''
+    Contatos e IPs dos arquivos file_ids que não aparecem nos demais arquivos da operação.
+
+    Somados às contagens distintas do snapshot. Cada chave dos arquivos novos é procurada nos arquivos
+    anteriores pelos índices de contacts.contact_phone e messages.sender_ip, sem varrer a operação.
+    '''
+    older_file = aliased(File)
+    older_contact = aliased(Contact)
+    older_message = aliased(Message)
+    older_file_contacts = file_contacts.alias('older_file_contacts')
+
+    def older_files():
+        return (older_file.operation_id == op_id, older_file.file_id.notin_(file_ids))
+
+    contact_seen = session.query(older_file_contacts.c.file_id).join(
+        older_contact, older_contact.contact_id == older_file_contacts.c.contact_id
+    ).join(
+        older_file, older_file.file_id == older_file_contacts.c.file_id
+    ).filter(
+        *older_files(),
+        older_contact.contact_phone == Contact.contact_phone
+    ).exists()
+
+    new_contacts = session.query(func.count(distinct(Contact.contact_phone))).join(
+        file_contacts, Contact.contact_id == file_contacts.c.contact_id
+    ).filter(
+        file_contacts.c.file_id.in_(file_ids),
+        ~contact_seen
+    ).scalar()
+
+    ip_seen = session.query(older_message.message_id).join(
+        older_file, older_message.file_id == older_file.file_id
+    ).filter(
+        *older_files(),
+        older_message.sender_ip == Message.sender_ip
+    ).exists()
+
+    new_ips = session.query(func.count(distinct(Message.sender_ip))).filter(
+        Message.file_id.in_(file_ids),
+        Message.sender_ip.isnot(None),
+        ~ip_seen
+    ).scalar()
+
+    return {'num_contacts': new_contacts or 0, 'num_ips': new_ips or 0}
+
+
+def _message_metrics(session, op_id, file_ids=None):
+    '''
+    Métricas aditivas das mensagens: total, período, por tipo e por alvo.
+
+    Com file_ids, considera apenas as mensagens desses arquivos (o incremento de uma carga).
+    '''
+    def scoped(query):
+        query = query.filter(File.operation_id == op_id)
+        if file_ids is not None:
+            query = query.filter(File.file_id.in_(file_ids))
+        return query
+
+    # 4. Número total de Mensagens
+    num_messages = scoped(session.query(func.count(Message.message_id)).join(
+        File, Message.file_id == File.file_id
+    )).scalar()
+
+    # 6. Período de dados (primeira e última mensagem)
+    date_range = scoped(session.query(
+        func.min(Message.timestamp).label('start_date'),
+        func.max(Message.timestamp).label('end_date')
+    ).join(File, Message.file_id == File.file_id)).first()
+
+    # 9. Mensagens por tipo
+    messages_by_type = scoped(session.query(
+        Message.message_type,
+        func.count(Message.message_id).label('count')
+    ).join(File, Message.file_id == File.file_id)).group_by(Message.message_type).all()
+
+    # 10. Mensagens por alvo (o dashboard exibe os TOP_TARGETS mais ativos)
+    messages_by_target = scoped(session.query(
+        Target.target,
+        func.count(Message.message_id).label('msg_count')
+    ).join(
+        operation_targets, Target.target_id == operation_targets.c.target_id
+    ).join(
+        File, File.target_id == Target.target_id
+    ).join(
+        Message, Message.file_id == File.file_id
+    ).filter(
+        operation_targets.c.operation_id == op_id
+    )).group_by(Target.target).order_by(func.count(Message.message_id).desc()).all()
+
+    return {
+        'num_messages': num_messages or 0,
+        'start_date': date_range.start_date if date_range else None,
+        'end_date': date_range.end_date if date_range else None,
+        'messages_by_type': [[msg_type, count] for msg_type, count in messages_by_type],
+        'top_targets': [[target, count] for target, count in messages_by_target]
+    }
+
+
+def _target_counts(session, op_id, targets):
+    '''Total de mensagens da operação para os alvos informados'''
+    return session.query(
+        Target.target,
+        func.count(Message.message_id)
+    ).join(
+        File, File.target_id == Target.target_id
+    ).join(
+        Message, Message.file_id == File.file_id
+    ).filter(
+        File.operation_id == op_id,
+        Target.target.in_(targets)
+    ).group_by(Target.target).all()
+
+
+def compute_operation_metrics(session, op_id):
+    '''Executa as agregações da operação direto nas tabelas de dados'''
+    return {
+        **_file_metrics(session, op_id),
+        **_distinct_metrics(session, op_id),
+        **_message_metrics(session, op_id)
+    }
+
+
+def _merge_counts(current, delta):
+    '''Soma listas [[chave, contagem]] e ordena pela contagem (maior primeiro)'''
+    totals = {key: count for key, count in current or []}
+    for key, count in delta:
+        totals[key] = totals.get(key, 0) + count
+    return [[key, count] for key, count in sorted(totals.items(), key=lambda item: item[1], reverse=True)]
+
+
+def refresh_operation_metrics(operation_id):
+    '''Recalcula e grava o snapshot da operação, incrementando a versão'''
+    if not operation_id:
+        return None
+
+    try:
+        with get_session() as session:
+            if not session.query(Operation.operation_id).filter_by(operation_id=operation_id).first():
+                return None
+
+            values = compute_operation_metrics(session, operation_id)
+            values['refreshed_at'] = datetime.now()
+
+            table = OperationMetrics.__table__
+            stmt = insert(table).values(operation_id=operation_id, version=1, **values)
+            stmt = stmt.on_duplicate_key_update(version=table.c.version + 1, **values)
+            session.execute(stmt)
+            session.commit()
+
+            print(f"📊 Métricas da operação {operation_id} atualizadas")
+            return values
+
+    except Exception as e:
+        print(f"❌ Erro ao atualizar métricas da operação {operation_id}: {str(e)}")
+        return None
+
+
+def update_operation_metrics(operation_id, file_ids):
+    '''
+    Atualiza o snapshot da operação após a carga de file_ids (arquivos novos), incrementando a versão.
+
+    Total de mensagens, período, mensagens por tipo e por alvo são calculados só sobre as mensagens
+    dos arquivos novos e somados ao snapshot, assim como os contatos e IPs novos na operação; alvos,
+    arquivos e status (tabelas pequenas) e os grupos distintos são recontados. Chamada uma vez por
+    lote de upload. Sem snapshot anterior, faz o cálculo completo.
+    '''
+    if not operation_id:
+        return None
+
+    snapshot = _read_snapshot(operation_id)
+    if not snapshot:
+        return refresh_operation_metrics(operation_id)
+
+    file_ids = list(file_ids or [])
+
+    try:
+        with get_session() as session:
+            values = {**_file_metrics(session, operation_id), 'num_groups': _group_count(session, operation_id)}
+
+            if file_ids:
+                new_keys = _new_distinct_counts(session, operation_id, file_ids)
+                delta = _message_metrics(session, operation_id, file_ids)
+                stored_targets = {target for target, _ in snapshot['top_targets'] or []}
+
+                # Alvos fora do snapshot (novos, ou além dos 5 guardados pelos snapshots antigos) são contados por inteiro
+                missing = [target for target, _ in delta['top_targets'] if target not in stored_targets]
+                if missing:
+                    full_counts = dict(_target_counts(session, operation_id, missing))
+                    delta['top_targets'] = [
+                        [target, full_counts.get(target, count)]
+                        for target, count in delta['top_targets']
+                    ]
+
+                starts = [value for value in (snapshot['start_date'], delta['start_date']) if value]
+                ends = [value for value in (snapshot['end_date'], delta['end_date']) if value]
+                values.update({
+                    'num_contacts': snapshot['num_contacts'] + new_keys['num_contacts'],
+                    'num_ips': snapshot['num_ips'] + new_keys['num_ips'],
+                    'num_messages': snapshot['num_messages'] + delta['num_messages'],
+                    'start_date': min(starts) if starts else None,
+                    'end_date': max(ends) if ends else None,
+                    'messages_by_type': _merge_counts(snapshot['messages_by_type'], delta['messages_by_type']),
+                    'top_targets': _merge_counts(snapshot['top_targets'], delta['top_targets'])
+                })
+
+            values['refreshed_at'] = datetime.now()
+
+            table = OperationMetrics.__table__
+            session.execute(
+                table.update().where(table.c.operation_id == operation_id).values(version=table.c.version + 1, **values)
+            )
+            session.commit()
+
+            print(f"📊 Métricas da operação {operation_id} atualizadas ({len(file_ids)} arquivo(s) novo(s))")
+            return values
+
+    except Exception as e:
+        print(f"❌ Erro ao atualizar métricas da operação {operation_id}: {str(e)}")
+        return None
+
+
+def bump_versions_for_ips(ip_list, chunk_size=1000):
+    '''
+    Incrementa a versão das operações com mensagens desses IPs.
+
+    Chamada ao fim do enriquecimento: os caches das páginas (app/query_cache.py) que mostram
+    geolocalização passam a buscar os dados novos. Retorna quantas operações foram afetadas.
+    '''
+    ip_list = list(set(ip_list or []))
+    if not ip_list:
+        return 0
+
+    try:
+        with get_session() as session:
+            operation_ids = set()
+            for i in range(0, len(ip_list), chunk_size):
+                rows = session.query(File.operation_id).join(
+                    Message, Message.file_id == File.file_id
+                ).filter(
+                    Message.sender_ip.in_(ip_list[i:i + chunk_size])
+                ).distinct().all()
+                operation_ids.update(row[0] for row in rows)
+
+            if operation_ids:
+                session.query(OperationMetrics).filter(
+                    OperationMetrics.operation_id.in_(operation_ids)
+                ).update(
+                    {OperationMetrics.version: OperationMetrics.version + 1},
+                    synchronize_session=False
+                )
+                session.commit()
+
+            return len(operation_ids)
+
+    except Exception as e:
+        print(f"❌ Erro ao atualizar versão das operações: {str(e)}")
+        return 0
+
+
+def _read_snapshot(operation_id):
+    with get_session() as session:
+        snapshot = session.query(OperationMetrics).filter_by(operation_id=operation_id).first()
+        if not snapshot:
+            return None
+        return {
+            column.name: getattr(snapshot, column.key)
+            for column in OperationMetrics.__table__.columns
+        }
+
+
+def get_operation_metrics_snapshot(operation_id):
+    '''
+    Lê o snapshot da operação no formato esperado pelo dashboard.
+
+    Se a operação ainda não tiver snapshot, calcula na hora.
+    '''
+    if not operation_id:
+        return None
+
+    snapshot = _read_snapshot(operation_id)
+    if not snapshot and refresh_operation_metrics(operation_id) is not None:
+        snapshot = _read_snapshot(operation_id)
+
+    if not snapshot:
+        return None
+
+    return {
+        'num_targets': snapshot['num_targets'],
+        'num_files': snapshot['num_files'],
+        'num_groups': snapshot['num_groups'],
+        'num_messages': snapshot['num_messages'],
+        'num_contacts': snapshot['num_contacts'],
+        'num_ips': snapshot['num_ips'],
+        'date_range': DateRange(snapshot['start_date'], snapshot['end_date']),
+        'files_by_status': [tuple(item) for item in snapshot['files_by_status'] or []],
+        'messages_by_type': [tuple(item) for item in snapshot['messages_by_type'] or []],
+        'top_targets': [tuple(item) for item in (snapshot['top_targets'] or [])[:TOP_TARGETS]],
+        'version': snapshot['version'],
+        'refreshed_at': snapshot['refreshed_at']
+    }
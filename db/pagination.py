@@ -0,0 +1,49 @@
+"""
+Paginação por keyset (seek) para tabelas grandes das páginas.
+
+Em vez de OFFSET, cada página começa logo após a última linha da anterior: o cursor é o valor das
+colunas de ordenação dessa linha e o filtro (c1, c2, ...) < (v1, v2, ...) é expandido em
+OR/AND, o que permite ao MySQL percorrer o índice a partir do cursor. O custo de cada página é o
+mesmo, seja a primeira ou a milésima, e apenas uma página é trazida do banco.
+
+As colunas de ordenação devem definir uma ordem total (a última normalmente é a chave primária)
+e são informadas como pares (nome na linha, expressão SQL):
+
+    page, next_cursor = keyset_page(
+        query,
+        [('timestamp', Message.timestamp), ('message_id', Message.message_id)],
+        after=cursor
+    )
+"""
+from sqlalchemy import and_, or_
+
+
+# Tamanho padrão das páginas
+PAGE_SIZE = 500
+
+
+def keyset_filter(order_by, after, descending=True):
+    '''Filtro das linhas posteriores ao cursor after na ordem informada'''
+    clauses = []
+    for index, ((_, column), value) in enumerate(zip(order_by, after)):
+        equal_prefix = [previous == previous_value for (_, previous), previous_value in zip(order_by[:index], after[:index])]
+        step = column < value if descending else column > value
+        clauses.append(and_(*equal_prefix, step))
+    return or_(*clauses)
+
+
+def keyset_page(query, order_by, after=None, limit=PAGE_SIZE, descending=True):
+    '''
+    Executa uma página da consulta ordenada por order_by.
+
+    Retorna (linhas como dicionários, cursor da próxima página ou None quando não há mais páginas).
+    '''
+    if after:
+        query = query.filter(keyset_filter(order_by, after, descending))
+
+    ordering = [column.desc() if descending else column.asc() for _, column in order_by]
+    rows = query.order_by(*ordering).limit(limit + 1).all()
+
+    page = [row._asdict() for row in rows[:limit]]
+    next_cursor = tuple(page[-1][name] for name, _ in order_by) if len(rows) > limit else None
+    return page, next_cursor
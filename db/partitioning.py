@@ -0,0 +1,308 @@
+"""
+Particionamento opcional da tabela messages por mês (RANGE sobre UNIX_TIMESTAMP(timestamp)).
+
+Com o particionamento ativo, consultas limitadas por data (timestamp >= início AND timestamp < fim)
+passam a ler apenas as partições do período (partition pruning) e a remoção de meses antigos vira
+um DROP PARTITION em vez de um DELETE de horas.
+
+Restrições do MySQL para tabelas particionadas:
+    - não podem ter FOREIGN KEY (nem referenciar, nem ser referenciadas): as FKs de messages e
+      de message_recipients são removidas e a exclusão em cascata passa a ser feita pelo ORM
+      (relacionamentos File.messages e Message.message_recipients);
+    - toda chave única precisa conter a coluna de particionamento: a PK passa a ser
+      (message_id, timestamp). O banco deixa de garantir message_id único; a deduplicação fica
+      com a ingestão (insert_messages ignora os message_id já gravados) e o comando duplicates
+      lista os message_id repetidos, se houver;
+    - timestamp passa a ser NOT NULL: a conversão é recusada enquanto houver mensagens sem data
+      (nada é apagado) e, depois dela, insert_messages rejeita as mensagens sem timestamp.
+
+Remover meses antigos apaga mensagens: o resumo de conversas (conversation_stats) dos arquivos
+afetados é recalculado e as métricas das operações (operation_metrics) são atualizadas.
+
+Uso:
+    python -m db.partitioning enable              # converte a tabela (uma única vez)
+    python -m db.partitioning ensure 2025-12      # cria partições até o mês informado
+    python -m db.partitioning drop-before 2024-01 # remove os meses anteriores ao informado
+    python -m db.partitioning duplicates          # lista message_id repetidos
+"""
+import sys
+import os
+from datetime import date, datetime, timezone
+from sqlalchemy import text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.session import engine
+from db.conversation_stats import rebuild_conversation_stats
+from db.operation_metrics import refresh_operation_metrics
+
+
+# Partição que recebe tudo que for anterior ao primeiro mês particionado
+OLDEST_PARTITION = 'p000000'
+
+# Partição coringa para datas futuras (deve permanecer vazia)
+FUTURE_PARTITION = 'pmax'
+
+# Quantos meses à frente manter partições criadas
+MONTHS_AHEAD = 3
+
+
+def _month_start(value) -> date:
+    '''Retorna o primeiro dia do mês da data informada'''
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.replace(day=1)
+
+
+def _add_months(month: date, months: int) -> date:
+    '''Soma meses a uma data de início de mês'''
+    index = month.year * 12 + (month.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _epoch(month: date) -> int:
+    '''Limite da partição em segundos UTC (independente do time_zone da sessão)'''
+    return int(datetime(month.year, month.month, month.day, tzinfo=timezone.utc).timestamp())
+
+
+def _partition_name(month: date) -> str:
+    return f"p{month.year:04d}{month.month:02d}"
+
+
+def _partition_definition(month: date) -> str:
+    '''Partição que guarda o mês informado (limite superior = início do mês seguinte)'''
+    return f"PARTITION {_partition_name(month)} VALUES LESS THAN ({_epoch(_add_months(month, 1))})"
+
+
+def _months_between(start: date, end: date):
+    month = _month_start(start)
+    end = _month_start(end)
+    while month <= end:
+        yield month
+        month = _add_months(month, 1)
+
+
+def get_month_partitions(connection):
+    '''Retorna a lista de meses (date) já particionados em messages, em ordem'''
+    rows = connection.execute(text("""
+        SELECT PARTITION_NAME
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = 'messages'
+          AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """)).all()
+
+    months = []
+    for (name,) in rows:
+        if name in (OLDEST_PARTITION, FUTURE_PARTITION):
+            continue
+        months.append(date(int(name[1:5]), int(name[5:7]), 1))
+    return months
+
+
+def is_partitioning_enabled(connection=None) -> bool:
+    '''Indica se a tabela messages já está particionada'''
+    if connection is None:
+        with engine.connect() as conn:
+            return is_partitioning_enabled(conn)
+
+    count = connection.execute(text("""
+        SELECT COUNT(*)
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = 'messages'
+          AND PARTITION_NAME IS NOT NULL
+    """)).scalar()
+    return bool(count)
+
+
+def _drop_foreign_keys(connection, table_name, referenced_table=None):
+    '''Remove as FKs de uma tabela (opcionalmente apenas as que apontam para referenced_table)'''
+    query = """
+        SELECT CONSTRAINT_NAME
+        FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = DATABASE()
+          AND TABLE_NAME = :table_name
+    """
+    params = {'table_name': table_name}
+    if referenced_table:
+        query += " AND REFERENCED_TABLE_NAME = :referenced_table"
+        params['referenced_table'] = referenced_table
+
+    for (constraint_name,) in connection.execute(text(query), params).all():
+        print(f"Removendo FK {constraint_name} de {table_name}")
+        connection.execute(text(f"ALTER TABLE {table_name} DROP FOREIGN KEY {constraint_name}"))
+
+
+def enable_partitioning(months_ahead: int = MONTHS_AHEAD):
+    '''
+    Converte messages para particionamento mensal.
+
+    Operação pesada (reconstrói a tabela): executar em janela de manutenção, sem uploads em andamento.
+    Recusada (sem alterar nada) se houver mensagens sem timestamp.
+    '''
+    with engine.begin() as conn:
+        if is_partitioning_enabled(conn):
+            print("ℹ️  Tabela messages já está particionada.")
+            return {'status': 'info', 'message': 'Tabela messages já está particionada'}
+
+        # Verificado antes de qualquer DDL (o MySQL confirma cada ALTER TABLE na hora)
+        undated, = conn.execute(text("SELECT COUNT(*) FROM messages WHERE timestamp IS NULL")).one()
+        if undated:
+            message = (f"{undated} mensagem(ns) sem timestamp: corrija ou remova essas mensagens "
+                       f"(e seus destinatários) antes de particionar")
+            print(f"❌ {message}")
+            return {'status': 'error', 'message': message, 'undated': undated}
+
+        first_ts, = conn.execute(text("SELECT MIN(timestamp) FROM messages")).one()
+        first_month = _month_start(first_ts or datetime.now(timezone.utc))
+        last_month = _add_months(_month_start(datetime.now(timezone.utc)), months_ahead)
+
+        last_ts, = conn.execute(text("SELECT MAX(timestamp) FROM messages")).one()
+        if last_ts and _month_start(last_ts) > last_month:
+            last_month = _month_start(last_ts)
+
+        _drop_foreign_keys(conn, 'message_recipients', 'messages')
+        _drop_foreign_keys(conn, 'messages')
+
+        conn.execute(text("""
+            ALTER TABLE messages
+                MODIFY timestamp TIMESTAMP NOT NULL,
+                DROP PRIMARY KEY,
+                ADD PRIMARY KEY (message_id, timestamp)
+        """))
+
+        partitions = [f"PARTITION {OLDEST_PARTITION} VALUES LESS THAN ({_epoch(first_month)})"]
+        partitions += [_partition_definition(month) for month in _months_between(first_month, last_month)]
+        partitions.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+
+        conn.execute(text(
+            "ALTER TABLE messages PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (\n    "
+            + ",\n    ".join(partitions)
+            + "\n)"
+        ))
+
+    print(f"✅ messages particionada de {first_month:%Y-%m} até {last_month:%Y-%m}")
+    return {'status': 'success', 'message': f'Particionamento mensal ativado ({first_month:%Y-%m} a {last_month:%Y-%m})'}
+
+
+def ensure_month_partitions(until, months_ahead: int = MONTHS_AHEAD):
+    '''
+    Garante partições criadas até o mês de `until` (e `months_ahead` meses além do atual).
+
+    Deve ser chamada ANTES de a sessão de ingestão tocar a tabela messages: o ALTER TABLE usa
+    conexão própria e esperaria pelo metadata lock de uma transação aberta sobre messages.
+    Sem particionamento ativo, não faz nada.
+    '''
+    target_month = max(
+        _month_start(until),
+        _add_months(_month_start(datetime.now(timezone.utc)), months_ahead)
+    )
+
+    with engine.begin() as conn:
+        if not is_partitioning_enabled(conn):
+            return []
+
+        months = get_month_partitions(conn)
+        start = _add_months(months[-1], 1) if months else _month_start(until)
+        missing = list(_months_between(start, target_month)) if start <= target_month else []
+
+        if not missing:
+            return []
+
+        # pmax fica sempre vazia, então reorganizá-la é instantâneo
+        definitions = [_partition_definition(month) for month in missing]
+        definitions.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+        conn.execute(text(
+            f"ALTER TABLE messages REORGANIZE PARTITION {FUTURE_PARTITION} INTO (\n    "
+            + ",\n    ".join(definitions)
+            + "\n)"
+        ))
+
+    created = [_partition_name(month) for month in missing]
+    print(f"🧱 Partições criadas em messages: {created}")
+    return created
+
+
+def drop_partitions_before(month):
+    '''
+    Remove por DROP PARTITION todos os meses anteriores a `month`.
+
+    Os destinatários dessas mensagens são removidos antes (message_recipients não é particionada).
+    Em seguida o resumo de conversas dos arquivos afetados é recalculado e as métricas das
+    operações afetadas são atualizadas.
+    '''
+    limit_month = _month_start(month)
+
+    with engine.begin() as conn:
+        if not is_partitioning_enabled(conn):
+            return {'status': 'error', 'message': 'Tabela messages não está particionada'}
+
+        to_drop = [_partition_name(m) for m in get_month_partitions(conn) if m < limit_month]
+        to_drop.insert(0, OLDEST_PARTITION)
+
+        affected = conn.execute(text(f"""
+            SELECT DISTINCT f.file_id, f.operation_id
+            FROM messages PARTITION ({', '.join(to_drop)}) m
+            JOIN files f ON f.file_id = m.file_id
+        """)).all()
+
+        for partition in to_drop:
+            conn.execute(text(f"""
+                DELETE mr FROM message_recipients mr
+                JOIN messages PARTITION ({partition}) m ON m.message_id = mr.message_id
+            """))
+
+        # A partição mais antiga é esvaziada (não removida) para continuar aceitando datas antigas
+        conn.execute(text(f"ALTER TABLE messages TRUNCATE PARTITION {OLDEST_PARTITION}"))
+
+        dropped = to_drop[1:]
+        if dropped:
+            conn.execute(text(f"ALTER TABLE messages DROP PARTITION {', '.join(dropped)}"))
+
+    print(f"🗑️  Partições removidas: {dropped}")
+
+    # Resumos derivados das mensagens removidas
+    if affected:
+        rebuild_conversation_stats(sorted({file_id for file_id, _ in affected}))
+        for operation_id in sorted({operation_id for _, operation_id in affected}):
+            refresh_operation_metrics(operation_id)
+
+    return {'status': 'success', 'message': f'{len(dropped)} partição(ões) removida(s)'}
+
+
+def find_duplicate_message_ids(limit: int = 100):
+    '''
+    Lista (message_id, ocorrências) repetidos em messages.
+
+    Com a tabela particionada a PK é (message_id, timestamp) e o banco não impede o mesmo
+    message_id com datas diferentes; a ingestão deduplica, e esta consulta confere.
+    '''
+    with engine.connect() as conn:
+        return conn.execute(text("""
+            SELECT message_id, COUNT(*) AS ocorrencias
+            FROM messages
+            GROUP BY message_id
+            HAVING COUNT(*) > 1
+            ORDER BY ocorrencias DESC
+            LIMIT :limit
+        """), {'limit': limit}).all()
+
+
+if __name__ == '__main__':
+    comando = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if comando == 'enable':
+        enable_partitioning()
+    elif comando == 'ensure' and len(sys.argv) > 2:
+        ensure_month_partitions(datetime.strptime(sys.argv[2], '%Y-%m'))
+    elif comando == 'drop-before' and len(sys.argv) > 2:
+        drop_partitions_before(datetime.strptime(sys.argv[2], '%Y-%m'))
+    elif comando == 'duplicates':
+        duplicados = find_duplicate_message_ids()
+        for message_id, ocorrencias in duplicados:
+            print(f"{message_id}: {ocorrencias}")
+        print("✅ Nenhum message_id repetido" if not duplicados else f"⚠️  {len(duplicados)} message_id repetido(s)")
+    else:
+        print(__doc__)
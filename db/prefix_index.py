@@ -0,0 +1,90 @@
+"""
+Busca por prefixo de telefones da operação (remetentes, alvos e contatos).
+
+Em vez de carregar todos os valores distintos em um st.selectbox a cada rerun, cada lista é lida
+uma única vez (por versão dos dados, ver app/prefix_search.py) e mantida como um array ordenado;
+cada busca é resolvida com bisect em O(log n) e devolve apenas os primeiros N resultados.
+
+Uso programático:
+    from db.prefix_index import load_prefix_index
+    index = load_prefix_index(operation_id, 'senders')
+    index.search('5561', limit=20)
+"""
+from bisect import bisect_left
+
+from db.session import get_session
+from db.models import Message, File, Target, Contact, operation_targets, file_contacts
+
+
+# Resultados devolvidos por busca
+DEFAULT_LIMIT = 20
+
+
+class PrefixIndex:
+    """Array ordenado de valores distintos com busca por prefixo (bisect)."""
+
+    def __init__(self, values):
+        self.values = sorted(set(value for value in values if value))
+
+    def __len__(self):
+        return len(self.values)
+
+    def search(self, prefix, limit=DEFAULT_LIMIT):
+        '''Primeiros limit valores que começam com prefix (os primeiros da lista se prefix for vazio)'''
+        prefix = (prefix or '').strip()
+        start = bisect_left(self.values, prefix)
+        matches = []
+        for value in self.values[start:start + limit]:
+            if not value.startswith(prefix):
+                break
+            matches.append(value)
+        return matches
+
+    def count(self, prefix):
+        '''Quantidade de valores que começam com prefix'''
+        prefix = (prefix or '').strip()
+        if not prefix:
+            return len(self.values)
+        # Todo valor com o prefixo é menor que o prefixo seguido do maior caractere possível
+        return bisect_left(self.values, prefix + '\U0010ffff') - bisect_left(self.values, prefix)
+
+
+def _senders_query(session, operation_id):
+    return session.query(Message.sender).join(
+        File, Message.file_id == File.file_id
+    ).filter(
+        File.operation_id == operation_id,
+        Message.sender.isnot(None),
+        Message.sender != ''
+    ).distinct()
+
+
+def _targets_query(session, operation_id):
+    return session.query(Target.target).join(
+        operation_targets, Target.target_id == operation_targets.c.target_id
+    ).filter(operation_targets.c.operation_id == operation_id).distinct()
+
+
+def _contacts_query(session, operation_id):
+    return session.query(Contact.contact_phone).join(
+        file_contacts, Contact.contact_id == file_contacts.c.contact_id
+    ).join(
+        File, file_contacts.c.file_id == File.file_id
+    ).filter(File.operation_id == operation_id).distinct()
+
+
+INDEX_QUERIES = {
+    'senders': _senders_query,
+    'targets': _targets_query,
+    'contacts': _contacts_query,
+}
+
+
+def load_prefix_index(operation_id, kind):
+    '''Monta o índice de prefixos (kind: senders, targets ou contacts) a partir do banco'''
+    if kind not in INDEX_QUERIES:
+        raise ValueError(f"Tipo de índice desconhecido: {kind}")
+
+    with get_session() as session:
+        rows = INDEX_QUERIES[kind](session, operation_id)
+        return PrefixIndex(row[0] for row in rows)
@@ -1,5 +1,8 @@
 from datetime import datetime
 from db.session import get_session
+from db.partitioning import ensure_month_partitions, is_partitioning_enabled
+from db.conversation_stats import summarize_conversations, apply_conversation_stats
+from db.enrichment_state import classify_ip, ENRICHMENT_PENDING
 from db.models import Operation, Target, File, Group, Contact, IP, Message, MessageRecipient, GroupMetadata
 from extractor import get_account_data, get_messages, get_contacts_and_groups
 
@@ -86,7 +89,7 @@ def insert_data_into_files(operation_id, zip_path: str, account_data: dict):
             ).first()
             
             if existing:
-                return {'status': 'info', 'message': f'Arquivo {filename} já existe para target {target.target} na operação {operation_id}'}
+                return {'status': 'info', 'message': f'Arquivo {filename} já existe para target {target.target} na operação {operation_id}', 'file_id': existing.file_id}
             
             # Preparar dados
             file_data = {
@@ -105,7 +108,7 @@ def insert_data_into_files(operation_id, zip_path: str, account_data: dict):
             session.add(new_file)
             session.commit()
             
-            return {'status': 'success', 'message': 'Dados da conta salvos'}
+            return {'status': 'success', 'message': 'Dados da conta salvos', 'file_id': new_file.file_id}
     except Exception as e:
         print(f"❌ Erro ao inserir arquivo: {str(e)}")
         import traceback
@@ -339,6 +342,20 @@ def insert_messages(operation_id, zip_path: str):
             
             print(f"Após remover duplicatas: {len(unique_messages)} mensagens únicas")
             
+            # Com messages particionada o timestamp é NOT NULL (faz parte da PK): mensagens sem data são rejeitadas
+            undated = [msg_id for msg_id, msg_data in unique_messages.items() if not msg_data.get('timestamp')]
+            if undated and is_partitioning_enabled():
+                for msg_id in undated:
+                    del unique_messages[msg_id]
+                print(f"⚠️  {len(undated)} mensagens sem timestamp rejeitadas (tabela messages particionada)")
+            else:
+                undated = []
+            
+            # Criar partições mensais do período antes de tocar a tabela messages (se particionada)
+            timestamps = [m['timestamp'] for m in unique_messages.values() if m.get('timestamp')]
+            if timestamps:
+                ensure_month_partitions(max(timestamps))
+            
             # Coletar todos os IPs únicos primeiro
             unique_ips = set()
             for message_data in unique_messages.values():
@@ -370,7 +387,9 @@ def insert_messages(operation_id, zip_path: str):
                             isp=None,
                             org=None,
                             as_name=None,
-                            mobile=None
+                            mobile=None,
+                            # IPs privados/reservados/inválidos já nascem com estado definitivo
+                            enrichment_status=classify_ip(ip) or ENRICHMENT_PENDING
                         ))
                 
                 if new_ips:
@@ -479,6 +498,14 @@ def insert_messages(operation_id, zip_path: str):
                     print(f"Erro ao inserir recipients: {str(e)}")
                     raise
 
+            # Atualizar o resumo de conversas do alvo com as mensagens novas deste arquivo
+            try:
+                summary = summarize_conversations(messages_to_process.values(), target.target)
+                apply_conversation_stats(session, file_record.file_id, summary)
+            except Exception as e:
+                print(f"Erro ao atualizar resumo de conversas: {str(e)}")
+                raise
+
             # Atualizar o status do arquivo se ainda estiver PENDING
             try:
                 if hasattr(file_record, 'process_status') and file_record.process_status == 'PENDING':
@@ -491,7 +518,10 @@ def insert_messages(operation_id, zip_path: str):
             try:
                 session.commit()
                 print("Commit realizado com sucesso")
-                return {'status': 'success', 'message': f'{len(messages_to_process)} mensagens processadas com sucesso'}
+                message = f'{len(messages_to_process)} mensagens processadas com sucesso'
+                if undated:
+                    message += f' ({len(undated)} sem timestamp rejeitadas)'
+                return {'status': 'success', 'message': message}
             except Exception as e:
                 print(f"Erro no commit final: {str(e)}")
                 raise
@@ -0,0 +1,59 @@
+"""
+Leitura em streaming (cursor do lado do servidor) para exportações e consultas grandes.
+
+Um .all() faz o PyMySQL trazer o resultado inteiro para a memória do cliente antes da primeira
+linha ser usada. Aqui a consulta é executada com stream_results=True, o que faz o dialeto
+mysql+pymysql usar um SSCursor (sem buffer): as linhas chegam do MySQL conforme são consumidas,
+em blocos de tamanho fixo (yield_per), e a memória depende apenas do tamanho do bloco.
+
+Enquanto o iterador não termina, a conexão fica ocupada com o resultado; por isso cada leitura
+usa uma conexão própria do pool, devolvida quando o iterador é esgotado ou fechado.
+
+Uso programático:
+    from db.streaming import stream_dataframes
+    for df in stream_dataframes(select(Message.message_id, Message.timestamp), chunk_size=50000):
+        ...
+"""
+from db.session import engine
+from db.frames import frame_from_columns
+
+
+# Linhas por bloco
+CHUNK_SIZE = 10000
+
+
+def _statement(query):
+    '''Aceita tanto um SELECT (Core/ORM 2.0) quanto uma Query legada (usa o SELECT por trás dela)'''
+    return query.statement if hasattr(query, 'statement') else query
+
+
+def stream_results(query, chunk_size=CHUNK_SIZE):
+    '''
+    Itera (colunas, linhas) em blocos de até chunk_size linhas, com cursor do lado do servidor.
+
+    As colunas são as mesmas em todos os blocos; as linhas são Row (acessíveis por nome ou posição).
+    '''
+    with engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True,
+            yield_per=chunk_size
+        ).execute(_statement(query))
+
+        columns = list(result.keys())
+        for rows in result.partitions(chunk_size):
+            yield columns, rows
+
+
+def stream_rows(query, chunk_size=CHUNK_SIZE):
+    '''Itera as linhas uma a uma (lidas do servidor em blocos de chunk_size)'''
+    for _, rows in stream_results(query, chunk_size):
+        yield from rows
+
+
+def stream_dataframes(query, chunk_size=CHUNK_SIZE, **options):
+    '''
+    Itera DataFrames de até chunk_size linhas, montados coluna a coluna (db.frames; opções de
+    frame_from_columns). Nenhum bloco é produzido se não houver linhas.
+    '''
+    for columns, rows in stream_results(query, chunk_size):
+        yield frame_from_columns(columns, rows, **options)
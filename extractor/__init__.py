@@ -1,12 +1,15 @@
-from .extractor import (
-    get_account_data_from_buffer,
-    get_account_data,
-    get_messages,
-    get_groups,
-    get_addressbook,
-    exportar_mensagens_para_excel,
-    get_contacts_and_groups
-)
+from importlib import import_module
+
+
+# As funções do extrator são importadas no primeiro acesso: importar um submódulo leve
+# (extractor.enrichment_metrics, extractor.exporter) não carrega o BeautifulSoup.
+def __getattr__(name):
+    if name not in __all__:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module('.extractor', __name__), name)
+    globals()[name] = value
+    return value
+
 
 __all__ = [
     'get_account_data_from_buffer',
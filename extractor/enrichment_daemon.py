@@ -0,0 +1,107 @@
+"""
+Serviço de enriquecimento de IPs em segundo plano.
+
+Fica em execução contínua consultando a tabela ips: a cada ciclo processa até ENRICHMENT_CYCLE_LIMIT
+IPs pendentes (ou com retry_after vencido) e, quando não há nada a fazer, dorme
+ENRICHMENT_POLL_SECONDS segundos. Ao fim de cada ciclo grava o snapshot das métricas
+(extractor.enrichment_metrics). A ingestão apenas grava os IPs como PENDING e retorna;
+este processo é o único consumidor da API, de modo que a cota do ip-api nunca é disputada.
+
+Uso:
+    python -m extractor.enrichment_daemon          # loop contínuo
+    python -m extractor.enrichment_daemon --once   # um único ciclo (cron / manutenção)
+"""
+import asyncio
+import os
+import signal
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractor.ip_api_client import AsyncIPEnricher
+from extractor.enrichment_metrics import metrics
+
+
+# Intervalo entre consultas quando não há IPs pendentes
+POLL_SECONDS = float(os.getenv('ENRICHMENT_POLL_SECONDS', '10'))
+
+# Máximo de IPs por ciclo: ciclos curtos fazem IPs recém-carregados entrarem logo na fila
+CYCLE_LIMIT = int(os.getenv('ENRICHMENT_CYCLE_LIMIT', '1000'))
+
+# Espera após erro inesperado (ex.: banco indisponível)
+ERROR_BACKOFF_SECONDS = 30
+
+
+class EnrichmentDaemon:
+    """Loop de enriquecimento com parada limpa em SIGINT/SIGTERM."""
+
+    def __init__(self, poll_seconds: float = POLL_SECONDS, cycle_limit: int = CYCLE_LIMIT):
+        self.poll_seconds = poll_seconds
+        self.cycle_limit = cycle_limit
+        self.enricher = AsyncIPEnricher()
+        self._stop = None
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    async def _sleep(self, seconds: float):
+        """Dorme até o próximo ciclo, acordando antes se o serviço for encerrado."""
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run_once(self) -> int:
+        """
+        Executa um ciclo e retorna quantos IPs foram lidos da fila.
+
+        Conta os IPs lidos, não apenas os enviados à API: um ciclo resolvido inteiro pela base
+        offline, pelo cache de prefixos ou pela classificação local também consome a fila.
+        """
+        try:
+            await asyncio.to_thread(self.enricher.count_pending)
+            self.enricher.last_fetched = 0
+            await self.enricher.aprocess_pending_ips(limit=self.cycle_limit)
+            metrics.inc('cycles')
+            await asyncio.to_thread(self.enricher.count_pending)
+            return self.enricher.last_fetched
+        finally:
+            # Snapshot para a página "Enriquecimento de IPs"
+            try:
+                metrics.write_snapshot()
+            except OSError as e:
+                print(f"Não foi possível gravar as métricas: {e}")
+
+    async def run(self):
+        self._stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        print(f"🌐 Serviço de enriquecimento iniciado (ciclo de {self.cycle_limit} IPs, espera de {self.poll_seconds}s)")
+
+        while not self._stop.is_set():
+            try:
+                fetched = await self.run_once()
+            except Exception as e:
+                print(f"❌ Erro no ciclo de enriquecimento: {e}")
+                await self._sleep(ERROR_BACKOFF_SECONDS)
+                continue
+
+            # Ciclo cheio: ainda há fila, segue sem esperar
+            if fetched < self.cycle_limit:
+                await self._sleep(self.poll_seconds)
+
+        print("🛑 Serviço de enriquecimento encerrado")
+
+
+if __name__ == '__main__':
+    daemon = EnrichmentDaemon()
+    if '--once' in sys.argv[1:]:
+        asyncio.run(daemon.run_once())
+    else:
+        asyncio.run(daemon.run())
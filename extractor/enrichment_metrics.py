@@ -0,0 +1,180 @@
+"""
+Métricas do enriquecimento de IPs (contadores, medidores e histogramas em memória).
+
+O IPEnricher registra aqui cada consulta à API, cada evento de limitação de taxa e cada acerto
+da base offline e do cache por prefixo. O serviço extractor.enrichment_daemon grava um snapshot
+em JSON (ENRICHMENT_METRICS_PATH, padrão data/enrichment_metrics.json) ao fim de cada ciclo,
+lido pela página de administração "Enriquecimento de IPs".
+
+Uso programático:
+    from extractor.enrichment_metrics import metrics
+    metrics.snapshot()
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from pathlib import Path
+from typing import Dict, Optional
+
+
+PROJECT_ROOT = Path(__file__).absolute().parent.parent
+
+SNAPSHOT_PATH = os.getenv('ENRICHMENT_METRICS_PATH') or str(PROJECT_ROOT / 'data' / 'enrichment_metrics.json')
+
+# Janela (segundos) usada no cálculo de IPs enriquecidos por segundo
+THROUGHPUT_WINDOW = 60
+
+# Limites dos buckets de latência da API (segundos)
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+
+
+class Histogram:
+    """Histograma de buckets fixos com contagem, soma, mínimo e máximo."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimativa do quantil pelo limite superior do bucket (o último bucket usa o máximo)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict:
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': {
+                **{f"<={bucket}": count for bucket, count in zip(self.buckets, self.counts)},
+                f">{self.buckets[-1]}": self.counts[-1]
+            }
+        }
+
+
+class EnrichmentMetrics:
+    """Registro das métricas de um processo de enriquecimento (seguro entre threads)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.counters = {
+                'api_requests': 0,
+                'api_errors': 0,
+                'api_ips_sent': 0,
+                'ips_enriched': 0,
+                'ips_failed': 0,
+                'ips_final': 0,
+                'throttle_429': 0,
+                'throttle_waits': 0,
+                'offline_hits': 0,
+                'offline_misses': 0,
+                'prefix_hits': 0,
+                'prefix_misses': 0,
+                'prefix_inherited': 0,
+                'cycles': 0,
+            }
+            self.gauges = {
+                'pending_backlog': None,
+                'quota_remaining': None,
+                'quota_reset_seconds': None,
+            }
+            self.histograms = {
+                'api_latency_seconds': Histogram(),
+                'throttle_wait_seconds': Histogram(),
+            }
+            self._enriched_events = deque()
+
+    def inc(self, name: str, value: int = 1):
+        if not value:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            if name == 'ips_enriched':
+                self._enriched_events.append((time.time(), value))
+
+    def set_gauge(self, name: str, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    def lookups_per_second(self) -> float:
+        """IPs enriquecidos por segundo na última janela de THROUGHPUT_WINDOW segundos."""
+        now = time.time()
+        with self._lock:
+            while self._enriched_events and self._enriched_events[0][0] < now - THROUGHPUT_WINDOW:
+                self._enriched_events.popleft()
+            total = sum(count for _, count in self._enriched_events)
+        window = min(THROUGHPUT_WINDOW, max(now - self.started_at, 1))
+        return total / window
+
+    @staticmethod
+    def _rate(hits: int, misses: int) -> Optional[float]:
+        return hits / (hits + misses) if hits + misses else None
+
+    def snapshot(self) -> Dict:
+        lookups_per_second = self.lookups_per_second()
+        with self._lock:
+            counters = dict(self.counters)
+            return {
+                'updated_at': time.time(),
+                'started_at': self.started_at,
+                'uptime_seconds': time.time() - self.started_at,
+                'lookups_per_second': lookups_per_second,
+                'offline_hit_rate': self._rate(counters['offline_hits'], counters['offline_misses']),
+                'prefix_hit_rate': self._rate(counters['prefix_hits'], counters['prefix_misses']),
+                'counters': counters,
+                'gauges': dict(self.gauges),
+                'histograms': {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+            }
+
+    def write_snapshot(self, path: str = SNAPSHOT_PATH):
+        """Grava o snapshot em JSON (escrita atômica: arquivo temporário + rename)."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(path.suffix + '.tmp')
+        temp_path.write_text(json.dumps(self.snapshot(), indent=2))
+        os.replace(temp_path, path)
+
+
+def read_snapshot(path: str = SNAPSHOT_PATH) -> Optional[Dict]:
+    """Lê o último snapshot gravado pelo serviço de enriquecimento (None se não existir)."""
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+# Instância única por processo
+metrics = EnrichmentMetrics()
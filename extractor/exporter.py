@@ -0,0 +1,161 @@
+"""
+Exportação em streaming (memória constante) para XLSX, CSV e Parquet.
+
+A origem é qualquer iterável de linhas (dicionários, como os do extrator) ou de DataFrames
+(como os blocos de db.streaming.stream_dataframes, lidos do banco com cursor do lado do
+servidor). Os dados são gravados bloco a bloco, sem montar o resultado inteiro:
+
+    - XLSX: openpyxl em modo write-only (as linhas vão direto para o arquivo); ao atingir o
+      limite de 1.048.576 linhas do Excel, a exportação continua em uma nova planilha;
+    - CSV: cabeçalho no primeiro bloco, demais blocos acrescentados ao arquivo;
+    - Parquet: um row group por bloco (pyarrow.parquet.ParquetWriter).
+
+Uso programático:
+    from extractor.exporter import export_rows
+    export_rows(stream_dataframes(query), 'saida.xlsx', 'xlsx')
+"""
+from itertools import islice
+
+import pandas as pd
+
+
+# Limite de linhas por planilha do Excel (inclui o cabeçalho)
+EXCEL_MAX_ROWS = 1048576
+
+# Linhas por bloco quando a origem é um iterável de dicionários
+EXPORT_CHUNK_SIZE = 10000
+
+EXPORT_FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def iter_chunks(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Normaliza a origem em DataFrames sem adiantar a leitura.
+
+    O primeiro item decide o tipo da origem: blocos de DataFrame passam direto, um por vez (cada
+    bloco do cursor só é lido quando o anterior já foi gravado); dicionários são agrupados em
+    blocos de chunk_size linhas.
+    """
+    iterator = iter(rows)
+    first = next(iterator, None)
+    if first is None:
+        return
+
+    if isinstance(first, pd.DataFrame):
+        yield first
+        yield from iterator
+        return
+
+    block = [first, *islice(iterator, chunk_size - 1)]
+    while block:
+        yield pd.DataFrame(block)
+        block = list(islice(iterator, chunk_size))
+
+
+def _plain(df):
+    """Valores exportáveis: listas viram texto separado por vírgula e categorias viram seus valores."""
+    df = df.copy()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+        elif df[column].dtype == object:
+            df[column] = df[column].map(lambda value: ', '.join(map(str, value)) if isinstance(value, (list, tuple)) else value)
+    return df
+
+
+def write_xlsx(chunks, target, sheet_name='Dados', max_rows=EXCEL_MAX_ROWS):
+    """Grava os blocos em XLSX (write-only), abrindo uma nova planilha a cada max_rows linhas."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = None
+    sheet_rows = 0
+    sheet_count = 0
+    header = None
+    total = 0
+
+    for df in chunks:
+        df = _plain(df)
+        if header is None:
+            header = [str(column) for column in df.columns]
+
+        values = df.astype(object).where(df.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            if sheet is None or sheet_rows >= max_rows:
+                sheet_count += 1
+                sheet = workbook.create_sheet(sheet_name if sheet_count == 1 else f"{sheet_name} ({sheet_count})")
+                sheet.append(header)
+                sheet_rows = 1
+            sheet.append(row)
+            sheet_rows += 1
+            total += 1
+
+    # Resultado vazio: planilha apenas com o cabeçalho (ou em branco)
+    if sheet is None:
+        sheet = workbook.create_sheet(sheet_name)
+        if header:
+            sheet.append(header)
+
+    workbook.save(target)
+    return total
+
+
+def write_csv(chunks, target, sep=',', encoding='utf-8-sig'):
+    """Grava os blocos em CSV (cabeçalho apenas no primeiro bloco)."""
+    total = 0
+    with open(target, 'w', newline='', encoding=encoding) as handle:
+        for index, df in enumerate(chunks):
+            _plain(df).to_csv(handle, sep=sep, index=False, header=index == 0)
+            total += len(df)
+    return total
+
+
+def write_parquet(chunks, target):
+    """Grava os blocos em Parquet, um row group por bloco, com o esquema do primeiro bloco."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    schema = None
+    total = 0
+    try:
+        for df in chunks:
+            table = pa.Table.from_pandas(_plain(df), preserve_index=False)
+            if writer is None:
+                # Colunas sem nenhum valor no primeiro bloco são gravadas como texto
+                schema = pa.schema([
+                    field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                    for field in table.schema
+                ]).remove_metadata()
+                writer = pq.ParquetWriter(target, schema)
+            writer.write_table(table.cast(schema))
+            total += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        pq.write_table(pa.table({}), target)
+    return total
+
+
+WRITERS = {
+    'xlsx': write_xlsx,
+    'csv': write_csv,
+    'parquet': write_parquet,
+}
+
+
+def export_rows(rows, target, fmt='xlsx', chunk_size=EXPORT_CHUNK_SIZE, **options):
+    """
+    Exporta a origem (dicionários ou DataFrames) para target no formato fmt (xlsx, csv, parquet).
+
+    Retorna a quantidade de linhas gravadas.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"Formato de exportação desconhecido: {fmt}")
+    return WRITERS[fmt](iter_chunks(rows, chunk_size), target, **options)
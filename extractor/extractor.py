@@ -4,7 +4,6 @@ import re
 import os
 import tempfile
 from bs4 import BeautifulSoup
-import pandas as pd
 from datetime import datetime
 import sys
 
@@ -402,34 +401,33 @@ def get_addressbook(zip_path: str) -> Dict[str, List[str]]:
 def exportar_mensagens_para_excel(lista_mensagens, caminho_arquivo="mensagens.xlsx"):
     """
 
-    Exporta uma lista de mensagens para um arquivo Excel.
+    Exporta mensagens para um arquivo Excel (ou CSV/Parquet, conforme a extensão do arquivo).
 
-    Esta função recebe uma lista de mensagens, converte em um DataFrame do pandas,
-    normaliza o campo 'Recipients' (caso exista, transformando listas em strings separadas por vírgula)
-    e exporta o resultado para um arquivo Excel no caminho especificado.
+    As mensagens são gravadas em blocos pelo extractor.exporter, sem montar um DataFrame com todas
+    elas: o Excel é escrito em modo write-only e, ao atingir o limite de 1.048.576 linhas, a
+    exportação continua em uma nova planilha. O campo 'recipients' (listas) é gravado como texto
+    separado por vírgula.
 
     Parâmetros:
-        lista_mensagens (list): Lista de dicionários contendo os dados das mensagens.
-        caminho_arquivo (str, opcional): Caminho do arquivo Excel a ser gerado. Padrão é 'mensagens.xlsx'.
+        lista_mensagens (iterable): Lista (ou qualquer iterável) de dicionários com os dados das mensagens.
+        caminho_arquivo (str, opcional): Caminho do arquivo a ser gerado. Padrão é 'mensagens.xlsx'.
 
     Retorna:
-        None
+        int: Quantidade de mensagens exportadas.
 
     Exemplo:
         exportar_mensagens_para_excel(mensagens, "saida.xlsx")
 
     """
+    from extractor.exporter import export_rows
 
-    # Converter em DataFrame
-    df = pd.DataFrame(lista_mensagens)
+    formato = os.path.splitext(caminho_arquivo)[1].lstrip('.').lower() or 'xlsx'
+    if formato not in ('xlsx', 'csv', 'parquet'):
+        formato = 'xlsx'
 
-    # Normalizar lista de recipients (transformar lista em string separada por vírgula)
-    if 'Recipients' in df.columns:
-        df['Recipients'] = df['Recipients'].apply(lambda x: ', '.join(x) if isinstance(x, list) else x)
-
-    # Exportar para Excel
-    df.to_excel(caminho_arquivo, index=False)
-    print(f"Arquivo Excel exportado para: {caminho_arquivo}")
+    total = export_rows(lista_mensagens, caminho_arquivo, formato)
+    print(f"Arquivo exportado para: {caminho_arquivo} ({total} mensagens)")
+    return total
 
 
 def get_contacts_and_groups(zip_path: str) -> Dict[str, any]:
@@ -1,33 +1,454 @@
 import httpx
+import asyncio
 import time
 import sys
 import os
-from typing import List, Dict
+import csv
+import ipaddress
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_right
+from typing import List, Dict, Optional, Tuple
+from tenacity import AsyncRetrying, stop_after_attempt, wait_exponential, retry_if_exception
 
 # Adicionar o diretório pai ao path (mesmo padrão do extractor.py)
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Agora as importações funcionarão
 from db.session import get_session
-from db.models import IP
+from db.models import IP, IPPrefixCache
+from db.operation_metrics import bump_versions_for_ips
+from db.geo import point_wkt, geo_point_param, haversine_km
+from db.enrichment_state import (
+    ENRICHMENT_PENDING, ENRICHMENT_DONE, ENRICHMENT_FAILED, ENRICHMENT_PRIVATE, ENRICHMENT_RESERVED,
+    ENRICHMENT_INVALID, RETRYABLE_STATUSES, classify_ip
+)
+from extractor.enrichment_metrics import metrics
+from sqlalchemy import update, bindparam, func, or_, literal_column
+from sqlalchemy.dialects.mysql import insert
+from datetime import datetime, timedelta
+from statistics import median
+
+# Backoff das falhas: RETRY_BASE_SECONDS * 2^tentativas, limitado a RETRY_MAX_SECONDS
+RETRY_BASE_SECONDS = 15 * 60
+RETRY_MAX_SECONDS = 30 * 24 * 3600
+
+# Mensagens de falha do ip-api que são definitivas
+API_TERMINAL_FAILURES = {
+    'private range': ENRICHMENT_PRIVATE,
+    'reserved range': ENRICHMENT_RESERVED,
+    'invalid query': ENRICHMENT_INVALID,
+}
+
+# Coluna da tabela ips -> campo do resultado do ip-api
+IP_RESULT_FIELDS = {
+    'continent': 'continent',
+    'country': 'country',
+    'country_code': 'countryCode',
+    'region': 'region',
+    'region_name': 'regionName',
+    'city': 'city',
+    'district': 'district',
+    'zipcode_ip': 'zip',
+    'latitude': 'lat',
+    'longitude': 'lon',
+    'timezone_ip': 'timezone',
+    'isp': 'isp',
+    'org': 'org',
+    'as_name': 'asname',
+    'mobile': 'mobile',
+}
+
+# Campos do resultado (formato ip-api) preenchidos pelos provedores offline
+GEO_FIELDS = ('continent', 'country', 'countryCode', 'regionName', 'city', 'zip', 'lat', 'lon', 'timezone', 'isp', 'org')
+
+# Código de continente (DB-IP) -> nome usado pelo ip-api
+CONTINENT_NAMES = {
+    'AF': 'Africa',
+    'AN': 'Antarctica',
+    'AS': 'Asia',
+    'EU': 'Europe',
+    'NA': 'North America',
+    'OC': 'Oceania',
+    'SA': 'South America',
+}
+
+
+class GeoIPProvider(ABC):
+    """
+    Interface dos provedores de geolocalização.
+
+    lookup recebe uma lista de IPs e devolve {ip: resultado} apenas para os IPs encontrados,
+    com o resultado no mesmo formato da resposta do ip-api (status, query, country, lat, lon...).
+    """
+
+    name = 'base'
+
+    @abstractmethod
+    def lookup(self, ip_list: List[str]) -> Dict[str, Dict]:
+        ...
+
+
+class RangeIndex:
+    """
+    Índice de intervalos de IP ordenado, baseado em arrays, com busca por bisect.
+
+    Cada família (IPv4/IPv6) guarda três vetores paralelos: início, fim e índice do registro.
+    Registros de localização idênticos são armazenados uma única vez.
+    """
+
+    def __init__(self):
+        self._rows = {4: [], 6: []}
+        self._record_ids = {}
+        self.records: List[Tuple] = []
+        self.starts = {4: array('Q'), 6: []}
+        self.ends = {4: array('Q'), 6: []}
+        self.record_index = {4: array('I'), 6: array('I')}
+
+    def add(self, start_ip: str, end_ip: str, record: Tuple):
+        start = ipaddress.ip_address(start_ip)
+        end = ipaddress.ip_address(end_ip)
+        record_id = self._record_ids.get(record)
+        if record_id is None:
+            record_id = self._record_ids[record] = len(self.records)
+            self.records.append(record)
+        self._rows[start.version].append((int(start), int(end), record_id))
+
+    def build(self):
+        """Ordena os intervalos e monta os vetores de busca."""
+        for version, rows in self._rows.items():
+            rows.sort()
+            for start, end, record_id in rows:
+                self.starts[version].append(start)
+                self.ends[version].append(end)
+                self.record_index[version].append(record_id)
+        self._rows = {4: [], 6: []}
+        self._record_ids = {}
+        return self
+
+    def find(self, ip: str) -> Optional[Tuple]:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+
+        value = int(address)
+        starts = self.starts[address.version]
+        i = bisect_right(starts, value) - 1
+        if i >= 0 and value <= self.ends[address.version][i]:
+            return self.records[self.record_index[address.version][i]]
+        return None
+
+    def __len__(self):
+        return len(self.starts[4]) + len(self.starts[6])
+
+
+class OfflineGeoIPProvider(GeoIPProvider):
+    """
+    Provedor offline: carrega uma base local de faixas de IP (CSV ou MMDB) em um RangeIndex.
+
+    CSV aceitos:
+        - DB-IP Lite City, sem cabeçalho: ip_start, ip_end, continent, country, stateprov, city, latitude, longitude
+          (continente e país vêm como códigos: o continente é convertido para o nome usado pelo ip-api e o
+          código ISO do país vai apenas para countryCode, com country vazio, para não misturar "BR" e "Brazil")
+        - CSV com cabeçalho contendo ip_start/start_ip e ip_end/end_ip, além de colunas com os nomes de GEO_FIELDS
+    MMDB (ex.: GeoLite2-City) requer o pacote opcional `maxminddb`.
+    """
+
+    name = 'offline'
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index = RangeIndex()
+
+        if path.lower().endswith('.mmdb'):
+            self._load_mmdb(path)
+        else:
+            self._load_csv(path)
+
+        self.index.build()
+        print(f"Base GeoIP offline carregada: {len(self.index)} faixas ({path})")
+
+    def _load_csv(self, path: str):
+        with open(path, newline='', encoding='utf-8') as f:
+            first_line = f.readline()
+            f.seek(0)
+            first_field = first_line.split(',')[0].strip().strip('"')
+
+            try:
+                ipaddress.ip_address(first_field)
+                has_header = False
+            except ValueError:
+                has_header = True
+
+            if not has_header:
+                # DB-IP Lite City
+                for row in csv.reader(f):
+                    if len(row) < 8:
+                        continue
+                    continent = CONTINENT_NAMES.get(row[2].strip().upper())
+                    country_code = row[3].strip().upper() or None
+                    record = (continent, None, country_code, row[4] or None, row[5] or None, None,
+                              float(row[6]), float(row[7]), None, None, None)
+                    self.index.add(row[0], row[1], record)
+                return
+
+            for row in csv.DictReader(f):
+                start_ip = row.get('ip_start') or row.get('start_ip')
+                end_ip = row.get('ip_end') or row.get('end_ip')
+                if not start_ip or not end_ip:
+                    continue
+                record = tuple(
+                    float(row[field]) if field in ('lat', 'lon') and row.get(field) else (row.get(field) or None)
+                    for field in GEO_FIELDS
+                )
+                self.index.add(start_ip, end_ip, record)
+
+    def _load_mmdb(self, path: str):
+        try:
+            import maxminddb
+        except ImportError:
+            raise RuntimeError("Para bases .mmdb instale o pacote opcional 'maxminddb'")
+
+        def name(node):
+            return (node or {}).get('names', {}).get('en')
+
+        with maxminddb.open_database(path) as reader:
+            for network, data in reader:
+                location = data.get('location', {})
+                if location.get('latitude') is None:
+                    continue
+                subdivisions = data.get('subdivisions') or [{}]
+                record = (
+                    name(data.get('continent')),
+                    name(data.get('country')),
+                    data.get('country', {}).get('iso_code'),
+                    name(subdivisions[0]),
+                    name(data.get('city')),
+                    data.get('postal', {}).get('code'),
+                    location.get('latitude'),
+                    location.get('longitude'),
+                    location.get('time_zone'),
+                    None,
+                    None
+                )
+                self.index.add(str(network.network_address), str(network.broadcast_address), record)
+
+    def lookup(self, ip_list: List[str]) -> Dict[str, Dict]:
+        results = {}
+        find = self.index.find
+        for ip in ip_list:
+            record = find(ip)
+            if record is not None:
+                result = dict(zip(GEO_FIELDS, record))
+                result['status'] = 'success'
+                result['query'] = ip
+                results[ip] = result
+        return results
+
+
+_offline_provider = None
+
+
+def get_offline_provider() -> Optional[OfflineGeoIPProvider]:
+    """Provedor offline configurado em GEOIP_DB_PATH (carregado uma única vez por processo)."""
+    global _offline_provider
+
+    path = os.getenv("GEOIP_DB_PATH")
+    if not path:
+        return None
+
+    if _offline_provider is None or _offline_provider.path != path:
+        if not os.path.exists(path):
+            print(f"Base GeoIP offline não encontrada: {path}")
+            return None
+        _offline_provider = OfflineGeoIPProvider(path)
+
+    return _offline_provider
+
+
+class PrefixCache:
+    """
+    Cache de geolocalização por prefixo de rede (tabela ip_prefix_cache).
+
+    IPs de operadoras móveis giram por milhares de endereços do mesmo bloco, todos com a mesma
+    localização. Com o cache ativo, apenas um IP representante de cada prefixo vai à API e o
+    resultado é aplicado aos demais endereços do bloco. Entradas mais antigas que max_age_days
+    são ignoradas (e substituídas na próxima consulta do prefixo).
+    """
+
+    def __init__(self, v4_prefix: int = 24, v6_prefix: int = 48, max_age_days: float = 30):
+        self.v4_prefix = v4_prefix
+        self.v6_prefix = v6_prefix
+        self.max_age = timedelta(days=max_age_days)
+
+    def prefix_of(self, ip: str) -> Optional[str]:
+        try:
+            address = ipaddress.ip_address(str(ip).strip())
+        except ValueError:
+            return None
+        length = self.v4_prefix if address.version == 4 else self.v6_prefix
+        return str(ipaddress.ip_network(f"{address}/{length}", strict=False))
+
+    def lookup(self, ip_list: List[str]) -> Dict[str, Dict]:
+        """Retorna {ip: resultado} para os IPs cujo prefixo tem entrada válida no cache."""
+        prefixes = {}
+        for ip in ip_list:
+            prefix = self.prefix_of(ip)
+            if prefix:
+                prefixes.setdefault(prefix, []).append(ip)
+        if not prefixes:
+            return {}
+
+        with get_session() as session:
+            entries = session.query(IPPrefixCache.prefix, IPPrefixCache.result).filter(
+                IPPrefixCache.prefix.in_(list(prefixes)),
+                IPPrefixCache.cached_at >= datetime.now() - self.max_age
+            ).all()
+
+        results = {}
+        for prefix, result in entries:
+            for ip in prefixes[prefix]:
+                results[ip] = {**result, 'query': ip}
+        return results
+
+    def store(self, results: List[Dict]):
+        """Grava (ou renova) o prefixo de cada resultado bem-sucedido."""
+        rows = {}
+        now = datetime.now()
+        for result in results:
+            if result.get('status') != 'success':
+                continue
+            prefix = self.prefix_of(result.get('query'))
+            if prefix:
+                rows[prefix] = {'prefix': prefix, 'representative_ip': result['query'], 'result': result, 'cached_at': now}
+        if not rows:
+            return
+
+        stmt = insert(IPPrefixCache.__table__)
+        stmt = stmt.on_duplicate_key_update(
+            representative_ip=stmt.inserted.representative_ip,
+            result=stmt.inserted.result,
+            cached_at=stmt.inserted.cached_at
+        )
+        with get_session() as session:
+            session.execute(stmt, list(rows.values()))
+            session.commit()
+
+
+def get_prefix_cache() -> Optional[PrefixCache]:
+    """Cache por prefixo, ativado por GEOIP_PREFIX_CACHE=1 (tamanhos e validade configuráveis)."""
+    if os.getenv("GEOIP_PREFIX_CACHE", "").lower() not in ("1", "true", "yes", "on"):
+        return None
+
+    return PrefixCache(
+        v4_prefix=int(os.getenv("GEOIP_PREFIX_V4", "24")),
+        v6_prefix=int(os.getenv("GEOIP_PREFIX_V6", "48")),
+        max_age_days=float(os.getenv("GEOIP_PREFIX_MAX_AGE_DAYS", "30"))
+    )
+
 
 class IPEnricher:
     """Classe para enriquecer IPs."""
     
-    def __init__(self):
+    def __init__(self, offline_provider: Optional[GeoIPProvider] = None, prefix_cache: Optional[PrefixCache] = None):
         self.api_url = "http://ip-api.com/batch"
         self.fields = "status,message,continent,country,countryCode,region,regionName,city,district,zip,lat,lon,timezone,isp,org,asname,mobile,query"
         self.batch_size = 100
         self.delay_between_requests = 4  # 4 segundos entre requests (15/min)
+        self.offline_provider = offline_provider or get_offline_provider()
+        self.prefix_cache = prefix_cache or get_prefix_cache()
+        # IP representante -> demais IPs do mesmo prefixo no ciclo atual
+        self.prefix_siblings: Dict[str, List[str]] = {}
+        # IPs geolocalizados desde a última publicação (ver publish_changes)
+        self.changed_ips: List[str] = []
+        # IPs lidos da fila na última chamada a get_pending_ips (antes das resoluções locais)
+        self.last_fetched = 0
     
-    def get_pending_ips(self) -> List[str]:
-        """Busca TODOS os IPs que ainda não foram enriquecidos."""
+    def get_pending_ips(self, limit: Optional[int] = None) -> List[str]:
+        """
+        Busca os IPs a enriquecer: pendentes ou com falha cujo retry_after já venceu.
+
+        A ordem segue a fila de prioridade (db.enrichment_queue): pedidos explícitos, depois a
+        operação aberta/carregada mais recentemente e, dentro dela, os IPs com mais mensagens.
+        IPs privados/reservados/inválidos são classificados localmente aqui e nunca retornados.
+        """
         with get_session() as session:
-            pending_ips = session.query(IP.sender_ip).filter(
-                IP.country.is_(None)  # IPs sem dados geográficos
-            ).all()  # REMOVER o .limit(100) para pegar todos
+            query = session.query(IP.sender_ip).filter(
+                IP.enrichment_status.in_(RETRYABLE_STATUSES),
+                or_(IP.retry_after.is_(None), IP.retry_after <= func.now())
+            ).order_by(
+                IP.priority_tier.desc(),
+                IP.priority_at.desc(),
+                IP.priority_weight.desc()
+            )
+            if limit:
+                query = query.limit(limit)
+            pending_ips = query.all()
+            self.last_fetched = len(pending_ips)
             
-            return [ip[0] for ip in pending_ips]
+            return self.short_circuit_local([ip[0] for ip in pending_ips])
+    
+    def count_pending(self) -> int:
+        """Tamanho da fila: IPs pendentes ou com falha aguardando nova tentativa (None se o banco falhar)."""
+        total = None
+        with get_session() as session:
+            total = session.query(func.count(IP.sender_ip)).filter(
+                IP.enrichment_status.in_(RETRYABLE_STATUSES)
+            ).scalar() or 0
+        metrics.set_gauge('pending_backlog', total)
+        return total
+
+    def short_circuit_local(self, ip_list: List[str]) -> List[str]:
+        """Grava o estado definitivo dos IPs não públicos e retorna apenas os públicos."""
+        public_ips = []
+        local_rows = []
+
+        for ip in ip_list:
+            status = classify_ip(ip)
+            if status is None:
+                public_ips.append(ip)
+            else:
+                local_rows.append({'b_sender_ip': ip, 'b_status': status})
+
+        if local_rows:
+            self.set_final_status(local_rows)
+            metrics.inc('ips_final', len(local_rows))
+            print(f"{len(local_rows)} IPs classificados localmente (privados/reservados/inválidos)")
+
+        return public_ips
+
+    def set_final_status(self, rows: List[Dict]):
+        """Grava um estado definitivo (sem novas tentativas) para cada {'b_sender_ip', 'b_status'}."""
+        table = IP.__table__
+        stmt = update(table).where(table.c.sender_ip == bindparam('b_sender_ip')).values(
+            enrichment_status=bindparam('b_status'),
+            enriched_at=func.now(),
+            retry_after=None
+        )
+        with get_session() as session:
+            session.execute(stmt, rows)
+            session.commit()
+
+    def mark_failed(self, ip_list: List[str]):
+        """Registra falha temporária: incrementa attempts e agenda nova tentativa com backoff exponencial."""
+        if not ip_list:
+            return
+
+        table = IP.__table__
+        # retry_after antes de attempts: o MySQL avalia o SET da esquerda para a direita
+        stmt = update(table).where(table.c.sender_ip.in_(ip_list)).ordered_values(
+            (table.c.retry_after, literal_column(
+                f"NOW() + INTERVAL LEAST({RETRY_MAX_SECONDS}, {RETRY_BASE_SECONDS} * POW(2, attempts)) SECOND"
+            )),
+            (table.c.attempts, table.c.attempts + 1),
+            (table.c.enrichment_status, ENRICHMENT_FAILED)
+        )
+        with get_session() as session:
+            session.execute(stmt)
+            session.commit()
+        metrics.inc('ips_failed', len(ip_list))
+        print(f"{len(ip_list)} IPs com falha reagendados")
     
     def query_ip_api(self, ip_list: List[str]) -> List[Dict]:
         """Consulta a API para lista de IPs."""
@@ -37,6 +458,9 @@ class IPEnricher:
         payload = ip_list
         params = {"fields": self.fields}
         
+        metrics.inc('api_requests')
+        metrics.inc('api_ips_sent', len(ip_list))
+        started = time.perf_counter()
         try:
             with httpx.Client(timeout=30) as client:
                 response = client.post(
@@ -44,48 +468,157 @@ class IPEnricher:
                     json=payload,
                     params=params
                 )
+                metrics.observe('api_latency_seconds', time.perf_counter() - started)
+                record_quota(response.headers)
+                if response.status_code == 429:
+                    metrics.inc('throttle_429')
                 response.raise_for_status()
                 return response.json()
                 
         except Exception as e:
+            metrics.inc('api_errors')
             print(f"Erro na consulta IP: {e}")
             return []
     
     def update_ip_data(self, ip_results: List[Dict]):
-        """Atualiza dados dos IPs no banco."""
+        """
+        Atualiza dados dos IPs no banco em lote.
+
+        Cada batch vira um único executemany de UPDATE ... WHERE sender_ip = ?, sem SELECT
+        prévio nem carregamento de objetos ORM.
+        """
+        rows_with_point = []
+        rows_without_point = []
+        final_rows = []
+        failed_ips = []
+
+        for result in ip_results:
+            if result.get('status') != 'success':
+                if not result.get('query'):
+                    continue
+                final_status = API_TERMINAL_FAILURES.get(result.get('message'))
+                if final_status:
+                    final_rows.append({'b_sender_ip': result['query'], 'b_status': final_status})
+                else:
+                    failed_ips.append(result['query'])
+                continue
+
+            row = {'b_sender_ip': result['query']}
+            for column, field in IP_RESULT_FIELDS.items():
+                row[f'b_{column}'] = result.get(field)
+
+            # Manter o POINT espacial sincronizado com latitude/longitude
+            if result.get('lat') is not None and result.get('lon') is not None:
+                row['b_wkt'] = point_wkt(result['lat'], result['lon'])
+                rows_with_point.append(row)
+            else:
+                rows_without_point.append(row)
+
+        if final_rows:
+            self.set_final_status(final_rows)
+            metrics.inc('ips_final', len(final_rows))
+        if failed_ips:
+            self.mark_failed(failed_ips)
+
+        if not rows_with_point and not rows_without_point:
+            return
+
+        table = IP.__table__
+        values = {column: bindparam(f'b_{column}') for column in IP_RESULT_FIELDS}
+        values.update(enrichment_status=ENRICHMENT_DONE, enriched_at=func.now(), retry_after=None)
+        stmt = update(table).where(table.c.sender_ip == bindparam('b_sender_ip'))
+
         with get_session() as session:
-            for result in ip_results:
-                if result.get('status') == 'success':
-                    ip_record = session.query(IP).filter_by(
-                        sender_ip=result['query']
-                    ).first()
-                    
-                    if ip_record:
-                        # Atualizar com dados da API
-                        ip_record.continent = result.get('continent')
-                        ip_record.country = result.get('country')
-                        ip_record.country_code = result.get('countryCode')
-                        ip_record.region = result.get('region')
-                        ip_record.region_name = result.get('regionName')
-                        ip_record.city = result.get('city')
-                        ip_record.district = result.get('district')
-                        ip_record.zipcode_ip = result.get('zip')
-                        ip_record.latitude = result.get('lat')
-                        ip_record.longitude = result.get('lon')
-                        ip_record.timezone_ip = result.get('timezone')
-                        ip_record.isp = result.get('isp')
-                        ip_record.org = result.get('org')
-                        ip_record.as_name = result.get('asname')
-                        ip_record.mobile = result.get('mobile')
-            
+            if rows_with_point:
+                session.execute(
+                    stmt.values(**values, geo_point=geo_point_param('b_wkt')),
+                    rows_with_point
+                )
+            if rows_without_point:
+                session.execute(stmt.values(**values), rows_without_point)
+
             session.commit()
-            print(f"{len(ip_results)} IPs atualizados")
+            print(f"{len(rows_with_point) + len(rows_without_point)} IPs atualizados")
+
+        metrics.inc('ips_enriched', len(rows_with_point) + len(rows_without_point))
+        self.changed_ips.extend(row['b_sender_ip'] for row in rows_with_point + rows_without_point)
+
+    def publish_changes(self):
+        """Incrementa a versão dos dados das operações cujos IPs foram geolocalizados (invalida o cache das páginas)."""
+        changed_ips, self.changed_ips = self.changed_ips, []
+        if changed_ips:
+            bump_versions_for_ips(changed_ips)
     
+    def resolve_offline(self, ip_list: List[str]) -> List[str]:
+        """Resolve o que for possível pela base offline e retorna os IPs não encontrados."""
+        if not self.offline_provider or not ip_list:
+            return ip_list
+
+        found = self.offline_provider.lookup(ip_list)
+        metrics.inc('offline_hits', len(found))
+        metrics.inc('offline_misses', len(ip_list) - len(found))
+        if found:
+            self.update_ip_data(list(found.values()))
+            print(f"{len(found)}/{len(ip_list)} IPs resolvidos pela base offline")
+
+        return [ip for ip in ip_list if ip not in found]
+
+    def resolve_prefixes(self, ip_list: List[str]) -> List[str]:
+        """
+        Aplica o cache por prefixo e retorna apenas um IP representante por prefixo sem cache.
+
+        Os demais IPs de cada prefixo recebem o resultado do representante em expand_prefix_results.
+        """
+        self.prefix_siblings = {}
+        if not self.prefix_cache or not ip_list:
+            return ip_list
+
+        found = self.prefix_cache.lookup(ip_list)
+        metrics.inc('prefix_hits', len(found))
+        metrics.inc('prefix_misses', len(ip_list) - len(found))
+        if found:
+            self.update_ip_data(list(found.values()))
+            print(f"{len(found)}/{len(ip_list)} IPs resolvidos pelo cache de prefixos")
+
+        representatives = {}
+        for ip in ip_list:
+            if ip in found:
+                continue
+            prefix = self.prefix_cache.prefix_of(ip)
+            if prefix in representatives:
+                self.prefix_siblings[representatives[prefix]].append(ip)
+            else:
+                representatives[prefix] = ip
+                self.prefix_siblings[ip] = []
+
+        return list(representatives.values())
+
+    def expand_prefix_results(self, ip_results: List[Dict]) -> List[Dict]:
+        """Grava os resultados no cache de prefixos e os replica para os IPs irmãos."""
+        if not self.prefix_cache or not ip_results:
+            return ip_results
+
+        self.prefix_cache.store(ip_results)
+
+        expanded = list(ip_results)
+        for result in ip_results:
+            if result.get('status') != 'success':
+                continue
+            for sibling in self.prefix_siblings.get(result.get('query'), []):
+                expanded.append({**result, 'query': sibling})
+        metrics.inc('prefix_inherited', len(expanded) - len(ip_results))
+        return expanded
+
+    def pending_for_api(self, limit: Optional[int] = None) -> List[str]:
+        """IPs pendentes que sobram para a API após base offline e cache de prefixos."""
+        return self.resolve_prefixes(self.resolve_offline(self.get_pending_ips(limit)))
+
     def process_pending_ips(self):
         """Processa TODOS os IPs pendentes, dividindo em batches automaticamente."""
-        pending_ips = self.get_pending_ips()
+        pending_ips = self.pending_for_api()
         
         if not pending_ips:
+            self.publish_changes()
             print("Nenhum IP pendente para processar")
             return
         
@@ -108,13 +641,294 @@ class IPEnricher:
             
             # Atualizar banco
             if results:
-                self.update_ip_data(results)
+                self.update_ip_data(self.expand_prefix_results(results))
                 success_count = len([r for r in results if r.get('status') == 'success'])
                 print(f"{success_count}/{len(batch)} IPs do batch processados com sucesso")
+            else:
+                self.mark_failed(batch)
             
             # Aguardar entre batches para respeitar rate limit (exceto no último)
             if batch_num < total_batches:
                 print(f"Aguardando {self.delay_between_requests}s antes do próximo batch...")
                 time.sleep(self.delay_between_requests)
         
+        self.publish_changes()
+        print(f"Processamento concluído! {total_ips} IPs processados em {total_batches} batches")
+
+
+def record_quota(headers):
+    """Registra nas métricas a cota restante informada pelo ip-api (X-Rl/X-Ttl)."""
+    for header, gauge in (('X-Rl', 'quota_remaining'), ('X-Ttl', 'quota_reset_seconds')):
+        value = headers.get(header)
+        if value is not None:
+            try:
+                metrics.set_gauge(gauge, int(value))
+            except ValueError:
+                pass
+
+
+class RateLimitedError(Exception):
+    """A API respondeu 429 (cota da janela esgotada)."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Falhas transitórias: rede, 429 e erros 5xx. Os demais 4xx não mudam com nova tentativa (e gastariam cota)."""
+    if isinstance(exc, (httpx.TransportError, RateLimitedError)):
+        return True
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code >= 500
+
+
+class HeaderRateLimiter:
+    """
+    Token bucket ajustado pelos cabeçalhos de rate limit do ip-api.
+
+    - X-Rl: requisições restantes na janela atual
+    - X-Ttl: segundos até a janela ser renovada
+
+    O bucket local nunca fica acima do que o servidor informa como restante, e é reabastecido
+    quando a janela expira.
+    """
+
+    def __init__(self, capacity: int = 15, window: float = 60):
+        self.capacity = capacity
+        self.window = window
+        self.tokens = capacity
+        self.reset_at = time.monotonic() + window
+        self._lock = None
+        self._loop = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        # O lock pertence ao event loop; o limitador sobrevive a várias chamadas de asyncio.run
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        return self._lock
+
+    async def acquire(self):
+        """Aguarda até haver cota e reserva uma requisição."""
+        async with self._get_lock():
+            while True:
+                now = time.monotonic()
+                if now >= self.reset_at:
+                    self.tokens = self.capacity
+                    self.reset_at = now + self.window
+
+                if self.tokens > 0:
+                    self.tokens -= 1
+                    return
+
+                wait = self.reset_at - now
+                metrics.inc('throttle_waits')
+                metrics.observe('throttle_wait_seconds', wait)
+                print(f"Cota esgotada, aguardando {wait:.1f}s pela renovação da janela...")
+                await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers):
+        """Sincroniza o bucket com X-Rl/X-Ttl da resposta."""
+        record_quota(headers)
+        remaining = headers.get('X-Rl')
+        ttl = headers.get('X-Ttl')
+
+        if ttl is not None:
+            try:
+                self.reset_at = time.monotonic() + int(ttl)
+            except ValueError:
+                pass
+
+        if remaining is not None:
+            try:
+                self.tokens = min(self.tokens, int(remaining))
+            except ValueError:
+                pass
+
+    def exhaust(self, ttl: Optional[str] = None):
+        """Zera a cota (ex.: após 429) até a próxima janela."""
+        self.tokens = 0
+        if ttl is not None:
+            try:
+                self.reset_at = time.monotonic() + int(ttl)
+            except ValueError:
+                pass
+
+
+class AsyncIPEnricher(IPEnricher):
+    """
+    Enriquecimento assíncrono: um único httpx.AsyncClient persistente, cota controlada pelos
+    cabeçalhos X-Rl/X-Ttl, batches em pipeline (gravação no banco em paralelo às próximas
+    consultas) e retry com backoff exponencial.
+    """
+
+    def __init__(self, max_concurrency: int = 2, max_attempts: int = 5, requests_per_window: int = 15,
+                 offline_provider: Optional[GeoIPProvider] = None, prefix_cache: Optional[PrefixCache] = None):
+        super().__init__(offline_provider=offline_provider, prefix_cache=prefix_cache)
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.rate_limiter = HeaderRateLimiter(capacity=requests_per_window)
+
+    async def _post_batch(self, client: httpx.AsyncClient, ip_list: List[str]) -> List[Dict]:
+        """Uma tentativa de consulta; levanta exceção para as falhas que merecem retry."""
+        await self.rate_limiter.acquire()
+
+        metrics.inc('api_requests')
+        metrics.inc('api_ips_sent', len(ip_list))
+        started = time.perf_counter()
+        response = await client.post(self.api_url, json=ip_list, params={"fields": self.fields})
+        metrics.observe('api_latency_seconds', time.perf_counter() - started)
+
+        if response.status_code == 429:
+            metrics.inc('throttle_429')
+            record_quota(response.headers)
+            self.rate_limiter.exhaust(response.headers.get('X-Ttl'))
+            raise RateLimitedError("ip-api retornou 429")
+
+        self.rate_limiter.update_from_headers(response.headers)
+        response.raise_for_status()
+        return response.json()
+
+    async def query_ip_api_async(self, client: httpx.AsyncClient, ip_list: List[str]) -> List[Dict]:
+        """
+        Consulta a API para lista de IPs, com retry e backoff nas falhas transitórias (is_retryable).
+
+        Nas demais falhas (ex.: 400, 403, 404) ou esgotadas as tentativas, retorna [] e o batch é reagendado.
+        """
+        if not ip_list:
+            return []
+
+        try:
+            async for attempt in AsyncRetrying(
+                stop=stop_after_attempt(self.max_attempts),
+                wait=wait_exponential(multiplier=1, min=1, max=60),
+                retry=retry_if_exception(is_retryable),
+                reraise=True
+            ):
+                with attempt:
+                    return await self._post_batch(client, ip_list)
+
+        except Exception as e:
+            metrics.inc('api_errors')
+            print(f"Erro na consulta IP: {e}")
+            return []
+
+    async def aprocess_pending_ips(self, limit: Optional[int] = None) -> int:
+        """
+        Processa os IPs pendentes com batches em pipeline.
+
+        Sem limit, processa TODOS; com limit, no máximo `limit` IPs (um ciclo do daemon).
+        Retorna quantos IPs foram enviados à API.
+        """
+        pending_ips = await asyncio.to_thread(self.pending_for_api, limit)
+
+        if not pending_ips:
+            await asyncio.to_thread(self.publish_changes)
+            print("Nenhum IP pendente para processar")
+            return 0
+
+        total_ips = len(pending_ips)
+        batches = [pending_ips[i:i + self.batch_size] for i in range(0, total_ips, self.batch_size)]
+        total_batches = len(batches)
+        print(f"Processando {total_ips} IPs em {total_batches} batches de até {self.batch_size} IPs")
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with httpx.AsyncClient(timeout=30) as client:
+
+            async def process_batch(batch_num, batch):
+                async with semaphore:
+                    results = await self.query_ip_api_async(client, batch)
+
+                # Gravação fora do semáforo: o próximo batch já pode ser consultado
+                if results:
+                    await asyncio.to_thread(lambda: self.update_ip_data(self.expand_prefix_results(results)))
+                    success_count = len([r for r in results if r.get('status') == 'success'])
+                    print(f"Batch {batch_num}/{total_batches}: {success_count}/{len(batch)} IPs processados com sucesso")
+                else:
+                    await asyncio.to_thread(self.mark_failed, batch)
+
+            await asyncio.gather(*(
+                process_batch(batch_num, batch)
+                for batch_num, batch in enumerate(batches, start=1)
+            ))
+
+        await asyncio.to_thread(self.publish_changes)
         print(f"Processamento concluído! {total_ips} IPs processados em {total_batches} batches")
+        return total_ips
+
+    def process_pending_ips(self):
+        """Versão síncrona (mesma interface do IPEnricher)."""
+        asyncio.run(self.aprocess_pending_ips())
+
+
+def prefix_accuracy_report(sample_size: int = 100, prefix_cache: Optional[PrefixCache] = None) -> Dict:
+    """
+    Mede a precisão do cache por prefixo: consulta individualmente no ip-api uma amostra de IPs
+    que não foram os representantes do seu prefixo e compara com o resultado herdado.
+
+    Consome uma requisição da cota do ip-api (amostra limitada a 100 IPs).
+    """
+    cache = prefix_cache or get_prefix_cache() or PrefixCache()
+    sample_size = max(1, min(sample_size, 100))
+
+    with get_session() as session:
+        candidates = [row[0] for row in session.query(IP.sender_ip).filter(
+            IP.enrichment_status == ENRICHMENT_DONE
+        ).order_by(func.rand()).limit(sample_size * 10).all()]
+
+        entries = dict(session.query(IPPrefixCache.prefix, IPPrefixCache.result).filter(
+            IPPrefixCache.prefix.in_({cache.prefix_of(ip) for ip in candidates} - {None})
+        ).all()) if candidates else {}
+
+    inherited = {}
+    for ip in candidates:
+        entry = entries.get(cache.prefix_of(ip))
+        if entry and entry.get('query') != ip:
+            inherited[ip] = entry
+        if len(inherited) >= sample_size:
+            break
+
+    if not inherited:
+        return {'sampled': 0}
+
+    individual = {r.get('query'): r for r in IPEnricher(prefix_cache=cache).query_ip_api(list(inherited)) if r.get('status') == 'success'}
+
+    compared = country_match = city_match = isp_match = 0
+    distances = []
+    mismatches = []
+    for ip, cached in inherited.items():
+        actual = individual.get(ip)
+        if not actual:
+            continue
+        compared += 1
+        country_match += cached.get('countryCode') == actual.get('countryCode')
+        city_match += cached.get('city') == actual.get('city')
+        isp_match += cached.get('isp') == actual.get('isp')
+        if None not in (cached.get('lat'), cached.get('lon'), actual.get('lat'), actual.get('lon')):
+            distances.append(haversine_km(cached['lat'], cached['lon'], actual['lat'], actual['lon']))
+        if cached.get('city') != actual.get('city'):
+            mismatches.append({'ip': ip, 'prefix': cache.prefix_of(ip), 'cache': cached.get('city'), 'individual': actual.get('city')})
+
+    if not compared:
+        return {'sampled': 0}
+
+    return {
+        'sampled': compared,
+        'country_match': country_match / compared,
+        'city_match': city_match / compared,
+        'isp_match': isp_match / compared,
+        'median_distance_km': median(distances) if distances else None,
+        'max_distance_km': max(distances) if distances else None,
+        'mismatches': mismatches
+    }
+
+
+if __name__ == '__main__':
+    # python -m extractor.ip_api_client prefix-report [amostra]
+    if len(sys.argv) > 1 and sys.argv[1] == 'prefix-report':
+        report = prefix_accuracy_report(int(sys.argv[2]) if len(sys.argv) > 2 else 100)
+        for key, value in report.items():
+            if key != 'mismatches':
+                print(f"{key}: {value}")
+        for mismatch in report.get('mismatches', []):
+            print(f"  {mismatch['ip']} ({mismatch['prefix']}): cache={mismatch['cache']} individual={mismatch['individual']}")
+    else:
+        print("Uso: python -m extractor.ip_api_client prefix-report [amostra]")
@@ -0,0 +1,173 @@
+"""
+conversation_aggregate_select (GROUP BY em SQL) contra a deduplicação original da página "Mensagens"
+(get_data_messages, agregação em Python sobre as linhas mensagem x destinatário).
+
+Roda em SQLite em memória e, quando TEST_DATABASE_URL estiver definida, também no MySQL.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, event, select, case
+
+from db.models import Base, Operation, Target, File, Message, MessageRecipient, operation_targets
+from db.conversation_stats import conversation_aggregate_select
+
+
+TABLES = ['operations', 'targets', 'operation_targets', 'files', 'messages', 'message_recipients']
+
+TARGET_A = '5561900000001'
+TARGET_B = '5561900000002'
+
+# (message_id, file_id, timestamp, sender, group_id, destinatários)
+MESSAGES = [
+    # Alvo A, arquivo 1: particular nos dois sentidos e grupo enviado/recebido
+    ('m01', 1, datetime(2024, 3, 1, 9, 0), TARGET_A, None, ['5561911111111']),
+    ('m02', 1, datetime(2024, 3, 1, 9, 5), '5561911111111', None, [TARGET_A]),
+    ('m03', 1, datetime(2024, 3, 2, 10, 0), TARGET_A, 'G1', ['5561922222222', '5561933333333', '5561944444444']),
+    ('m04', 1, datetime(2024, 3, 2, 10, 1), '5561922222222', 'G1', ['5561933333333', TARGET_A, '5561944444444']),
+    # Alvo A, arquivo 2: outros dias, vários destinatários, mensagem sem destinatários e grupo sem o alvo
+    ('m05', 2, datetime(2024, 3, 3, 8, 0), '5561922222222', 'G1', ['5561933333333', '5561944444444', TARGET_A]),
+    ('m06', 2, datetime(2024, 3, 3, 8, 30), TARGET_A, None, ['5561955555555', '5561966666666']),
+    ('m07', 2, datetime(2024, 3, 3, 9, 0), '5561911111111', None, []),
+    ('m08', 2, datetime(2024, 3, 4, 12, 0), TARGET_A, None, [TARGET_A]),
+    ('m09', 2, datetime(2024, 3, 4, 13, 0), '5561977777777', 'G2', ['5561933333333']),
+    ('m10', 2, datetime(2024, 3, 5, 23, 59), '5561911111111', None, [TARGET_A]),
+    # Alvo B, arquivo 3: conversa com o alvo A (não pode aparecer no resumo do A)
+    ('m11', 3, datetime(2024, 3, 1, 9, 0), TARGET_B, None, [TARGET_A]),
+    ('m12', 3, datetime(2024, 3, 2, 9, 0), TARGET_A, None, [TARGET_B]),
+    ('m13', 3, datetime(2024, 3, 2, 9, 30), TARGET_B, 'G1', ['5561922222222', TARGET_A]),
+]
+
+
+def _sqlite_concat(*values):
+    # CONCAT do MySQL: NULL se qualquer argumento for NULL
+    return None if any(value is None for value in values) else ''.join(str(value) for value in values)
+
+
+@pytest.fixture
+def sqlite_conn():
+    engine = create_engine('sqlite://', future=True)
+
+    @event.listens_for(engine, 'connect')
+    def register_concat(dbapi_conn, _):
+        dbapi_conn.create_function('concat', -1, _sqlite_concat)
+
+    Base.metadata.create_all(engine, tables=[Base.metadata.tables[name] for name in TABLES])
+    with engine.connect() as conn:
+        yield conn
+    engine.dispose()
+
+
+@pytest.fixture(params=['sqlite', 'mysql'])
+def conn(request):
+    conn = request.getfixturevalue('sqlite_conn' if request.param == 'sqlite' else 'mysql_conn')
+    seed(conn)
+    return conn
+
+
+def seed(conn):
+    conn.execute(Operation.__table__.insert(), [{'operation_id': 1, 'name': 'Operação teste'}])
+    conn.execute(Target.__table__.insert(), [
+        {'target_id': 1, 'target': TARGET_A},
+        {'target_id': 2, 'target': TARGET_B}
+    ])
+    conn.execute(operation_targets.insert(), [
+        {'operation_id': 1, 'target_id': 1},
+        {'operation_id': 1, 'target_id': 2}
+    ])
+    conn.execute(File.__table__.insert(), [
+        {'file_id': 1, 'operation_id': 1, 'target_id': 1, 'file_type': 'PRTT'},
+        {'file_id': 2, 'operation_id': 1, 'target_id': 1, 'file_type': 'PRTT'},
+        {'file_id': 3, 'operation_id': 1, 'target_id': 2, 'file_type': 'PRTT'}
+    ])
+    conn.execute(Message.__table__.insert(), [
+        {'message_id': message_id, 'file_id': file_id, 'timestamp': timestamp, 'sender': sender, 'group_id': group_id}
+        for message_id, file_id, timestamp, sender, group_id, _ in MESSAGES
+    ])
+    conn.execute(MessageRecipient.__table__.insert(), [
+        {'message_id': message_id, 'recipient_phone': recipient}
+        for message_id, _, _, _, _, recipients in MESSAGES
+        for recipient in recipients
+    ])
+    conn.commit()
+
+
+def baseline_conversations(conn, target_id, target_phone):
+    '''Cópia da deduplicação do get_data_messages original: {conversa: (contato, enviadas, recebidas)}'''
+    rows = conn.execute(
+        select(
+            Message.message_id,
+            Message.sender,
+            MessageRecipient.recipient_phone.label('recipient'),
+            Message.group_id,
+            case((Message.sender == target_phone, 1), else_=0).label('enviada'),
+            case((MessageRecipient.recipient_phone == target_phone, 1), else_=0).label('recebida')
+        ).select_from(Message).join(
+            File, Message.file_id == File.file_id
+        ).join(
+            MessageRecipient, Message.message_id == MessageRecipient.message_id
+        ).where(
+            File.operation_id == 1,
+            File.target_id == target_id
+        ).order_by(MessageRecipient.id)
+    ).all()
+
+    # Uma linha por mensagem: a última em que o alvo está envolvido (ou a primeira, se nenhuma)
+    unique_messages = {}
+    for r in rows:
+        if r.message_id not in unique_messages or r.enviada == 1 or r.recebida == 1:
+            unique_messages[r.message_id] = r
+
+    conversations = defaultdict(lambda: [None, 0, 0])
+    for r in unique_messages.values():
+        if r.group_id:
+            key, contact = f"GRUPO_{r.group_id}", 'Grupo'
+        else:
+            contact = r.recipient if r.sender == target_phone else r.sender
+            key = f"PARTICULAR_{contact}"
+
+        entry = conversations[key]
+        entry[0] = contact
+        entry[1] += r.enviada
+        entry[2] += r.recebida
+
+    return {key: tuple(entry) for key, entry in conversations.items()}
+
+
+def sql_conversations(conn, file_ids):
+    '''Resumo de conversation_aggregate_select somado por conversa (todos os dias e arquivos)'''
+    conversations = defaultdict(lambda: [None, 0, 0])
+    for row in conn.execute(conversation_aggregate_select(file_ids)).all():
+        entry = conversations[row.conversation_key]
+        entry[0] = row.contact
+        entry[1] += int(row.sent)
+        entry[2] += int(row.received)
+    return {key: tuple(entry) for key, entry in conversations.items()}
+
+
+@pytest.mark.parametrize('target_id, target_phone, file_ids', [
+    (1, TARGET_A, [1, 2]),
+    (2, TARGET_B, [3]),
+])
+def test_sql_aggregate_matches_original_dedup(conn, target_id, target_phone, file_ids):
+    expected = baseline_conversations(conn, target_id, target_phone)
+
+    assert sql_conversations(conn, file_ids) == expected
+
+
+def test_fixture_covers_the_dedup_cases(conn):
+    conversations = baseline_conversations(conn, 1, TARGET_A)
+
+    # Grupo com vários destinatários conta uma vez por mensagem
+    assert conversations['GRUPO_G1'] == ('Grupo', 1, 2)
+    # Grupo sem o alvo entre os destinatários entra com zero
+    assert conversations['GRUPO_G2'] == ('Grupo', 0, 0)
+    # Particular nos dois sentidos, em dias e arquivos diferentes (a mensagem sem destinatários fica de fora)
+    assert conversations['PARTICULAR_5561911111111'] == ('5561911111111', 1, 2)
+    # Particular para vários destinatários: contato é o último
+    assert conversations['PARTICULAR_5561966666666'] == ('5561966666666', 1, 0)
+    # Mensagem para si mesmo: enviada e recebida
+    assert conversations[f'PARTICULAR_{TARGET_A}'] == (TARGET_A, 1, 1)
+    # Mensagens do arquivo do alvo B não entram
+    assert f'PARTICULAR_{TARGET_B}' not in conversations
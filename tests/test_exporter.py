@@ -0,0 +1,80 @@
+"""
+Exportação em streaming: a origem deve ser consumida sob demanda, um bloco por vez.
+"""
+import pandas as pd
+
+from extractor.exporter import iter_chunks, export_rows
+
+
+class Source:
+    '''Origem que registra quantos itens já foram lidos'''
+
+    def __init__(self, items):
+        self.items = items
+        self.pulled = 0
+
+    def __iter__(self):
+        for item in self.items:
+            self.pulled += 1
+            yield item
+
+
+def frames(count, rows=3):
+    return [pd.DataFrame({'id': range(index * rows, (index + 1) * rows)}) for index in range(count)]
+
+
+def test_dataframe_blocks_are_pulled_one_at_a_time():
+    source = Source(frames(5))
+    chunks = iter_chunks(source, chunk_size=100)
+
+    first = next(chunks)
+    assert source.pulled == 1
+    assert first is source.items[0]
+
+    next(chunks)
+    assert source.pulled == 2
+
+    assert len(list(chunks)) == 3
+    assert source.pulled == 5
+
+
+def test_dicts_are_batched_by_chunk_size():
+    source = Source([{'id': index} for index in range(25)])
+    chunks = iter_chunks(source, chunk_size=10)
+
+    first = next(chunks)
+    assert len(first) == 10
+    assert source.pulled == 10
+
+    assert [len(df) for df in chunks] == [10, 5]
+
+
+def test_empty_source_yields_nothing():
+    assert list(iter_chunks(iter([]))) == []
+
+
+def test_csv_export_keeps_all_blocks(tmp_path):
+    target = tmp_path / 'saida.csv'
+    source = Source(frames(3))
+
+    assert export_rows(source, target, 'csv') == 9
+    assert pd.read_csv(target, encoding='utf-8-sig')['id'].tolist() == list(range(9))
+
+
+def test_xlsx_export_rolls_over_to_new_sheets(tmp_path):
+    from openpyxl import load_workbook
+
+    target = tmp_path / 'saida.xlsx'
+    rows = [{'id': index, 'nome': f'linha {index}'} for index in range(7)]
+
+    # max_rows inclui o cabeçalho: 2 linhas de dados por planilha
+    assert export_rows(iter(rows), target, 'xlsx', chunk_size=3, max_rows=3) == 7
+
+    workbook = load_workbook(target, read_only=True)
+    assert workbook.sheetnames == ['Dados', 'Dados (2)', 'Dados (3)', 'Dados (4)']
+
+    sheets = [list(workbook[name].iter_rows(values_only=True)) for name in workbook.sheetnames]
+    assert all(sheet[0] == ('id', 'nome') for sheet in sheets)
+    assert [len(sheet) - 1 for sheet in sheets] == [2, 2, 2, 1]
+    assert [row[0] for sheet in sheets for row in sheet[1:]] == list(range(7))
+    workbook.close()
@@ -0,0 +1,70 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, insert, select, and_
+
+from db.filters import time_range_filter
+from db.models import Operation, Target, File, Message, operation_targets
+
+
+TARGET_PHONE = '5561999990000'
+
+
+def _explain(conn, statement):
+    compiled = statement.compile(dialect=conn.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    return conn.exec_driver_sql(f"EXPLAIN {compiled}", params).mappings().all()
+
+
+def _messages_plan(conn, statement):
+    return next(row for row in _explain(conn, statement) if row['table'] == 'messages')
+
+
+def _seed(conn):
+    '''Dois arquivos com mensagens espalhadas por dois anos (o suficiente para o otimizador preferir o índice)'''
+    conn.execute(insert(Operation), [{'operation_id': 1, 'name': 'explain'}])
+    conn.execute(insert(Target), [{'target_id': 1, 'target': TARGET_PHONE}])
+    conn.execute(insert(operation_targets), [{'operation_id': 1, 'target_id': 1}])
+    conn.execute(insert(File), [
+        {'file_id': file_id, 'operation_id': 1, 'target_id': 1, 'file_type': 'PRTT'}
+        for file_id in (1, 2)
+    ])
+
+    start = datetime(2023, 1, 1)
+    conn.execute(insert(Message), [
+        {
+            'message_id': f'm{i}',
+            'file_id': 1 + i % 2,
+            'timestamp': start + timedelta(hours=3 * i),
+            'sender': TARGET_PHONE if i % 3 == 0 else f'55619{i % 50:08d}',
+        }
+        for i in range(6000)
+    ])
+    conn.exec_driver_sql("ANALYZE TABLE messages")
+
+
+def test_time_range_filter_uses_index_range_scan(mysql_conn):
+    _seed(mysql_conn)
+    period = (date(2023, 3, 1), date(2023, 3, 7))
+
+    by_file = select(Message.message_id, Message.sender_ip).where(
+        Message.file_id == 1,
+        time_range_filter(Message.timestamp, period)
+    )
+    plan = _messages_plan(mysql_conn, by_file)
+    assert plan['type'] == 'range'
+    assert plan['key'] == 'idx_messages_file_timestamp'
+
+    by_sender = select(Message.message_id, Message.sender_ip).where(
+        Message.sender == TARGET_PHONE,
+        time_range_filter(Message.timestamp, period)
+    )
+    plan = _messages_plan(mysql_conn, by_sender)
+    assert plan['type'] == 'range'
+    assert plan['key'] == 'idx_messages_sender_timestamp'
+
+    # A forma antiga (DATE(timestamp) entre as datas) não permite o range sobre o timestamp
+    legacy = select(Message.message_id, Message.sender_ip).where(
+        Message.file_id == 1,
+        and_(func.date(Message.timestamp) >= period[0], func.date(Message.timestamp) <= period[1])
+    )
+    assert _messages_plan(mysql_conn, legacy)['type'] != 'range'
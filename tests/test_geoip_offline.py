@@ -0,0 +1,110 @@
+"""
+Base GeoIP offline: busca por faixas no RangeIndex e lookup do OfflineGeoIPProvider a partir de um CSV.
+"""
+import pytest
+
+from extractor.ip_api_client import GeoIPProvider, OfflineGeoIPProvider, RangeIndex
+
+
+CSV_HEADER = 'ip_start,ip_end,continent,country,countryCode,city,lat,lon\n'
+
+CSV_ROWS = [
+    '1.0.0.0,1.0.0.255,Oceania,Australia,AU,Sydney,-33.8688,151.2093',
+    # Faixa vizinha (começa no endereço seguinte ao fim da anterior)
+    '1.0.1.0,1.0.3.255,Asia,China,CN,Fuzhou,26.0614,119.3061',
+    # Lacuna entre 1.0.4.0 e 1.0.7.255; faixa de um único endereço
+    '1.0.8.0,1.0.8.0,Asia,China,CN,Guangzhou,23.1291,113.2644',
+    '2001:db8::,2001:db8::ffff,South America,Brazil,BR,Brasília,-15.7801,-47.9292',
+]
+
+
+@pytest.fixture
+def provider(tmp_path):
+    path = tmp_path / 'geoip.csv'
+    path.write_text(CSV_HEADER + '\n'.join(CSV_ROWS) + '\n', encoding='utf-8')
+    return OfflineGeoIPProvider(str(path))
+
+
+def city(provider, ip):
+    result = provider.lookup([ip]).get(ip)
+    return result and result['city']
+
+
+@pytest.mark.parametrize('ip, expected', [
+    ('0.255.255.255', None),      # antes da primeira faixa
+    ('1.0.0.0', 'Sydney'),        # primeiro endereço
+    ('1.0.0.255', 'Sydney'),      # último endereço
+    ('1.0.1.0', 'Fuzhou'),        # início da faixa vizinha
+    ('1.0.3.255', 'Fuzhou'),
+    ('1.0.4.0', None),            # lacuna entre faixas
+    ('1.0.7.255', None),
+    ('1.0.8.0', 'Guangzhou'),     # faixa de um único endereço
+    ('1.0.8.1', None),            # depois da última faixa IPv4
+    ('2001:db8::', 'Brasília'),
+    ('2001:db8::ffff', 'Brasília'),
+    ('2001:db8::1:0', None),
+    ('2001:db7:ffff:ffff:ffff:ffff:ffff:ffff', None),
+    ('::100:5', None),            # mesmo valor inteiro de 1.0.0.5, mas IPv6
+    ('não é ip', None),
+])
+def test_range_boundaries(provider, ip, expected):
+    assert city(provider, ip) == expected
+
+
+def test_lookup_returns_ip_api_format_only_for_hits(provider):
+    results = provider.lookup(['1.0.0.10', '1.0.5.1', '2001:db8::abcd'])
+
+    assert set(results) == {'1.0.0.10', '2001:db8::abcd'}
+    assert results['1.0.0.10'] == {
+        'status': 'success',
+        'query': '1.0.0.10',
+        'continent': 'Oceania',
+        'country': 'Australia',
+        'countryCode': 'AU',
+        'regionName': None,
+        'city': 'Sydney',
+        'zip': None,
+        'lat': -33.8688,
+        'lon': 151.2093,
+        'timezone': None,
+        'isp': None,
+        'org': None,
+    }
+
+
+def test_range_index_shares_identical_records():
+    index = RangeIndex()
+    record = ('Asia', 'China', 'CN')
+    index.add('1.0.1.0', '1.0.3.255', record)
+    index.add('1.0.8.0', '1.0.8.0', record)
+    # Inseridas fora de ordem: build ordena antes da busca
+    index.add('1.0.0.0', '1.0.0.255', ('Oceania', 'Australia', 'AU'))
+    index.build()
+
+    assert len(index) == 3
+    assert len(index.records) == 2
+    assert index.find('1.0.0.0') == ('Oceania', 'Australia', 'AU')
+    assert index.find('1.0.8.0') == record
+
+
+def test_provider_interface_is_abstract():
+    with pytest.raises(TypeError):
+        GeoIPProvider()
+
+
+def test_dbip_csv_keeps_codes_out_of_name_columns(tmp_path):
+    path = tmp_path / 'dbip-city-lite.csv'
+    path.write_text(
+        '177.0.0.0,177.0.0.255,SA,BR,Distrito Federal,Brasília,-15.7801,-47.9292\n'
+        '2001:db8::,2001:db8::ffff,EU,DE,Berlin,Berlin,52.52,13.405\n',
+        encoding='utf-8'
+    )
+    results = OfflineGeoIPProvider(str(path)).lookup(['177.0.0.1', '2001:db8::1'])
+
+    # Mesmo formato do ip-api: nome do continente; o país fica só no código ISO
+    assert results['177.0.0.1']['continent'] == 'South America'
+    assert results['177.0.0.1']['country'] is None
+    assert results['177.0.0.1']['countryCode'] == 'BR'
+    assert results['177.0.0.1']['regionName'] == 'Distrito Federal'
+    assert results['177.0.0.1']['city'] == 'Brasília'
+    assert (results['2001:db8::1']['continent'], results['2001:db8::1']['countryCode']) == ('Europe', 'DE')
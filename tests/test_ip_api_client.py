@@ -0,0 +1,170 @@
+"""
+Cota do ip-api (X-Rl/X-Ttl, 429) e retry do AsyncIPEnricher contra um servidor simulado
+(httpx.MockTransport). O relógio do módulo e o asyncio.sleep são substituídos por um relógio
+fictício: as esperas são registradas e avançam o tempo sem dormir de verdade.
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from extractor import ip_api_client
+from extractor.ip_api_client import AsyncIPEnricher, HeaderRateLimiter
+
+
+IPS = ['8.8.8.8', '1.1.1.1']
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(seconds, *args, **kwargs):
+        if seconds > 0:
+            clock.sleeps.append(seconds)
+            clock.now += seconds
+        await real_sleep(0)
+
+    monkeypatch.setattr(ip_api_client, 'time', clock)
+    monkeypatch.setattr(asyncio, 'sleep', fake_sleep)
+    return clock
+
+
+@pytest.fixture
+def enricher(clock, monkeypatch):
+    monkeypatch.delenv('GEOIP_DB_PATH', raising=False)
+    monkeypatch.delenv('GEOIP_PREFIX_CACHE', raising=False)
+    return AsyncIPEnricher(max_attempts=4, requests_per_window=15)
+
+
+def success(ip_list):
+    return [{'status': 'success', 'query': ip, 'lat': 1.0, 'lon': 2.0} for ip in ip_list]
+
+
+class StubIPApi:
+    '''Servidor ip-api simulado: cada resposta vem de uma lista (status, X-Rl, X-Ttl) ou de uma exceção'''
+
+    def __init__(self, clock, responses):
+        self.clock = clock
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(self.clock.now)
+        step = self.responses.pop(0)
+        if isinstance(step, Exception):
+            raise step
+
+        status, remaining, ttl = step
+        headers = {'X-Rl': str(remaining), 'X-Ttl': str(ttl)}
+        if status != 200:
+            return httpx.Response(status, headers=headers)
+        return httpx.Response(200, headers=headers, json=success(IPS))
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self))
+
+
+def run_queries(enricher, stub, count=1):
+    async def main():
+        async with stub.client() as client:
+            return [await enricher.query_ip_api_async(client, IPS) for _ in range(count)]
+    return asyncio.run(main())
+
+
+def test_waits_for_window_when_server_reports_no_quota(clock, enricher):
+    stub = StubIPApi(clock, [(200, 0, 30), (200, 14, 60)])
+
+    first, second = run_queries(enricher, stub, count=2)
+
+    assert first == success(IPS) and second == success(IPS)
+    # X-Rl: 0 esgota o bucket local; a segunda requisição espera o X-Ttl informado
+    assert clock.sleeps == [30]
+    assert stub.requests[1] - stub.requests[0] == 30
+
+
+def test_local_bucket_never_exceeds_server_remaining(clock):
+    limiter = HeaderRateLimiter(capacity=15, window=60)
+    limiter.update_from_headers({'X-Rl': '2', 'X-Ttl': '20'})
+
+    async def main():
+        for _ in range(3):
+            await limiter.acquire()
+    asyncio.run(main())
+
+    # Duas requisições restantes na janela; a terceira espera os 20 s do X-Ttl
+    assert clock.sleeps == [20]
+
+
+def test_pauses_after_429_and_retries(clock, enricher):
+    stub = StubIPApi(clock, [(429, 0, 12), (200, 14, 60)])
+
+    [result] = run_queries(enricher, stub)
+
+    assert result == success(IPS)
+    assert len(stub.requests) == 2
+    # O 429 zera a cota até a janela informada; a nova tentativa só sai depois dela
+    assert stub.requests[1] - stub.requests[0] >= 12
+
+
+def test_retries_transport_and_server_errors_with_backoff(clock, enricher):
+    stub = StubIPApi(clock, [httpx.ConnectError('sem conexão'), (503, 14, 60), (200, 13, 60)])
+
+    [result] = run_queries(enricher, stub)
+
+    assert result == success(IPS)
+    assert len(stub.requests) == 3
+    # Backoff exponencial do tenacity entre as tentativas (1 s, depois 2 s)
+    assert clock.sleeps == [1, 2]
+
+
+@pytest.mark.parametrize('status', [400, 403, 404])
+def test_client_errors_are_not_retried(clock, enricher, status):
+    stub = StubIPApi(clock, [(status, 14, 60)])
+
+    [result] = run_queries(enricher, stub)
+
+    # Uma única requisição: repetir um 4xx só gastaria cota
+    assert result == []
+    assert len(stub.requests) == 1
+    assert clock.sleeps == []
+
+
+def test_client_error_batch_goes_to_mark_failed(clock, enricher, monkeypatch):
+    stub = StubIPApi(clock, [(403, 14, 60)])
+    failed = []
+    real_client = httpx.AsyncClient
+
+    monkeypatch.setattr(httpx, 'AsyncClient', lambda **kwargs: real_client(transport=httpx.MockTransport(stub), **kwargs))
+    monkeypatch.setattr(enricher, 'pending_for_api', lambda limit=None: list(IPS))
+    monkeypatch.setattr(enricher, 'mark_failed', failed.extend)
+    monkeypatch.setattr(enricher, 'publish_changes', lambda: None)
+
+    assert asyncio.run(enricher.aprocess_pending_ips()) == len(IPS)
+    assert failed == IPS
+    assert len(stub.requests) == 1
+
+
+def test_gives_up_after_max_attempts(clock, enricher):
+    stub = StubIPApi(clock, [(503, 14, 60)] * enricher.max_attempts)
+
+    [result] = run_queries(enricher, stub)
+
+    assert result == []
+    assert len(stub.requests) == enricher.max_attempts
@@ -0,0 +1,124 @@
+"""
+db.migrate sobre um banco no esquema antigo (colunas e tabelas novas removidas do esquema atual).
+
+Precisa do MySQL (TEST_DATABASE_URL); ao fim de cada teste o esquema volta ao atual pela própria migração.
+"""
+from sqlalchemy import text
+
+from db.migrate import (
+    migrate_geo_point, migrate_new_tables, migrate_enrichment_state, files_without_conversation_stats,
+    operations_without_metrics, NEW_TABLES, ENRICHMENT_COLUMNS, ENRICHMENT_INDEXES, _has_column, _has_index, _has_table
+)
+
+
+def _ips(conn):
+    return {
+        row.sender_ip: row
+        for row in conn.execute(text("""
+            SELECT sender_ip, ST_Latitude(geo_point) AS lat, ST_Longitude(geo_point) AS lon
+            FROM ips
+        """)).all()
+    }
+
+
+def test_geo_point_is_added_and_filled_from_coordinates(mysql_conn):
+    mysql_conn.execute(text("ALTER TABLE ips DROP COLUMN geo_point"))
+    mysql_conn.execute(text("""
+        INSERT INTO ips (sender_ip, latitude, longitude) VALUES
+            ('8.8.8.8', '-15.7801', '-47.9292'),
+            ('1.1.1.1', NULL, NULL)
+    """))
+    mysql_conn.commit()
+
+    migrate_geo_point(mysql_conn)
+    mysql_conn.commit()
+
+    assert _has_column(mysql_conn, 'ips', 'geo_point')
+    assert _has_index(mysql_conn, 'ips', 'idx_ips_geo_point')
+
+    ips = _ips(mysql_conn)
+    assert (ips['8.8.8.8'].lat, ips['8.8.8.8'].lon) == (-15.7801, -47.9292)
+    assert (ips['1.1.1.1'].lat, ips['1.1.1.1'].lon) == (0, 0)
+
+    # Segunda execução: nada a alterar
+    migrate_geo_point(mysql_conn)
+    mysql_conn.commit()
+    assert _ips(mysql_conn)['8.8.8.8'].lat == -15.7801
+
+
+def test_new_tables_are_created_and_backfill_targets_listed(mysql_conn):
+    for table_name in NEW_TABLES:
+        mysql_conn.execute(text(f"DROP TABLE {table_name}"))
+    mysql_conn.execute(text("INSERT INTO operations (operation_id, name) VALUES (1, 'antiga'), (2, 'vazia')"))
+    mysql_conn.execute(text("INSERT INTO targets (target_id, target) VALUES (1, '5561999990000')"))
+    mysql_conn.execute(text("INSERT INTO operation_targets (operation_id, target_id) VALUES (1, 1)"))
+    mysql_conn.execute(text("""
+        INSERT INTO files (file_id, operation_id, target_id, file_type) VALUES
+            (1, 1, 1, 'PRTT'), (2, 1, 1, 'PRTT'), (3, 1, 1, 'DADOS')
+    """))
+    mysql_conn.execute(text("""
+        INSERT INTO messages (message_id, file_id, timestamp, sender) VALUES
+            ('m1', 1, '2024-03-01 10:00:00', '5561999990000'),
+            ('m2', 3, '2024-03-01 11:00:00', '5561999990000')
+    """))
+    mysql_conn.commit()
+
+    migrate_new_tables(mysql_conn)
+    mysql_conn.commit()
+
+    assert all(_has_table(mysql_conn, table_name) for table_name in NEW_TABLES)
+    # Apenas arquivos PRTT com mensagens; todas as operações ainda sem snapshot
+    assert files_without_conversation_stats(mysql_conn) == [1]
+    assert operations_without_metrics(mysql_conn) == [1, 2]
+
+    mysql_conn.execute(text("""
+        INSERT INTO conversation_stats (file_id, conversation_key, day, sent, received)
+        VALUES (1, 'PARTICULAR_5561911111111', '2024-03-01', 1, 0)
+    """))
+    mysql_conn.execute(text("INSERT INTO operation_metrics (operation_id) VALUES (1)"))
+    mysql_conn.commit()
+
+    # Segunda execução: tabelas já existem e só falta o snapshot da operação 2
+    migrate_new_tables(mysql_conn)
+    assert files_without_conversation_stats(mysql_conn) == []
+    assert operations_without_metrics(mysql_conn) == [2]
+
+
+def _statuses(conn):
+    return dict(conn.execute(text("SELECT sender_ip, enrichment_status FROM ips")).all())
+
+
+def test_enrichment_state_is_added_and_backfilled(mysql_conn):
+    mysql_conn.execute(text(
+        "ALTER TABLE ips " + ", ".join(f"DROP COLUMN {column_name}" for column_name, _ in ENRICHMENT_COLUMNS)
+    ))
+    mysql_conn.execute(text("""
+        INSERT INTO ips (sender_ip, country, latitude, longitude) VALUES
+            ('8.8.8.8', 'United States', '37.751', '-97.822'),
+            ('1.1.1.1', NULL, NULL, NULL),
+            ('10.0.0.1', NULL, NULL, NULL),
+            ('224.0.0.1', NULL, NULL, NULL),
+            ('não é ip', NULL, NULL, NULL)
+    """))
+    mysql_conn.commit()
+
+    migrate_enrichment_state(mysql_conn)
+    mysql_conn.commit()
+
+    assert all(_has_column(mysql_conn, 'ips', column_name) for column_name, _ in ENRICHMENT_COLUMNS)
+    assert all(_has_index(mysql_conn, 'ips', index_name) for index_name, _ in ENRICHMENT_INDEXES)
+
+    expected = {
+        '8.8.8.8': 'DONE',        # já geolocalizado: não volta ao ip-api
+        '1.1.1.1': 'PENDING',     # público ainda sem dados
+        '10.0.0.1': 'PRIVATE',
+        '224.0.0.1': 'RESERVED',
+        'não é ip': 'INVALID',
+    }
+    assert _statuses(mysql_conn) == expected
+    assert mysql_conn.execute(text("SELECT enriched_at FROM ips WHERE sender_ip = '8.8.8.8'")).scalar() is not None
+
+    # Segunda execução: nada muda
+    migrate_enrichment_state(mysql_conn)
+    mysql_conn.commit()
+    assert _statuses(mysql_conn) == expected